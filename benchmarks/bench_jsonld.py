@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Jan 24 18:52:10 2021
+
+@author: jmr
+
+Micro-benchmark of the ClaimReview detection + extraction path: lxml check + extruct parse (previous path) vs the single pass byte level extractor.
+
+usage: python benchmarks/bench_jsonld.py [n_pages]
+"""
+from google_fc_helpers.claim_review_parser import claim_review_parser, select_claim_review
+from corpus import generate_corpus
+import time
+import sys
+import extruct
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    sys.exit('bench_jsonld.py compares against the former lxml path, install it with: pip install google-factCheck-helpers[bench]')
+
+class page:
+    def __init__(self, content):
+        self.content = content
+
+def legacy_path(content : bytes, url : str):
+    tree = lxml_html.fromstring(content)
+    if len(tree.xpath('//script[@type="application/ld+json" and contains(text(), "itemReviewed")]')) == 0:
+        return None
+    metadata = extruct.extract(content, base_url = url, syntaxes = ['json-ld'], uniform = True)['json-ld']
+    return select_claim_review(metadata)
+
+def fast_path(parser : claim_review_parser, content : bytes, url : str):
+    if not parser.check_claim_review(page(content)):
+        return None
+    return parser.parse_claim_review(html = content, url = url)
+
+def bench(name : str, fn, corpus : list):
+    start = time.perf_counter()
+    found = sum(1 for url, content in corpus if fn(content, url) is not None)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<8} pages={len(corpus):<6} claim_reviews={found:<6} elapsed={elapsed:.3f}s pages/sec={len(corpus) / elapsed:,.0f}')
+    return elapsed
+
+if __name__ == '__main__':
+    n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    corpus = generate_corpus(n_pages)
+    parser = claim_review_parser()
+    legacy = bench('legacy', legacy_path, corpus)
+    fast = bench('fast', lambda content, url: fast_path(parser, content, url), corpus)
+    print(f'speedup: {legacy / fast:.1f}x')
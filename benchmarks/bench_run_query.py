@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jan 18 22:02:31 2021
+
+@author: jmr
+
+Sequential vs concurrent claim_search.run_query against a local stub of the claims:search endpoint.
+Each run checks the number of records and of api calls against the stub's, so that a run whose calls failed or were retried does not report a timing.
+
+usage: python benchmarks/bench_run_query.py
+"""
+from google_fc_helpers.google_fc_wrapper import claim_search
+from stub_server import start_stub_server
+import time
+
+QUERIES = ['covid', 'vaccine', 'election', '5g']
+LANGUAGES = ['pt', 'es', 'en', 'de', 'fr']
+PAGE_SIZE = 10
+PAGES = 2
+
+def bench(server, max_workers : int, requests_per_second : float = None):
+    query = {
+        "key": 'bench-key-' + str(max_workers) + '-' + str(requests_per_second),
+        "query": QUERIES,
+        "languageCode": LANGUAGES,
+        "reviewPublisherSiteFilter": None,
+        "pageSize": PAGE_SIZE,
+        "maxAgeDays": 2
+        }
+    cs = claim_search(query = query, endpoint = server.endpoint)
+    hits = server.hits
+    start = time.perf_counter()
+    out = cs.run_query(max_workers = max_workers, requests_per_second = requests_per_second)
+    elapsed = time.perf_counter() - start
+    calls = server.hits - hits
+    expected_calls = len(QUERIES) * len(LANGUAGES) * PAGES
+    if len(out) != expected_calls * PAGE_SIZE or calls != expected_calls:
+        raise RuntimeError(f'max_workers={max_workers}: got {len(out)} records in {calls} api calls, expected {expected_calls * PAGE_SIZE} in {expected_calls}.')
+    print(f'max_workers={max_workers:<3} rps_cap={str(requests_per_second):<6} records={len(out):<5} calls={calls:<4} elapsed={elapsed:.2f}s calls/s={calls / elapsed:.1f}')
+
+if __name__ == '__main__':
+    server = start_stub_server(latency = 0.02, pages = PAGES)
+    try:
+        for workers in [1, 4, 8, 16]:
+            bench(server, workers)
+        bench(server, 16, requests_per_second = 50)
+    finally:
+        server.shutdown()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jan 26 21:30:02 2021
+
+@author: jmr
+
+Compiled extraction schema vs the previous eval based get_candidate_value, on a large synthetic record set.
+Only depends on the standard library and google_fc_helpers.extraction_schema.
+
+usage: python benchmarks/bench_schema.py [n_records]
+"""
+from google_fc_helpers.extraction_schema import CLAIM_REVIEW_SCHEMA
+from corpus import claim_review
+import random
+import time
+import sys
+
+def legacy_get_candidate_value(d : dict, key : str, candidate_expressions = None):
+    """ eval based lookup, as previously implemented in claim_review_parser """
+    try:
+        if d.get(key) is None:
+            out = None
+            if candidate_expressions is not None:
+                for candidate in candidate_expressions:
+                    exp = f'd{candidate}'
+                    try:
+                        result = eval(exp)
+                        if result is not None and len(result) > 0:
+                            out = result
+                            break
+                    except:
+                        pass
+        else:
+            out = d.get(key)
+    except:
+        out = None
+    return out
+
+def legacy_clean_claim_review(cr : dict):
+    get = legacy_get_candidate_value
+    rr_dict = get(cr, 'reviewRating')
+    ir_dict = get(cr, 'itemReviewed')
+    author = get(cr, 'author')
+    return dict(
+            claim_reviewed = get(cr, 'claimReviewed'),
+            review_rating_type = get(rr_dict, '@type'),
+            review_rating_value = get(rr_dict, 'ratingValue'),
+            review_rating_best = get(rr_dict, 'bestRating'),
+            review_rating_worst = get(rr_dict, 'worstRating'),
+            review_rating_alternate_name = get(rr_dict, 'alternateName'),
+            fact_check_url = get(cr, 'url'),
+            fact_check_date_published = get(cr, 'datePublished'),
+            fact_check_author_type = get(author, '@type'),
+            fact_check_author_id = get(author, '@id'),
+            fact_check_author_name = get(author, 'name'),
+            fact_check_author_url = get(author, 'url'),
+            fact_check_author_url_sameAs = get(author, 'sameAs', candidate_expressions = ['["sameAs"][0]']),
+            item_reviewed_url = get(ir_dict, 'url', candidate_expressions = ['["author"]["sameAs"]["url"]', '["author"]["sameAs"]', '["appearance"]', '["appearance"]["url"]', "['url']"]),
+            item_reviewed_date_published = get(ir_dict, 'datePublished', candidate_expressions = ['["author"]["datePublished"]', '["appearance"]["datePublished"]']),
+            item_reviewed_author_type = get(ir_dict, 'author.type', candidate_expressions = ['["author"]["@type"]', '["author"]["type"]']),
+            item_reviewed_author_name = get(ir_dict, 'author.name', candidate_expressions = ['["author"]["name"]'])
+            )
+
+def synthetic_records(n : int, seed : int = 1):
+    """ claim reviews with the item reviewed url in its different locations """
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        cr = claim_review(i, f'factcheck{i % 7}.example.org')
+        layout = rng.randrange(3)
+        if layout == 1:
+            cr['itemReviewed'].pop('url')
+            cr['itemReviewed']['appearance'] = [{'url': f'https://social.example.com/post/{i}', 'datePublished': '2021-01-01'}]
+        elif layout == 2:
+            cr['itemReviewed'].pop('url')
+            cr['itemReviewed']['author']['sameAs'] = f'https://social.example.com/user/{i}'
+        out.append(cr)
+    return out
+
+def bench(name : str, fn, records : list):
+    start = time.perf_counter()
+    for r in records:
+        fn(r)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<8} records={len(records):<8} elapsed={elapsed:.3f}s records/sec={len(records) / elapsed:,.0f}')
+    return elapsed
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    records = synthetic_records(n)
+    legacy = bench('eval', legacy_clean_claim_review, records)
+    compiled = bench('schema', CLAIM_REVIEW_SCHEMA.extract, records)
+    print(f'speedup: {legacy / compiled:.1f}x')
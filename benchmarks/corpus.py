@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Jan 24 18:20:44 2021
+
+@author: jmr
+
+Synthetic corpus of fact check pages, modeled on the ClaimReview layouts claim_review_parser handles.
+"""
+import json
+import random
+
+## filler markup, real fact check pages are mostly navigation, article body and tracking scripts
+FILLER = '<div class="paragraph"><p>' + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 8 + '</p><a href="/related">related</a></div>\n'
+
+def claim_review(n : int, domain : str):
+    return {
+        "@type": "ClaimReview",
+        "itemReviewed": {
+            "@type": "CreativeWork",
+            "url": f"https://social.example.com/post/{n}",
+            "datePublished": "2020-12-30",
+            "author": {"@type": "Organization", "name": "multiple sources"}
+        },
+        "author": {
+            "@type": "Organization",
+            "@id": f"https://{domain}/",
+            "name": "Fact Check",
+            "url": f"https://{domain}/",
+            "sameAs": [f"https://twitter.com/{domain}"]
+        },
+        "reviewRating": {"@type": "Rating", "ratingValue": "1", "bestRating": "5", "worstRating": "1", "alternateName": "FALSE"},
+        "claimReviewed": f"Claim number {n} went viral on social media",
+        "name": f"Fact check {n}",
+        "datePublished": "2021-01-05 05:00",
+        "url": f"https://{domain}/fact-check/{n}"
+        }
+
+def json_ld_variant(n : int, domain : str, variant : str):
+    """ The ld+json script blocks of a page, for a given layout variant """
+    article = '<script type="application/ld+json">' + json.dumps({"@context": "https://schema.org", "@type": "NewsArticle", "headline": f"Article {n}"}) + '</script>'
+    cr = claim_review(n, domain)
+    if variant == 'plain':
+        return article + '<script type="application/ld+json">' + json.dumps({"@context": "https://schema.org", **cr}) + '</script>'
+    if variant == 'graph':
+        return '<script type="application/ld+json">' + json.dumps({"@context": "https://schema.org", "@graph": [cr, {"@type": "WebPage"}]}) + '</script>'
+    if variant == 'list':
+        return "<script type='application/ld+json'>" + json.dumps([{"@type": "WebSite", "name": domain}, cr]) + '</script>'
+    if variant == 'commented':
+        return '<script type="application/ld+json">\n<!--\n' + json.dumps(cr) + '\n-->\n</script>'
+    if variant == 'malformed':
+        ## trailing comma, only extruct's lenient decoder copes with it
+        return '<script type="application/ld+json">' + json.dumps(cr)[:-1] + ',}</script>'
+    return article
+
+VARIANTS = ('plain', 'graph', 'list', 'commented', 'malformed', 'none')
+
+def fact_check_page(n : int, domain : str = 'factcheck.example.org', variant : str = 'plain', size : int = 60):
+    """ A full html page, size controls the number of filler paragraphs """
+    return (
+        '<!DOCTYPE html><html><head><title>Fact check</title>'
+        + '<script>window.dataLayer = window.dataLayer || [];</script>'
+        + json_ld_variant(n, domain, variant)
+        + '</head><body><nav>menu</nav>'
+        + FILLER * size
+        + '</body></html>'
+        ).encode('utf-8')
+
+def generate_corpus(n_pages : int, seed : int = 1, weights : tuple = (4, 4, 2, 1, 1, 3)):
+    """ List of (url, html bytes) tuples mixing the layout variants """
+    rng = random.Random(seed)
+    out = []
+    for n in range(n_pages):
+        domain = f'factcheck{n % 7}.example.org'
+        variant = rng.choices(VARIANTS, weights = weights)[0]
+        out.append((f'https://{domain}/fact-check/{n}', fact_check_page(n, domain, variant)))
+    return out
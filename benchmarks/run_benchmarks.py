@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jan 30 15:08:26 2021
+
+@author: jmr
+
+Offline benchmark suite. Starts the local stand-in server (stub_server.py) and reports throughput and latency percentiles for
+    * claim_search.run_query, sequential and concurrent, with a share of 429 responses
+    * async_claim_review_parser, at several batch sizes, with and without the pipelined parse stage
+    * the pure parsing path (claim_review_parser.parse_page), at several batch sizes
+
+usage: python benchmarks/run_benchmarks.py [--latency 0.02] [--error-rate 0.05] [--batch-sizes 50 200 1000]
+"""
+from google_fc_helpers.google_fc_wrapper import claim_search
+from google_fc_helpers.async_scraper import async_claim_review_parser
+from google_fc_helpers.claim_review_parser import parse_page
+from google_fc_helpers.retry import retry_policy
+from stub_server import start_stub_server
+from corpus import generate_corpus
+import argparse
+import statistics
+import time
+
+def percentiles(latencies : list):
+    """ p50, p90 and p99 in ms """
+    if len(latencies) < 2:
+        return (latencies or [0.0]) * 3
+    q = statistics.quantiles(latencies, n = 100, method = 'inclusive')
+    return [q[49] * 1000, q[89] * 1000, q[98] * 1000]
+
+def report(name : str, n : int, elapsed : float, latencies : list, unit : str = 'records'):
+    p50, p90, p99 = percentiles(latencies)
+    print(f'{name:<40} {unit}={n:<7} elapsed={elapsed:7.3f}s {unit}/sec={n / elapsed:10,.1f}  p50={p50:8.2f}ms p90={p90:8.2f}ms p99={p99:8.2f}ms')
+
+class timed_claim_search(claim_search):
+    """ claim_search recording the latency of each query combination """
+    def run_combination(self, pars : tuple, verbose = False, **kwargs):
+        start = time.perf_counter()
+        out = super().run_combination(pars, verbose = verbose, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        return out
+
+class timed_claim_review_parser(async_claim_review_parser):
+    """ async_claim_review_parser recording the latency of each fetch """
+    async def async_get_task(self, s, claim_dict : dict):
+        start = time.perf_counter()
+        out = await super().async_get_task(s = s, claim_dict = claim_dict)
+        self.latencies.append(time.perf_counter() - start)
+        return out
+
+def bench_run_query(server, max_workers : int):
+    query = {
+        "key": f'bench-key-{max_workers}',
+        "query": ['covid', 'vaccine', 'election', '5g'],
+        "languageCode": ['pt', 'es', 'en', 'de', 'fr'],
+        "reviewPublisherSiteFilter": None,
+        "pageSize": 20,
+        "maxAgeDays": 2
+        }
+    cs = timed_claim_search(query = query, endpoint = server.endpoint, retry = retry_policy(base_delay = 0.01, max_delay = 0.1), latencies = [])
+    start = time.perf_counter()
+    out = cs.run_query(max_workers = max_workers)
+    report(f'run_query max_workers={max_workers}', len(out), time.perf_counter() - start, cs.latencies)
+    print(f'{"":<40} retries={cs.retry.stats["retries"]}')
+    return out
+
+def bench_scraper(claims : list, batch_size : int, pipeline : bool):
+    batch = claims[:batch_size]
+    start = time.perf_counter()
+    scraper = timed_claim_review_parser(claim_dict_list = batch, pipeline = pipeline, max_per_domain = 8, latencies = [])
+    report(f'async_claim_review_parser pipeline={pipeline}', len(batch), time.perf_counter() - start, scraper.latencies, unit = 'pages')
+
+def bench_parsing(corpus : list, batch_size : int):
+    latencies = []
+    start = time.perf_counter()
+    for url, content in corpus[:batch_size]:
+        t = time.perf_counter()
+        parse_page(content, url)
+        latencies.append(time.perf_counter() - t)
+    report('parse_page', batch_size, time.perf_counter() - start, latencies, unit = 'pages')
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--latency', type = float, default = 0.02, help = 'server latency in secs')
+    argparser.add_argument('--error-rate', type = float, default = 0.05, help = 'share of 429 responses of the claims:search stub')
+    argparser.add_argument('--batch-sizes', type = int, nargs = '+', default = [50, 200, 1000])
+    args = argparser.parse_args()
+    print('### claim_search.run_query')
+    server = start_stub_server(latency = args.latency, pages = 3, error_rate = args.error_rate)
+    try:
+        for workers in [1, 8]:
+            claims = bench_run_query(server, workers)
+    finally:
+        server.shutdown()
+    print('\n### async_claim_review_parser')
+    server = start_stub_server(latency = args.latency, pages = max(args.batch_sizes) // 20 + 1)
+    try:
+        cs = claim_search(query = {"key": "bench-key-scraper", "query": ['covid', 'vaccine', 'election', '5g', 'antifa'], "languageCode": ['en', 'pt', 'de', 'es'], "reviewPublisherSiteFilter": None, "pageSize": 20}, endpoint = server.endpoint)
+        claims = cs.run_query(max_workers = 8)
+        for batch_size in args.batch_sizes:
+            for pipeline in [False, True]:
+                bench_scraper(claims, batch_size, pipeline)
+    finally:
+        server.shutdown()
+    print('\n### parsing path')
+    corpus = generate_corpus(max(args.batch_sizes))
+    for batch_size in args.batch_sizes:
+        bench_parsing(corpus, batch_size)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jan 18 21:40:55 2021
+
+@author: jmr
+
+Local stand-in for google's claims:search endpoint and for the fact check sites, used by the benchmarks.
+    * /v1alpha1/claims:search, paginated fake claims (nextPageToken), with configurable latency and share of 429 responses
+    * /fact-check/<n>, fact check page n of the synthetic corpus, see corpus.py
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from corpus import VARIANTS, fact_check_page
+import threading
+import zlib
+import random
+import json
+import time
+
+class stub_api_handler(BaseHTTPRequestHandler):
+
+    """ Serves paginated fake claims and fact check pages. Settings are read from the server instance."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_payload(self, status : int, payload : bytes, content_type : str, headers : dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        with self.server.lock:
+            self.server.hits += 1
+        time.sleep(self.server.latency)
+        if self.server.error_rate > 0 and random.random() < self.server.error_rate:
+            return self.send_payload(429, b'{"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}', 'application/json', {'Retry-After': str(self.server.retry_after)})
+        if parsed.path.endswith('claims:search'):
+            return self.claims_search(parsed)
+        if parsed.path.startswith('/fact-check/'):
+            return self.fact_check(parsed)
+        self.send_payload(404, b'not found', 'text/plain')
+
+    def claims_search(self, parsed):
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        page_size = int(params.get('pageSize', 10))
+        page = int(params.get('pageToken', 0))
+        base = self.server.base_url
+        claims = []
+        for i in range(page_size):
+            n = (zlib.crc32(f'{params.get("query")}|{params.get("languageCode")}'.encode('utf-8')) % 10000) * 1000 + page * page_size + i
+            claims.append({
+                'text': f'claim {n} about {params.get("query")}',
+                'claimant': 'social media',
+                'claimDate': '2021-01-06T18:16:03Z',
+                'claimReview': [{
+                    'publisher': {'name': 'Fact Check', 'site': f'factcheck{n % 7}.example.org'},
+                    'url': f'{base}/fact-check/{n}',
+                    'title': f'fact check {n}',
+                    'languageCode': params.get('languageCode')
+                    }]
+                })
+        body = {'claims': claims}
+        if page + 1 < self.server.pages:
+            body['nextPageToken'] = str(page + 1)
+        self.send_payload(200, json.dumps(body).encode('utf-8'), 'application/json')
+
+    def fact_check(self, parsed):
+        n = int(parsed.path.rstrip('/').split('/')[-1])
+        variant = random.Random(n).choices(VARIANTS, weights = (4, 4, 2, 1, 1, 3))[0]
+        page = fact_check_page(n, f'factcheck{n % 7}.example.org', variant, size = self.server.page_size)
+        self.send_payload(200, page, 'text/html; charset=utf-8')
+
+def start_stub_server(latency : float = 0.05, pages : int = 2, error_rate : float = 0.0, retry_after : float = 0, page_size : int = 60, port : int = 0):
+    """
+    Start the stub server in a background thread. Call server.shutdown() to stop it.
+    args:
+        latency: float, secs slept before answering any request
+        pages: int, number of pages returned by claims:search for any query
+        error_rate: float, share of requests answered with a 429
+        retry_after: float, Retry-After header of the 429 responses
+        page_size: int, number of filler paragraphs of the fact check pages
+        port: int, 0 picks a free port
+    returns:
+        the server, with .endpoint (claims:search url), .base_url and .hits attributes
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), stub_api_handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.pages = pages
+    server.error_rate = error_rate
+    server.retry_after = retry_after
+    server.page_size = page_size
+    server.hits = 0
+    server.lock = threading.Lock()
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.endpoint = f'{server.base_url}/v1alpha1/claims:search'
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
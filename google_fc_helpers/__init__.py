@@ -5,4 +5,25 @@ Created on Thu Jan  7 18:02:39 2021
 
 @author: jmr
 """
+import logging
 
+## quiet by default, applications opt in to the package's log messages by configuring logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+## main entry points, imported lazily so that `import google_fc_helpers` stays cheap
+_lazy_imports = {
+    'claim_search': 'google_fc_helpers.google_fc_wrapper',
+    'claim_review_parser': 'google_fc_helpers.claim_review_parser',
+    'async_claim_review_parser': 'google_fc_helpers.async_scraper',
+    'iter_claim_reviews': 'google_fc_helpers.async_scraper',
+    'claim_review_client': 'google_fc_helpers.async_scraper',
+    'async_claim_search': 'google_fc_helpers.async_wrapper',
+    'claim_pipeline': 'google_fc_helpers.pipeline'
+    }
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        import importlib
+        return getattr(importlib.import_module(_lazy_imports[name]), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
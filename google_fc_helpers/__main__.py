@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Feb 11 20:12:03 2021
+
+@author: jmr
+
+python -m google_fc_helpers, same as the gfc-helpers command
+"""
+import sys
+from google_fc_helpers.cli import main
+
+sys.exit(main())
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Feb 10 21:17:36 2021
+
+@author: jmr
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+
+class async_session:
+
+    """
+        Lightweight asynchronous GET session: a pooled requests.Session run on a thread pool.
+        Drop-in for the subset of requests_html.AsyncHTMLSession used by the scraper, without its browser/pyppeteer import chain.
+    """
+
+    def __init__(self, workers : int = 50, pool_connections : int = 50, pool_maxsize : int = 4):
+        """
+        Instantiate class async_session
+        args:
+            workers: int, number of threads running the blocking requests
+            pool_connections: int, number of hosts whose connections are kept in the pool
+            pool_maxsize: int, number of connections kept per host
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.thread_pool = ThreadPoolExecutor(max_workers = workers)
+
+    async def get(self, url : str, **kwargs):
+        """ asynchronous requests.Session.get """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, partial(self.session.get, url, **kwargs))
+
+    async def close(self):
+        self.thread_pool.shutdown(wait = False)
+        self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -5,11 +5,382 @@ Created on Wed Jan 13 17:18:21 2021
 
 @author: jmr
 """
-import requests_html
 import asyncio
-from google_fc_helpers.claim_review_parser import *
+import time
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+from google_fc_helpers.async_http import async_session
+from google_fc_helpers.claim_review_parser import parse_page
+from google_fc_helpers.instrumentation import default_registry, logger
+from google_fc_helpers.checkpoint import checkpoint_store
+from google_fc_helpers.sharding import claim_in_shard
 
-class async_claim_review_parser:
+class claim_review_client:
+    
+    """
+        Long-lived asynchronous claim review scraper: fetches the fact check pages of claims, parses and cleans their claim review.
+        Runs inside an existing event loop (async services, jupyter) and keeps its connection pool, concurrency caps and parsing processes across batches:
+
+            async with claim_review_client(max_per_domain = 4) as client:
+                records = await client.enrich(batch)
+                ...
+                records = await client.enrich(next_batch)
+    """
+    
+    ## maximum number of fetches in flight
+    max_concurrency = 50
+    ## maximum number of fetches in flight per fact check domain
+    max_per_domain = 4
+    ## request timeout in secs
+    timeout = 30
+    ## optional persistent http cache
+    cache = None
+    ## optional index of the claims already processed, for incremental runs
+    seen_index = None
+    ## extraction schema of the claim reviews, defaults to extraction_schema.CLAIM_REVIEW_SCHEMA
+    schema = None
+    ## pipelined mode: parse the pages in a process pool while the fetches are still running
+    pipeline = False
+    ## number of parsing processes in pipelined mode, defaults to the number of cores
+    parse_workers = None
+    ## maximum number of fetched pages waiting to be parsed in pipelined mode
+    queue_size = 100
+    ## keep the http responses in self.response_list
+    keep_responses = False
+    ## metrics registry and event hooks, see instrumentation.metrics_registry
+    metrics = default_registry
+    ## optional checkpoints of the scraped urls, and whether to resume from them
+    checkpoint = None
+    resume = False
+    ## optional shard "i/N" of the claim urls to scrape, see sharding
+    shard = None
+    ## optional negative cache of the domains without claim review, see domain_cache
+    domain_cache = None
+    ## optional compressed archive of the fetched pages, for offline re-parses, see page_archive
+    archive = None
+    
+    def __init__(self, **kwargs):
+        """ 
+        Instantiate class claim_review_client
+        kwargs:
+            max_concurrency: int, global cap on the number of concurrent fetches. Defaults to 50.
+            max_per_domain: int, cap on the number of concurrent fetches per fact_check_domain. Defaults to 4.
+            timeout: float, request timeout in secs. Defaults to 30.
+            cache: http_cache, persistent page cache. Fresh pages are served without a request, stale ones are revalidated with a conditional GET.
+            seen_index: seen_claim_index, incremental mode. Claims already enriched (same url and fingerprint) are skipped before any fetch and the processed ones are marked in the index.
+            schema: extraction_schema, output fields of the claim reviews.
+            pipeline: logical, parse each page in a process pool as soon as it is fetched instead of after all fetches. Defaults to False.
+            parse_workers: int, number of parsing processes in pipelined mode. Defaults to the number of cores.
+            queue_size: int, maximum number of fetched pages waiting to be parsed in pipelined mode. Defaults to 100.
+            keep_responses: logical, keep the raw http responses in self.response_list. Defaults to False.
+            metrics: metrics_registry, fetch latency per domain, parse time and failures. Defaults to instrumentation.default_registry.
+            checkpoint: checkpoint_store or str (path to its sqlite file), records every scraped claim url and its claim review as it is parsed.
+            resume: logical, skip the urls already recorded in checkpoint and reuse their claim review instead of starting over. Defaults to False. Within a job, later batches always reuse the claim reviews scraped by the earlier ones.
+            archive: page_archive, append every fetched page to a compressed archive, so that page_archive.reparse can apply new cleaning rules without scraping again.
+            domain_cache: domain_capability_cache, skip the pages of the domains whose recent pages had no claim review, re-probing them once the cache entry expires.
+            shard: str "i/N" or tuple (i, N), only scrape the claims whose fact_check_url falls in the i-th of N shards, e.g. when several workers share one claim list.
+        """
+        ## attrs: additional
+        for k in kwargs:
+            setattr(self, k, kwargs[k])
+        ## list to store the http responses
+        self.response_list  = []
+        ## fetch counters and achieved throughput
+        self.stats = dict(fetched = 0, cached = 0, skipped = 0, resumed = 0, failed = 0, parsed = 0, no_claim_review_domain = 0, batches = 0, elapsed = 0.0, pages_per_second = 0.0)
+        self._session = None
+        self._executor = None
+        self._semaphore = None
+    
+    ### lifecycle
+    async def start(self):
+        """ Open the session, the concurrency caps, the checkpoint store and, in pipelined mode, the parsing processes. Called by enrich if needed."""
+        if self.started:
+            return self
+        self._session = self.session()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._domain_semaphores = {}
+        ## checkpoint path to store
+        self.checkpoint = checkpoint_store.open(self.checkpoint)
+        ## a new job starts from scratch, later batches reuse the claim reviews scraped so far
+        if self.checkpoint is not None and not self.resume:
+            self.checkpoint.reset(api = False, scraped = True)
+        if self.pipeline:
+            self.parse_workers = self.parse_workers or os.cpu_count() or 1
+            self._executor = ProcessPoolExecutor(max_workers = self.parse_workers)
+        return self
+    
+    @property
+    def started(self):
+        """ Whether the session is open, i.e. start was called and close was not """
+        return self._session is not None
+    
+    async def close(self):
+        """ Close the session and the parsing processes, and commit the pages archived so far. The cache, archive and indexes are left open for their owner to close."""
+        if self.archive is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.archive.sync)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+    
+    async def __aenter__(self):
+        return await self.start()
+    
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    ### Retrieving the missing claimReview data from the FC websites
+    def session(self):
+        """ Start an asynchronous session. Connections are pooled and reused per host, up to max_per_domain of them."""
+        return async_session(workers = self.max_concurrency, pool_connections = self.max_concurrency, pool_maxsize = self.max_per_domain)
+    
+    @staticmethod
+    def claim_domain(claim_dict : dict):
+        """ Domain used for per domain politeness, the fact_check_domain or the host of the fact_check_url """
+        return claim_dict.get('fact_check_domain') or urlparse(claim_dict['fact_check_url']).netloc
+    
+    def domain_semaphore(self, domain : str):
+        """ Fetch (or create) the semaphore capping the concurrent fetches to a given domain """
+        if domain not in self._domain_semaphores:
+            self._domain_semaphores[domain] = asyncio.Semaphore(self.max_per_domain)
+        return self._domain_semaphores[domain]
+    
+    ## asynchronous get requests for fetching the claimReviews from the websites
+    async def async_get_task(self, s: async_session, claim_dict : dict):
+        """ asynchronous http get request, bounded by the global and the per domain caps """
+        if 'fact_check_url' in claim_dict.keys():
+            url = claim_dict['fact_check_url']
+            domain = self.claim_domain(claim_dict)
+            ## the sqlite calls (domain cache, http cache, archive) run on the default thread pool, off the event loop
+            loop = asyncio.get_running_loop()
+            ## domains known not to embed claim reviews
+            if self.domain_cache is not None and not await loop.run_in_executor(None, self.domain_cache.should_fetch, domain):
+                self.stats['no_claim_review_domain'] += 1
+                self.metrics.inc('domain_cache_skips_total', domain = domain)
+                return None
+            ## serve fresh pages from the cache, revalidate stale ones
+            entry, headers = None, {}
+            if self.cache is not None:
+                cached, entry = await loop.run_in_executor(None, self.cache.lookup, url)
+                if cached is not None:
+                    self.stats['cached'] += 1
+                    if self.archive is not None:
+                        await loop.run_in_executor(None, self.archive_page, url, cached)
+                    return [cached, claim_dict]
+                headers = self.cache.conditional_headers(entry)
+            async with self._semaphore, self.domain_semaphore(domain):
+                start = time.perf_counter()
+                try:
+                    response = await s.get(url, headers = headers, timeout = self.timeout)
+                    if self.cache is not None:
+                        response = await loop.run_in_executor(None, self.cache.update, url, entry, response)
+                    if self.archive is not None:
+                        await loop.run_in_executor(None, self.archive_page, url, response)
+                    self.stats['fetched'] += 1
+                    self.metrics.observe('fetch_seconds', time.perf_counter() - start, domain = domain)
+                    self.metrics.emit('fetch', url = url, domain = domain, status_code = response.status_code, elapsed = time.perf_counter() - start)
+                    ## error pages are not parsed
+                    if not 200 <= response.status_code < 300:
+                        self.stats['failed'] += 1
+                        self.metrics.inc('fetch_failures_total', domain = domain)
+                        logger.warning('HTTP %s when fetching %s, the page is not parsed.', response.status_code, url)
+                        return None
+                    return [response, claim_dict]
+                except Exception as err:
+                    self.stats['failed'] += 1
+                    self.metrics.inc('fetch_failures_total', domain = domain)
+                    self.metrics.emit('fetch_failure', url = url, domain = domain, error = str(err))
+                    logger.warning('When fetching the html of %s. Got the following error: %s', url, err)
+    
+    def archive_page(self, url : str, response):
+        """ Append a 200 page to the archive, so that it holds every page parsed. Pages served by the http cache are only appended if the archive does not have them yet."""
+        if response.status_code != 200:
+            return
+        if getattr(response, 'from_cache', False) and url in self.archive:
+            return
+        self.archive.append(url, response.content)
+    
+    def merge(self, claim_dict : dict, cleaned : dict = None, elapsed : float = None):
+        """ Combine the api claim with its cleaned claim review. None if the page does not use the claim review schema."""
+        if elapsed is not None:
+            self.metrics.observe('parse_seconds', elapsed)
+        if cleaned is None:
+            self.metrics.inc('pages_without_claim_review_total')
+            return None
+        if len(cleaned) == 0:
+            self.metrics.inc('parse_failures_total')
+            self.metrics.emit('parse_failure', url = claim_dict.get('fact_check_url'))
+        self.stats['parsed'] += 1
+        return {**claim_dict, **cleaned}
+    
+    @staticmethod
+    def processed(response, cleaned : dict = None):
+        """ Whether a claim is done with, i.e. its page was fetched with a 200 and parsed (with or without a claim review) """
+        return response.status_code == 200 and (cleaned is None or len(cleaned) > 0)
+    
+    def record_processed(self, claim_dict : dict, response, cleaned : dict = None):
+        """ Record whether the domain of a 200 page embeds claim reviews, and checkpoint the claim review of a claim which is done with.
+        Fetch and parse failures are not checkpointed, so that a resumed job retries them. Writes to sqlite, the coroutines run it on the default thread pool.
+        returns:
+            logical, whether the claim is done with, see processed
+        """
+        if self.domain_cache is not None and response.status_code == 200:
+            self.domain_cache.record(self.claim_domain(claim_dict), has_claim_review = cleaned is not None)
+        if not self.processed(response, cleaned):
+            return False
+        if self.checkpoint is not None:
+            self.checkpoint.save_scraped(claim_dict['fact_check_url'], cleaned)
+        return True
+    
+    def fail(self, claim_dict : dict, err : Exception):
+        """ Record a parse stage error """
+        self.metrics.inc('parse_failures_total')
+        self.metrics.emit('parse_failure', url = claim_dict.get('fact_check_url'), error = str(err))
+        logger.warning('Error occurred in the async claim review parser: %s.', err)
+    
+    async def claim_review_pipeline(self, s: async_session, claim_dict_list : list, executor : ProcessPoolExecutor, n_workers : int):
+        """ 
+        Pipelined mode. Each fetched page is handed to a process pool parsing stage as soon as it arrives, at most queue_size pages wait to be parsed.
+        args:
+            executor: ProcessPoolExecutor, the parsing processes
+            n_workers: int, number of parsing processes of executor, one parse task is kept in flight per process
+        returns:
+            tuple, (merged records in the order of claim_dict_list, None where the page has no claim review; claim dicts whose page was fetched and parsed, see processed)
+        """
+        loop = asyncio.get_running_loop()
+        ## bounded hand over between the fetch and the parse stages
+        queue = asyncio.Queue(maxsize = self.queue_size)
+        slots = asyncio.Semaphore(self.queue_size)
+        out = [None] * len(claim_dict_list)
+        done = []
+        async def fetch_stage(i : int, claim_dict : dict):
+            ## back pressure, do not fetch more pages than the parse stage can hold
+            await slots.acquire()
+            task_list = await self.async_get_task(s = s, claim_dict = claim_dict)
+            if task_list is None:
+                slots.release()
+            else:
+                await queue.put((i, task_list))
+        async def parse_stage():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                i, (response, claim_dict) = item
+                if self.keep_responses:
+                    self.response_list.append(response)
+                try:
+                    ## includes the wait for a free worker
+                    start = time.perf_counter()
+                    cleaned = await loop.run_in_executor(executor, parse_page, response.content, claim_dict['fact_check_url'], self.schema)
+                    out[i] = self.merge(claim_dict, cleaned, time.perf_counter() - start)
+                    if await loop.run_in_executor(None, self.record_processed, claim_dict, response, cleaned):
+                        done.append(claim_dict)
+                except Exception as err:
+                    self.fail(claim_dict, err)
+                finally:
+                    slots.release()
+        parsers = [asyncio.ensure_future(parse_stage()) for _ in range(n_workers)]
+        await asyncio.gather(*[fetch_stage(i, d) for i, d in enumerate(claim_dict_list)])
+        for _ in parsers:
+            await queue.put(None)
+        await asyncio.gather(*parsers)
+        return out, done
+    
+    async def enrich_claim(self, claim_dict : dict):
+        """
+        Fetch, parse and clean the claim review of a single claim, e.g. as the claims stream in from the api
+        args:
+            claim_dict: dict, a claim as returned by claim_search
+        returns:
+            the enriched claim, None if its page could not be fetched or has no claim review
+        """
+        await self.start()
+        task_list = await self.async_get_task(s = self._session, claim_dict = claim_dict)
+        if task_list is None:
+            return None
+        response = task_list[0]
+        if self.keep_responses:
+            self.response_list.append(response)
+        try:
+            start = time.perf_counter()
+            if self._executor is None:
+                cleaned = parse_page(response.content, claim_dict['fact_check_url'], self.schema)
+            else:
+                cleaned = await asyncio.get_running_loop().run_in_executor(self._executor, parse_page, response.content, claim_dict['fact_check_url'], self.schema)
+            out = self.merge(claim_dict, cleaned, time.perf_counter() - start)
+        except Exception as err:
+            self.fail(claim_dict, err)
+            return None
+        ## only a claim whose page was fetched and parsed is done with, the sqlite writes run off the event loop
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self.record_processed, claim_dict, response, cleaned) and self.seen_index is not None:
+            await loop.run_in_executor(None, self.seen_index.mark, [claim_dict])
+        return out
+    
+    async def enrich(self, claim_dict_list : list):
+        """
+        Enrich a batch of claims: fetch their fact check pages, then parse and clean the claim reviews. The session and the parsing processes are kept for the next batch.
+        args:
+            claim_dict_list: list of claim dictionaries obtained from google_fct_wrapper.run_query()
+        returns:
+            list of the enriched claims, the claims whose page has no claim review are left out
+        """
+        await self.start()
+        batch_start = time.perf_counter()
+        ## the sqlite calls (seen index, checkpoint) run on the default thread pool, off the event loop
+        loop = asyncio.get_running_loop()
+        ## incremental mode, skip the claims already enriched
+        if self.shard is not None:
+            claim_dict_list = [d for d in claim_dict_list if claim_in_shard(d, self.shard)]
+        if self.seen_index is not None:
+            n_claims = len(claim_dict_list)
+            claim_dict_list = await loop.run_in_executor(None, self.seen_index.filter_new, claim_dict_list)
+            self.stats['skipped'] += n_claims - len(claim_dict_list)
+        ## checkpoints, reuse the claim reviews of the urls already scraped
+        resumed, resumed_claims = [], []
+        if self.checkpoint is not None:
+            done = await loop.run_in_executor(None, self.checkpoint.scraped, [d.get('fact_check_url') for d in claim_dict_list])
+            resumed_claims = [d for d in claim_dict_list if d.get('fact_check_url') in done]
+            resumed = [{**d, **done[d['fact_check_url']]} if done[d['fact_check_url']] is not None else None for d in resumed_claims]
+            claim_dict_list = [d for d in claim_dict_list if d.get('fact_check_url') not in done]
+            self.stats['resumed'] += len(resumed)
+        if self._executor is not None:
+            out, parsed_claims = await self.claim_review_pipeline(s = self._session, claim_dict_list = claim_dict_list, executor = self._executor, n_workers = self.parse_workers)
+        else:
+            ## fetch the data async
+            raw = await asyncio.gather(*[self.async_get_task(s = self._session, claim_dict = d) for d in claim_dict_list])
+            ## fetch and clean the claim_review_data
+            out, parsed_claims = [], []
+            for task_list in raw:
+                if task_list is None:
+                    continue
+                response, claim_dict = task_list
+                if self.keep_responses:
+                    self.response_list.append(response)
+                try:
+                    start = time.perf_counter()
+                    cleaned = parse_page(response.content, claim_dict['fact_check_url'], self.schema)
+                    out.append(self.merge(claim_dict, cleaned, time.perf_counter() - start))
+                    if await loop.run_in_executor(None, self.record_processed, claim_dict, response, cleaned):
+                        parsed_claims.append(claim_dict)
+                except Exception as err:
+                    self.fail(claim_dict, err)
+        ## mark the claims whose page was fetched and parsed as processed, the failed ones are retried by the next run
+        if self.seen_index is not None:
+            await loop.run_in_executor(None, self.seen_index.mark, resumed_claims + parsed_claims)
+        elapsed = time.perf_counter() - batch_start
+        self.stats['batches'] += 1
+        self.stats['elapsed'] += elapsed
+        if self.stats['elapsed'] > 0:
+            self.stats['pages_per_second'] = self.stats['fetched'] / self.stats['elapsed']
+        self.metrics.observe('enrich_batch_seconds', elapsed)
+        return [d for d in resumed + out if d is not None]
+
+class async_claim_review_parser(claim_review_client):
     
     """ Instantiate async_claim_review_parser class. Runs an asynchronous scraper and returns the HTTP responses."""
     
@@ -19,75 +390,48 @@ class async_claim_review_parser:
         Instantiate class fetch_metadata. 
         args:
             claim_dict_list : list of claim dictionaries obtained from google_fct_wrapper.run_query()
+        kwargs:
+            see claim_review_client, e.g. max_concurrency, max_per_domain, cache, seen_index, pipeline, checkpoint or resume.
         returns:
             list of response objects or with claim_review_dictionaries
         """
+        super().__init__(**kwargs)
         self.claim_dict_list = claim_dict_list
-        ## attrs: additional
-        for k in kwargs:
-            setattr(self, k, kwargs[k])
-        ## list to store the http responses
-        self.response_list  = []
         ## list to store the cr dicts
         self.data = []
         ### run the async scraper
         return asyncio.run(self.claim_review_async())
-
-    ### Retrieving the missing claimReview data from the FC websites
-    ## asynchronous get requests for fetching the claimReviews from the websites
-    async def async_get_task(self, s: requests_html.AsyncHTMLSession, claim_dict : dict):
-        """ asynchronous http get request """
-        if 'fact_check_url' in claim_dict.keys():
-            url = claim_dict['fact_check_url']
-            try:
-                response = await s.get(url)
-                return [response, claim_dict]
-            except Exception as err:
-                print(f'When fetching the html of {url}. Got the following error: {err}')
-                pass
     
     async def claim_review_async(self):
         """ Run the scrapers asynchronously. Then clean and parse the claim review objects"""
-        ## start an asyncronous session
-        s = requests_html.AsyncHTMLSession()
-        ## define the tasks
-        tasks = []
-        ## fetch the urls
-        for d in self.claim_dict_list:
-            tasks.append(self.async_get_task(s = s, claim_dict = d))
-        ## fetch the data async
-        raw = await asyncio.gather(*tasks)
-        ## fetch and clean the claim_review_data
-        # instantiate a parser
-        parser = claim_review_parser()
-        out = []
-        for task_list, url in zip(raw, self.claim_dict_list):
-            try:
-                response = task_list[0]
-                self.response_list.append(response)
-                if parser.check_claim_review(response):
-                    parsed_html = response.content
-                    try:
-                        parsed_cr = parser.parse_claim_review(html = parsed_html, url = url)
-                        print(parsed_cr)
-                    except Exception as err:
-                        print(f'Error occurred in the async claim review parser: {err}.')
-                        parsed_cr = None
-                        pass
-                    if parsed_cr is not None:
-                        cleaned = parser.clean_claim_review(cr = parsed_cr)
-                        ## combine the dictionaries
-                        new_d = {**task_list[1], **cleaned}
-                        ## append
-                        out.append(new_d)
-                    else:
-                        out.append(task_list[1])
-            except:
-                pass
-        ## assign to attrivute
-        self.data = out
-            
-
-
-
+        async with self:
+            ## assign to attrivute
+            self.data = await self.enrich(self.claim_dict_list)
 
+def iter_claim_reviews(claims, batch_size : int = 500, **kwargs):
+    """
+    Stream the claim review enrichment. Consumes an iterable of claim dicts (e.g. claim_search.iter_query()) batch by batch and yields the enriched records,
+    so that memory is bounded by batch_size instead of the size of the result set.
+    args:
+        claims: iterable of claim dictionaries
+        batch_size: int, number of claims scraped at once
+        kwargs: passed on to claim_review_client, e.g. max_concurrency, cache, seen_index or pipeline
+    returns:
+        generator of dictionaries
+    """
+    ## one client, and so one connection pool, for every batch, run on a private event loop
+    client = claim_review_client(**kwargs)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(client.start())
+        batch = []
+        for claim in claims:
+            batch.append(claim)
+            if len(batch) >= batch_size:
+                yield from loop.run_until_complete(client.enrich(batch))
+                batch = []
+        if len(batch) > 0:
+            yield from loop.run_until_complete(client.enrich(batch))
+    finally:
+        loop.run_until_complete(client.close())
+        loop.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Feb 17 19:34:12 2021
+
+@author: jmr
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from google_fc_helpers.google_fc_wrapper import claim_search
+from google_fc_helpers.instrumentation import logger
+
+class async_claim_search(claim_search):
+
+    """
+        asyncio-native claim search client. The combinations are paginated concurrently and the cleaned, tagged claims are yielded as each page arrives,
+        instead of once every combination is done. Takes the same query and kwargs as claim_search.
+    """
+
+    async def fetch_page(self, querystring : dict, verbose = False, max_retries = None, requests_per_second = None, executor : ThreadPoolExecutor = None):
+        """ Request and parse one page, the blocking call (rate limiter, key pool, retries) runs on executor, defaults to the event loop's
+        returns:
+            the parsed page, None if the call failed
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        response = await loop.run_in_executor(executor, partial(self.request_page, dict(querystring), verbose = verbose, max_retries = max_retries, requests_per_second = requests_per_second))
+        if response is None:
+            return None
+        return self.read_page(querystring, response, time.perf_counter() - start)
+
+    async def iter_combination(self, pars : tuple, verbose = False, checkpoint = None, overrides = None, planner = None, requests_per_second = None, executor : ThreadPoolExecutor = None):
+        """ Paginate one (query, languageCode, reviewPublisherSiteFilter) combination. See claim_search.run_combination for the arguments, executor runs the blocking calls.
+        returns:
+            async generator of lists of dictionaries, the cleaned claims of each page
+        """
+        query, pars_to_add = self.query_for(pars, overrides)
+        pages, n_claims, complete = 0, 0, False
+        ## resume from the checkpoint
+        if checkpoint is not None:
+            state = checkpoint.combination(pars, overrides)
+            if state is not None:
+                n_claims += len(state['claims'])
+                if len(state['claims']) > 0:
+                    yield self.tag(state['claims'], pars_to_add)
+                complete = state['done']
+                query['pageToken'] = state['page_token']
+        ## pagination loop
+        while not complete:
+            page = await self.fetch_page(query, verbose = verbose, requests_per_second = requests_per_second, executor = executor)
+            if page is None:
+                break
+            pages += 1
+            claims = page.get('claims', [])
+            token = page.get('nextPageToken')
+            n_claims += len(claims)
+            if checkpoint is not None:
+                checkpoint.save_page(pars, claims, token, overrides)
+            if len(claims) > 0:
+                yield self.tag(claims, pars_to_add)
+            complete = token is None
+            query['pageToken'] = token
+        if planner is not None:
+            planner.record(pars, claims = n_claims, pages = pages, complete = complete)
+        if not complete:
+            self.record_incomplete(pars)
+        if n_claims == 0:
+            self.metrics.inc('api_empty_combinations_total')
+            logger.info('No data retrieved for the query: %s', pars_to_add)
+
+    async def iter_claims(self, verbose = False, max_workers = 4, requests_per_second = None, seen_index = None, checkpoint = None, resume = False, shard = None, planner = None, queue_size = 100):
+        """ Run multiple claim search calls concurrently, yielding the cleaned claims page by page as they arrive. See claim_search.run_query for the arguments.
+        args:
+            max_workers: int, number of combinations paginated concurrently. Defaults to 4.
+            queue_size: int, maximum number of pages waiting to be consumed. Defaults to 100.
+        returns:
+            async generator of dictionaries, in order of arrival
+        """
+        plan, checkpoint, planner = self.plan(checkpoint = checkpoint, resume = resume, shard = shard, planner = planner)
+        max_workers = max(1, max_workers or 1)
+        ## one thread per concurrent combination, for the blocking api calls
+        executor = ThreadPoolExecutor(max_workers = max_workers)
+        queue = asyncio.Queue(maxsize = queue_size)
+        steps = iter(plan)
+        async def worker():
+            for pars, overrides in steps:
+                async for claims in self.iter_combination(pars, verbose = verbose, checkpoint = checkpoint, overrides = overrides, planner = planner, requests_per_second = requests_per_second, executor = executor):
+                    await queue.put(claims)
+        async def workers():
+            try:
+                await asyncio.gather(*[worker() for _ in range(max_workers)])
+            finally:
+                await queue.put(None)
+        producer = asyncio.ensure_future(workers())
+        try:
+            while True:
+                claims = await queue.get()
+                if claims is None:
+                    break
+                ## incremental mode, drop the claims already processed
+                if seen_index is not None:
+                    claims = seen_index.filter_new(claims)
+                for claim in claims:
+                    yield claim
+            ## raise the errors of the api stage
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+            executor.shutdown(wait = False)
+        self.report_incomplete()
+        if planner is not None:
+            logger.info(planner.report())
+
+    async def run_query_async(self, **kwargs):
+        """ Collect iter_claims. See iter_claims for the arguments.
+        returns:
+            list of dictionaries
+        """
+        return [claim async for claim in self.iter_claims(**kwargs)]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Feb  3 20:48:15 2021
+
+@author: jmr
+"""
+import threading
+import sqlite3
+import json
+import time
+
+class checkpoint_store:
+
+    """
+        Checkpoints of long running jobs, stored in a sqlite file. Records, as they happen,
+            * for claim_search.run_query: the claims of each page and the nextPageToken of each query combination, and which combinations are done
+            * for async_claim_review_parser: the claim urls already scraped and their cleaned claim review
+        so that a job stopped by a crash or an exhausted quota can be resumed where it stopped.
+    """
+
+    def __init__(self, path : str):
+        """
+        Instantiate class checkpoint_store
+        args:
+            path: str, path to the sqlite file holding the checkpoints
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread = False)
+        self._con.execute('PRAGMA journal_mode = WAL')
+        self._con.executescript("""
+            CREATE TABLE IF NOT EXISTS combinations (
+                key TEXT PRIMARY KEY,
+                done INTEGER,
+                page_token TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS api_claims (
+                key TEXT,
+                claim TEXT
+            );
+            CREATE INDEX IF NOT EXISTS api_claims_key ON api_claims (key);
+            CREATE TABLE IF NOT EXISTS scraped (
+                url TEXT PRIMARY KEY,
+                claim_review TEXT,
+                updated_at REAL
+            );
+            """)
+        self._con.commit()
+
+    @classmethod
+    def open(cls, checkpoint):
+        """ A checkpoint_store out of a store or a path """
+        if checkpoint is None or isinstance(checkpoint, checkpoint_store):
+            return checkpoint
+        return cls(checkpoint)
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def reset(self, api : bool = True, scraped : bool = True):
+        """ Drop the checkpoints of the api calls and/or of the scraper, i.e. start that part of the job from scratch """
+        with self._lock:
+            if api:
+                self._con.executescript('DELETE FROM combinations; DELETE FROM api_claims;')
+            if scraped:
+                self._con.execute('DELETE FROM scraped')
+            self._con.commit()
+
+    ## overridden query parameters left out of the combination keys: relative to the day of the run (e.g. the delta window's maxAgeDays),
+    ## they change from one day to the next and would restart the combinations of a job resumed on a later day
+    date_overrides = ('maxAgeDays',)
+
+    @classmethod
+    def combination_key(cls, pars : tuple, overrides : dict = None):
+        """ Key of a (query, languageCode, reviewPublisherSiteFilter) combination, and of the query parameters overriden for it (e.g. the planner's pageSize), date_overrides excepted """
+        overrides = {k: v for k, v in (overrides or {}).items() if v is not None and k not in cls.date_overrides}
+        if len(overrides) == 0:
+            return json.dumps(list(pars), ensure_ascii = False)
+        return json.dumps(list(pars) + [overrides], ensure_ascii = False, sort_keys = True)
+
+    ### claim_search.run_query
+    def combination(self, pars : tuple, overrides : dict = None):
+        """
+        State of a query combination run with overrides. The pages fetched with other query parameters (date_overrides excepted) are not resumed.
+        returns:
+            None if it was never started, else dict with done (logical), page_token (str, the next page to fetch) and claims (list, the raw claims fetched so far)
+        """
+        key = self.combination_key(pars, overrides)
+        with self._lock:
+            row = self._con.execute('SELECT done, page_token FROM combinations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            claims = [json.loads(c) for (c,) in self._con.execute('SELECT claim FROM api_claims WHERE key = ? ORDER BY rowid', (key,))]
+        return dict(done = bool(row[0]), page_token = row[1], claims = claims)
+
+    def save_page(self, pars : tuple, claims : list, next_page_token : str = None, overrides : dict = None):
+        """ Record a fetched page of a combination run with overrides. The combination is done once there is no next page."""
+        key = self.combination_key(pars, overrides)
+        with self._lock:
+            self._con.executemany('INSERT INTO api_claims VALUES (?, ?)', [(key, json.dumps(c, ensure_ascii = False)) for c in claims])
+            self._con.execute('INSERT OR REPLACE INTO combinations VALUES (?, ?, ?, ?)', (key, int(next_page_token is None), next_page_token, time.time()))
+            self._con.commit()
+
+    ### async_claim_review_parser
+    def scraped(self, urls : list = None):
+        """ dict mapping the scraped urls (or those among urls) to their cleaned claim review, None where the page had no claim review """
+        with self._lock:
+            if urls is None:
+                rows = self._con.execute('SELECT url, claim_review FROM scraped').fetchall()
+            else:
+                ## look the urls up by chunks, within sqlite's limit on the number of parameters
+                urls = list(set(u for u in urls if u is not None))
+                rows = []
+                for i in range(0, len(urls), 500):
+                    chunk = urls[i:i + 500]
+                    rows.extend(self._con.execute(f'SELECT url, claim_review FROM scraped WHERE url IN ({", ".join("?" * len(chunk))})', chunk).fetchall())
+        return {url: (json.loads(cr) if cr is not None else None) for url, cr in rows}
+
+    def save_scraped(self, url : str, claim_review : dict = None):
+        """ Record a scraped claim url and its cleaned claim review, None if its page has no claim review. Only pages fetched and parsed are recorded, failures are retried on resume."""
+        with self._lock:
+            self._con.execute('INSERT OR REPLACE INTO scraped VALUES (?, ?, ?)', (url, json.dumps(claim_review, ensure_ascii = False) if claim_review is not None else None, time.time()))
+            self._con.commit()
@@ -5,11 +5,69 @@ Created on Sat Jan  9 22:44:13 2021
 
 @author: jmr
 """
-import extruct
-import requests
-from lxml import html
-from requests.exceptions import HTTPError
-import time
+import json
+import re
+import warnings
+from google_fc_helpers.retry import retry_policy, circuit_open_error
+from google_fc_helpers.http_cache import http_cache
+from google_fc_helpers.extraction_schema import extraction_schema, CLAIM_REVIEW_SCHEMA, get_candidate_value
+from google_fc_helpers.instrumentation import logger
+
+### Fast JSON-LD path
+## <script type="application/ld+json"> blocks, matched on the raw bytes
+LD_JSON_RE = re.compile(rb'<script[^>]*?type\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>', re.IGNORECASE | re.DOTALL)
+## markers of a claim review block
+CLAIM_REVIEW_MARKERS = (b'ClaimReview', b'itemReviewed')
+## wrappers some cms put around the json
+LD_JSON_WRAPPERS_RE = re.compile(rb'^\s*(?:<!--|//\s*<!\[CDATA\[|<!\[CDATA\[)|(?:-->|//\s*\]\]>|\]\]>)\s*$')
+
+def claim_review_blocks(content : bytes):
+    """ The raw JSON-LD script blocks of a page which mention a claim review. A byte level pre-filter skips pages without any marker."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    if not any(marker in content for marker in CLAIM_REVIEW_MARKERS):
+        return []
+    return [block for block in LD_JSON_RE.findall(content) if any(marker in block for marker in CLAIM_REVIEW_MARKERS)]
+
+def extract_json_ld(content : bytes):
+    """
+    Decode the claim review JSON-LD blocks of a page without building a DOM
+    returns:
+        list of dicts, or None if a block could not be decoded and extruct should be used instead
+    """
+    out = []
+    for block in claim_review_blocks(content):
+        try:
+            data = json.loads(LD_JSON_WRAPPERS_RE.sub(b'', block).decode('utf-8'), strict = False)
+        except ValueError:
+            return None
+        if isinstance(data, list):
+            out.extend(d for d in data if isinstance(d, dict))
+        elif isinstance(data, dict):
+            out.append(data)
+    return out
+
+def is_claim_review(d : dict):
+    """ Whether a JSON-LD node is a claim review """
+    node_type = d.get('@type')
+    return 'itemReviewed' in d or node_type == 'ClaimReview' or (isinstance(node_type, list) and 'ClaimReview' in node_type)
+
+def select_claim_review(metadata : list):
+    """ Select the claim review node out of a page's JSON-LD. Returns None if there is none."""
+    if isinstance(metadata, dict):
+        metadata = [metadata]
+    for d in metadata or []:
+        if not isinstance(d, dict):
+            continue
+        graph = d.get('@graph')
+        if isinstance(graph, list) and len(graph) > 0:
+            nodes = [n for n in graph if isinstance(n, dict) and is_claim_review(n)]
+            return nodes[0] if len(nodes) > 0 else graph[0]
+        if isinstance(graph, dict):
+            return graph
+        if is_claim_review(d):
+            return d
+    return None
 
 class claim_review_parser(object):
     
@@ -60,111 +118,115 @@ class claim_review_parser(object):
                     }'
         """
         
-    def scrape(self, url: str, max_retries: int, back_off: float):
-        """ Scrape a website and parse html"""
-        attempts = 0
+    def __init__(self, retry : retry_policy = None, cache : http_cache = None, schema : extraction_schema = None):
+        """
+        Instantiate class claim_review_parser
+        args:
+            retry: retry_policy, retry, back off and circuit breaker settings used by scrape. Retry counts are reported in retry.stats.
+            cache: http_cache, optional persistent cache of the fetched pages, revalidated with conditional GETs.
+            schema: extraction_schema, output fields of clean_claim_review. Extend a copy of extraction_schema.CLAIM_REVIEW_SCHEMA to add fields.
+        """
+        self.retry = retry if retry is not None else retry_policy()
+        self.cache = cache
+        self.schema = schema if schema is not None else CLAIM_REVIEW_SCHEMA
+        
+    def scrape(self, url: str, max_retries: int = None, back_off: float = None, verbose: bool = True):
+        """ Scrape a website and parse html
+        args:
+            url: str, page url
+            max_retries: int, overrides the retry policy's max_retries
+            back_off: float, deprecated, set it on the retry policy instead. Overrides the retry policy's back_off for this call.
+            verbose: logical, log the retries at info level. Defaults to True.
+        """
+        import requests
+        if back_off is not None:
+            warnings.warn('scrape(back_off = ...) is deprecated, set back_off on the retry policy instead.', DeprecationWarning, stacklevel = 2)
+        from requests.exceptions import HTTPError
         response = None
-        while attempts < max_retries:
-            attempts += 1
-            sleep_time = round(attempts ** back_off, 1)
-            try:
-                response = requests.get(url = url)
-                response.raise_for_status()
-                break
-            except HTTPError as http_err:
-                print(f'HTTP Error {http_err}. Retrying in {sleep_time} secs.')
-                time.sleep(sleep_time)
-            except Exception as err:
-                raise ValueError(f'Another non HTTP Request error occurred: {err}.')
+        ## serve fresh pages from the cache, revalidate stale ones
+        cached, entry, headers = None, None, {}
+        if self.cache is not None:
+            cached, entry = self.cache.lookup(url)
+            if cached is not None:
+                return cached
+            headers = self.cache.conditional_headers(entry)
+        try:
+            response = self.retry.request(lambda: requests.get(url = url, headers = headers), url = url, max_retries = max_retries, verbose = verbose, back_off = back_off)
+            if self.cache is not None:
+                response = self.cache.update(url, entry, response)
+            response.raise_for_status()
+        except HTTPError as http_err:
+            logger.warning('HTTP Error %s.', http_err)
+        except circuit_open_error as err:
+            logger.warning('Skipping %s: %s', url, err)
+        except Exception as err:
+            raise ValueError(f'Another non HTTP Request error occurred: {err}.')
         return response
         
     def check_claim_review(self, response = None):
         """Given a HTTP response, check wether or not a page uses claim_review schema """
-        ## parse the content
-        content = html.fromstring(response.content)
-        ## check whether the script tag with the claimReview exists
-        claim_review_script = content.xpath('//script[@type="application/ld+json" and contains(text(), "itemReviewed")]')
-        return len(claim_review_script) > 0
+        ## check whether a ld+json script tag with the claimReview exists, without parsing the html
+        return len(claim_review_blocks(response.content)) > 0
     
     def fetch_html(self, response = None):
         return response.text
     
-    def parse_claim_review(self, html: bytes, url: str) -> list:
-        """Fetch JSON-LD structured data."""
-        ## parse the json linked data metadata
-        metadata = extruct.extract(
+    def extruct_json_ld(self, html: bytes, url: str) -> list:
+        """Fetch JSON-LD structured data with extruct. Slow path, parses the whole document."""
+        import extruct
+        return extruct.extract(
             html,
             base_url=url,
             syntaxes=['json-ld'],
             uniform=True
         )['json-ld']
+    
+    def parse_claim_review(self, html: bytes, url: str) -> dict:
+        """Fetch the claim review JSON-LD structured data. Tries the extractor registered for the domain first (see extractors), then decodes the script blocks directly and only falls back to extruct when they cannot be decoded."""
+        from google_fc_helpers.extractors import get_extractor
+        extractor = get_extractor(url)
+        if extractor is not None:
+            node = extractor(html, url)
+            if node is not None:
+                return node
+        metadata = extract_json_ld(html)
+        if not metadata:
+            metadata = self.extruct_json_ld(html = html, url = url)
         ## select only the claimReview dictionary where more than one exists
-        out = []
-        if isinstance(metadata, list) and len(metadata) > 0:
-            for d in metadata:
-                if '@graph' in d.keys() and isinstance(d['@graph'], list):
-                    if isinstance(d['@graph'], list):
-                        out.append(d['@graph'][0])
-                    else:    
-                        out.append(d['@graph'])
-                else:
-                    if 'itemReviewed' in d.keys() and isinstance(d, dict):
-                        out.append(d)
-        elif len(metadata) > 0:
-            out = [metadata]
-        else:
-            out = [None]
-        return out[0]
+        return select_claim_review(metadata)
     
     def get_candidate_value(self, d: dict, key: str, candidate_expressions = None):
         """ 
-        Fetch the value given a key or one of a list of possible candidate keys or key[index] combos as expressions to be dynamically evaluated
+        Fetch the value given a key or one of a list of possible candidate keys or key[index] combos, see extraction_schema.get_candidate_value
         args:
             d: dict,
             key: str, 
-            candidate_expressions: list of str, containing python code to be dynamically evaluated
+            candidate_expressions: list of str, subscript expressions such as '["author"]["sameAs"]'
         """
-        try:
-            if d.get(key) is None:
-                out = None
-                if candidate_expressions is not None:
-                    for candidate in candidate_expressions:
-                        exp = f'd{candidate}'
-                        try:
-                            result = eval(exp)
-                            if result is not None and len(result) > 0:
-                                out = result
-                                break
-                        except:
-                            pass
-            else:
-                out = d.get(key)
-        except:
-            out = None
-        return out
+        return get_candidate_value(d, key, candidate_expressions = candidate_expressions)
     
     def clean_claim_review(self, cr: dict):
-        """ Extract the relevant metadata """
-        ### fetch the main arrays
-        rr_dict = self.get_candidate_value(cr, 'reviewRating')
-        ir_dict = self.get_candidate_value(cr, 'itemReviewed')
-        author = self.get_candidate_value(cr, 'author')
-        return dict(
-                claim_reviewed = self.get_candidate_value(cr, 'claimReviewed'),
-                review_rating_type = self.get_candidate_value(rr_dict, '@type'),
-                review_rating_value = self.get_candidate_value(rr_dict, 'ratingValue'),
-                review_rating_best = self.get_candidate_value(rr_dict, 'bestRating'),
-                review_rating_worst = self.get_candidate_value(rr_dict, 'worstRating'),
-                review_rating_alternate_name = self.get_candidate_value(rr_dict, 'alternateName'),
-                fact_check_url = self.get_candidate_value(cr, 'url'),
-                fact_check_date_published = self.get_candidate_value(cr, 'datePublished'),
-                fact_check_author_type = self.get_candidate_value(author, '@type'),
-                fact_check_author_id = self.get_candidate_value(author, '@id'),
-                fact_check_author_name = self.get_candidate_value(author, 'name'),
-                fact_check_author_url = self.get_candidate_value(author, 'url'),
-                fact_check_author_url_sameAs = self.get_candidate_value(author, 'sameAs', candidate_expressions = ['["sameAs"][0]']),
-                item_reviewed_url = self.get_candidate_value(ir_dict, 'url', candidate_expressions = ['["author"]["sameAs"]["url"]', '["author"]["sameAs"]', '["appearance"]', '["appearance"]["url"]', "['url']"]),
-                item_reviewed_date_published = self.get_candidate_value(ir_dict, 'datePublished', candidate_expressions = ['["author"]["datePublished"]', '["appearance"]["datePublished"]']),
-                item_reviewed_author_type = self.get_candidate_value(ir_dict, 'author.type', candidate_expressions = ['["author"]["@type"]', '["author"]["type"]']),
-                item_reviewed_author_name = self.get_candidate_value(ir_dict, 'author.name', candidate_expressions = ['["author"]["name"]'])
-                )
+        """ Extract the relevant metadata, as defined in the extraction schema """
+        return self.schema.extract(cr if isinstance(cr, dict) else {})
+
+def parse_page(content : bytes, url : str, schema : extraction_schema = None):
+    """
+    Check, parse and clean the claim review of a fetched page in one call. A module level function so that it can run in a process pool.
+    args:
+        content: bytes, the page's html
+        url: str, the page's url
+        schema: extraction_schema, defaults to CLAIM_REVIEW_SCHEMA
+    returns:
+        None if the page does not use the claim review schema, an empty dict if its claim review could not be parsed, else the cleaned claim review dict
+    """
+    if len(claim_review_blocks(content)) == 0:
+        return None
+    parser = claim_review_parser(schema = schema)
+    try:
+        parsed_cr = parser.parse_claim_review(html = content, url = url)
+    except Exception as err:
+        logger.warning('Error occurred in the claim review parser for %s: %s.', url, err)
+        parsed_cr = None
+    if parsed_cr is None:
+        return {}
+    return parser.clean_claim_review(cr = parsed_cr)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Feb 11 19:40:27 2021
+
+@author: jmr
+
+Command line entry point: runs a query json file (see examples/example_query.json) end to end,
+i.e. claim search calls, claim review scraping and export.
+
+usage: gfc-helpers examples/example_query.json -o fake_news.jsonl
+       gfc-helpers examples/example_query.json -o shard_0.jsonl --shard 0/4
+       gfc-helpers merge shard_*.jsonl -o fake_news.jsonl
+       gfc-helpers reparse pages.gfa -i fake_news.jsonl -o fake_news_v2.jsonl
+"""
+import time
+_start = time.perf_counter()
+import argparse
+import json
+import logging
+import sys
+
+def parse_args(argv : list = None):
+    parser = argparse.ArgumentParser(prog = 'gfc-helpers', description = "Query google's claim search endpoint and scrape the claim review metadata of the fact checks.")
+    parser.add_argument('query', help = 'query json file, see examples/example_query.json')
+    parser.add_argument('-o', '--output', default = 'fake_news.jsonl', help = 'output file. The format follows the extension: .jsonl, .csv, .parquet or .json. Defaults to fake_news.jsonl')
+    parser.add_argument('--key', action = 'append', default = None, help = 'google api key, overrides the one in the query file. Repeat it to spread the calls over a pool of keys')
+    parser.add_argument('--no-scrape', action = 'store_true', help = 'only make the api calls, do not scrape the fact check pages')
+    parser.add_argument('--max-workers', type = int, default = 4, help = 'query combinations fetched concurrently')
+    parser.add_argument('--requests-per-second', type = float, default = None, help = 'cap on the api calls per second')
+    parser.add_argument('--max-concurrency', type = int, default = 50, help = 'fact check pages fetched concurrently')
+    parser.add_argument('--max-per-domain', type = int, default = 4, help = 'fact check pages fetched concurrently per domain')
+    parser.add_argument('--fused', action = 'store_true', help = 'scrape the fact check pages while the api is still paginating, instead of batch by batch')
+    parser.add_argument('--batch-size', type = int, default = 500, help = 'claims scraped per batch')
+    parser.add_argument('--cache', default = None, help = 'path to a persistent http cache of the fact check pages')
+    parser.add_argument('--archive', default = None, help = 'path to a compressed archive of the fetched pages, see gfc-helpers reparse')
+    parser.add_argument('--domain-cache', default = None, help = 'path to a negative cache of the domains without claim review, whose pages are skipped')
+    parser.add_argument('--seen-index', default = None, help = 'path to a seen claim index, only new or changed claims are output')
+    parser.add_argument('--checkpoint', default = None, help = 'path to a checkpoint file')
+    parser.add_argument('--resume', action = 'store_true', help = 'resume the job recorded in --checkpoint')
+    parser.add_argument('--planner', default = None, help = 'path to the query planner history: dedupes the combinations, sizes the pages and skips the combinations empty in the last runs')
+    parser.add_argument('--delta', action = 'store_true', help = 'with --planner, only request the days since the last complete run of each combination')
+    parser.add_argument('--shard', default = None, help = 'run only the i-th of N shards of the query combinations, e.g. 0/4. Combine the shard outputs with gfc-helpers merge')
+    parser.add_argument('--metrics', action = 'store_true', help = 'print the startup time and the metrics summary')
+    parser.add_argument('-v', '--verbose', action = 'store_true', help = 'log progress')
+    return parser.parse_args(argv)
+
+def parse_merge_args(argv : list = None):
+    parser = argparse.ArgumentParser(prog = 'gfc-helpers merge', description = 'Combine and deduplicate the outputs of sharded runs.')
+    parser.add_argument('inputs', nargs = '+', help = 'shard output files (.jsonl, .json, .csv or .parquet)')
+    parser.add_argument('-o', '--output', default = 'fake_news.jsonl', help = 'merged output file, the format follows the extension')
+    parser.add_argument('--by-url', action = 'store_true', help = 'keep one record per fact check url instead of one per query combination and url')
+    return parser.parse_args(argv)
+
+def merge(argv : list = None):
+    args = parse_merge_args(argv)
+    from google_fc_helpers.sharding import merge_shards
+    n = merge_shards(args.inputs, args.output, by_url = args.by_url)
+    print(f'{n} records written to {args.output} in {time.perf_counter() - _start:.1f} secs', file = sys.stderr)
+    return 0
+
+def marked(records, seen_index):
+    """ Mark the records in the seen claim index as they are consumed """
+    for record in records:
+        yield record
+        seen_index.mark([record])
+
+def parse_reparse_args(argv : list = None):
+    parser = argparse.ArgumentParser(prog = 'gfc-helpers reparse', description = 'Parse and clean the claim reviews of an archive of fetched pages again, without network access.')
+    parser.add_argument('archive', help = 'page archive written with --archive')
+    parser.add_argument('-i', '--input', default = None, help = 'claims to enrich again, e.g. a previous output (.jsonl, .json, .csv or .parquet). Defaults to every archived page')
+    parser.add_argument('-o', '--output', default = 'fake_news.jsonl', help = 'output file, the format follows the extension')
+    parser.add_argument('--workers', type = int, default = None, help = 'parsing processes, defaults to the number of cores')
+    return parser.parse_args(argv)
+
+def reparse(argv : list = None):
+    args = parse_reparse_args(argv)
+    from google_fc_helpers import page_archive
+    from google_fc_helpers.sinks import open_sink
+    if args.input is not None:
+        from google_fc_helpers.sharding import iter_records
+        records = page_archive.reparse_claims(iter_records(args.input), args.archive, workers = args.workers)
+    else:
+        records = ({'fact_check_url': url, **cleaned} for url, cleaned in page_archive.reparse(args.archive, workers = args.workers) if cleaned is not None)
+    with open_sink(args.output) as sink:
+        n = sink.consume(records)
+    print(f'{n} records written to {args.output} in {time.perf_counter() - _start:.1f} secs', file = sys.stderr)
+    return 0
+
+def asyncio_consume(pipe, sink):
+    """ Write the records of a claim_pipeline into a sink """
+    import asyncio
+    async def consume():
+        n = 0
+        async for record in pipe.run():
+            sink.write(record)
+            n += 1
+        return n
+    return asyncio.run(consume())
+
+def main(argv : list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) > 0 and argv[0] == 'merge':
+        return merge(argv[1:])
+    if len(argv) > 0 and argv[0] == 'reparse':
+        return reparse(argv[1:])
+    args = parse_args(argv)
+    logging.basicConfig(level = logging.INFO if args.verbose else logging.WARNING, format = '%(asctime)s %(levelname)s %(message)s')
+    if args.fused and not args.no_scrape:
+        from google_fc_helpers.async_wrapper import async_claim_search as claim_search
+    else:
+        from google_fc_helpers.google_fc_wrapper import claim_search
+    from google_fc_helpers.instrumentation import default_registry
+    from google_fc_helpers.sinks import open_sink
+    ## prep the query
+    kwargs = {} if args.key is None else dict(key = args.key[0] if len(args.key) == 1 else args.key)
+    if args.requests_per_second is not None:
+        kwargs['requests_per_second'] = args.requests_per_second
+    cs = claim_search(query = args.query, **kwargs)
+    seen_index = None
+    if args.seen_index is not None:
+        from google_fc_helpers.seen_index import seen_claim_index
+        seen_index = seen_claim_index(args.seen_index)
+    checkpoint = None
+    if args.checkpoint is not None:
+        from google_fc_helpers.checkpoint import checkpoint_store
+        checkpoint = checkpoint_store(args.checkpoint)
+    planner = None
+    if args.planner is not None:
+        from google_fc_helpers.planner import query_planner
+        planner = query_planner(args.planner, delta = args.delta)
+    if args.metrics:
+        print(f'startup: {(time.perf_counter() - _start) * 1000:.1f} ms', file = sys.stderr)
+    scraper_kwargs = dict(max_concurrency = args.max_concurrency, max_per_domain = args.max_per_domain)
+    if args.cache is not None:
+        from google_fc_helpers.http_cache import http_cache
+        scraper_kwargs['cache'] = http_cache(args.cache)
+    if args.archive is not None:
+        from google_fc_helpers.page_archive import page_archive
+        scraper_kwargs['archive'] = page_archive(args.archive)
+    if args.domain_cache is not None:
+        from google_fc_helpers.domain_cache import domain_capability_cache
+        scraper_kwargs['domain_cache'] = domain_capability_cache(args.domain_cache)
+    try:
+        if args.fused and not args.no_scrape:
+            ## fused pipeline, the claim reviews are scraped as the api pages arrive
+            from google_fc_helpers.pipeline import claim_pipeline
+            pipe = claim_pipeline(cs, scraper_kwargs = scraper_kwargs, max_workers = args.max_workers, seen_index = seen_index, checkpoint = checkpoint, resume = args.resume, shard = args.shard, planner = planner)
+            with open_sink(args.output) as sink:
+                n = asyncio_consume(pipe, sink)
+        else:
+            ## stream the api results, then the scraped claim reviews, into the sink
+            records = cs.iter_query(max_workers = args.max_workers, seen_index = seen_index, checkpoint = checkpoint, resume = args.resume, shard = args.shard, planner = planner)
+            if not args.no_scrape:
+                from google_fc_helpers.async_scraper import iter_claim_reviews
+                records = iter_claim_reviews(records, batch_size = args.batch_size, seen_index = seen_index, checkpoint = checkpoint, resume = args.resume, **scraper_kwargs)
+            elif seen_index is not None:
+                ## without the scraper, the claims are marked as processed once written
+                records = marked(records, seen_index)
+            with open_sink(args.output) as sink:
+                n = sink.consume(records)
+    finally:
+        ## commit the archive index and the cache access times
+        for k in ('cache', 'archive', 'domain_cache'):
+            if k in scraper_kwargs:
+                scraper_kwargs[k].close()
+    print(f'{n} records written to {args.output} in {time.perf_counter() - _start:.1f} secs', file = sys.stderr)
+    if planner is not None:
+        print(planner.report(), file = sys.stderr)
+    if cs.keys is not None:
+        print(json.dumps(cs.keys.usage(), indent = 2), file = sys.stderr)
+    if args.metrics:
+        print(json.dumps(default_registry.summary(), indent = 2), file = sys.stderr)
+    ## partial results, e.g. after an open circuit or exhausted quotas
+    if len(cs.incomplete) > 0:
+        print(f'{len(cs.incomplete)} query combinations stopped before their last page, the output is partial. Rerun with --checkpoint and --resume to complete it.', file = sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
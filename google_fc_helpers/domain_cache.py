@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Feb 14 17:52:09 2021
+
+@author: jmr
+"""
+import threading
+import sqlite3
+import time
+
+class domain_capability_cache:
+
+    """
+        Negative cache of the fact check domains which do not embed claim review JSON-LD, stored in a sqlite file.
+        A domain whose last min_misses pages had no claim review is flagged and its pages are no longer fetched.
+        Once ttl has passed, a single page of the domain is fetched again to re-probe it; a claim review clears the flag.
+    """
+
+    def __init__(self, path : str = ':memory:', ttl : float = 30 * 24 * 3600, min_misses : int = 3):
+        """
+        Instantiate class domain_capability_cache
+        args:
+            path: str, path to the sqlite file holding the cache. Defaults to an in memory cache.
+            ttl: float, secs after which a flagged domain is re-probed. Defaults to 30 days.
+            min_misses: int, consecutive pages without claim review after which a domain is flagged. Defaults to 3.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.min_misses = min_misses
+        self.stats = dict(skipped = 0, probed = 0, flagged = 0, cleared = 0)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread = False)
+        self._con.execute("""
+            CREATE TABLE IF NOT EXISTS domains (
+                domain TEXT PRIMARY KEY,
+                misses INTEGER,
+                hits INTEGER,
+                flagged_at REAL
+            )""")
+        self._con.commit()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def flagged(self):
+        """ The domains currently flagged as without claim review """
+        with self._lock:
+            return [d for (d,) in self._con.execute('SELECT domain FROM domains WHERE flagged_at IS NOT NULL ORDER BY domain')]
+
+    def should_fetch(self, domain : str):
+        """ Whether a page of the domain should be fetched. The first call after the expiry of a flag lets one probe through and restarts the ttl."""
+        now = time.time()
+        with self._lock:
+            row = self._con.execute('SELECT flagged_at FROM domains WHERE domain = ?', (domain,)).fetchone()
+            if row is None or row[0] is None:
+                return True
+            if now - row[0] < self.ttl:
+                self.stats['skipped'] += 1
+                return False
+            self._con.execute('UPDATE domains SET flagged_at = ? WHERE domain = ?', (now, domain))
+            self._con.commit()
+        self.stats['probed'] += 1
+        return True
+
+    def record(self, domain : str, has_claim_review : bool):
+        """ Record whether a fetched page of the domain had a claim review """
+        with self._lock:
+            row = self._con.execute('SELECT misses, hits, flagged_at FROM domains WHERE domain = ?', (domain,)).fetchone()
+            misses, hits, flagged_at = row if row is not None else (0, 0, None)
+            if has_claim_review:
+                misses, hits = 0, hits + 1
+                if flagged_at is not None:
+                    flagged_at = None
+                    self.stats['cleared'] += 1
+            else:
+                misses += 1
+                if misses >= self.min_misses and flagged_at is None:
+                    flagged_at = time.time()
+                    self.stats['flagged'] += 1
+            self._con.execute('INSERT OR REPLACE INTO domains VALUES (?, ?, ?, ?)', (domain, misses, hits, flagged_at))
+            self._con.commit()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jan 26 20:14:37 2021
+
+@author: jmr
+"""
+from functools import lru_cache
+import re
+
+## one step of a candidate expression, e.g. ["author"], ['site'] or [0]
+PATH_STEP_RE = re.compile(r'''\[\s*(?:"([^"]*)"|'([^']*)'|(-?\d+))\s*\]''')
+
+@lru_cache(maxsize = None)
+def parse_path(expression : str):
+    """
+    Turn a candidate expression into a path
+    args:
+        expression: str, either a plain key, e.g. 'url', or subscripts, e.g. '["author"]["sameAs"][0]'
+    returns:
+        tuple of keys (str) and indexes (int)
+    """
+    expression = expression.strip()
+    if not expression.startswith('['):
+        return (expression,)
+    steps = []
+    end = 0
+    for m in PATH_STEP_RE.finditer(expression):
+        if m.start() != end:
+            break
+        end = m.end()
+        steps.append(int(m.group(3)) if m.group(3) is not None else (m.group(1) if m.group(1) is not None else m.group(2)))
+    if end != len(expression):
+        raise ValueError(f'Invalid candidate expression: {expression}')
+    return tuple(steps)
+
+def compile_path(path):
+    """
+    Compile a path into an accessor function returning the value at that path or None.
+    Lists are handled at any node: an index selects an element, a key selects the first element holding that key.
+    Pin an index when several fields must be read from the same element, e.g. ('claimReview', 0, 'url').
+    """
+    if isinstance(path, str):
+        path = parse_path(path)
+    path = tuple(path)
+    def accessor(d):
+        node = d
+        for step in path:
+            if isinstance(node, dict):
+                if isinstance(step, int):
+                    return None
+                node = node.get(step)
+            elif isinstance(node, list):
+                if isinstance(step, int):
+                    node = node[step] if -len(node) <= step < len(node) else None
+                else:
+                    node = next((n[step] for n in node if isinstance(n, dict) and step in n), None)
+            else:
+                return None
+            if node is None:
+                return None
+        return node
+    return accessor
+
+def is_empty(value):
+    return value is None or (isinstance(value, (str, list, dict)) and len(value) == 0)
+
+def compile_field(paths):
+    """ Compile the fallback paths of a field into one accessor returning the first non empty value """
+    accessors = [compile_path(p) for p in paths]
+    if len(accessors) == 1:
+        return accessors[0]
+    def accessor(d):
+        for get in accessors:
+            value = get(d)
+            if not is_empty(value):
+                return value
+        return None
+    return accessor
+
+class extraction_schema:
+
+    """
+        Declarative mapping from output fields to the candidate paths holding their value in a (nested) dict.
+        Paths are compiled once into accessor functions, no eval involved.
+        Example:
+            schema = extraction_schema([('fact_check_domain', [('claimReview', 0, 'publisher', 'site'), ('claimReview', 0, 'site')])])
+            schema.add_field('publisher_url', '["claimReview"][0]["publisher"]["url"]')
+            schema.extract(claim)
+    """
+
+    def __init__(self, fields : list = None):
+        """
+        Instantiate class extraction_schema
+        args:
+            fields: list of (field name, list of paths) tuples. A path is a tuple of keys/indexes or a candidate expression string.
+        """
+        self.fields = []
+        self._accessors = []
+        for name, paths in fields or []:
+            self.add_field(name, *paths)
+
+    def add_field(self, name : str, *paths):
+        """ Add (or replace) an output field, extracted from the first of paths holding a non empty value """
+        paths = [parse_path(p) if isinstance(p, str) else tuple(p) for p in paths]
+        accessor = compile_field(paths)
+        for i, (field, _) in enumerate(self.fields):
+            if field == name:
+                self.fields[i] = (name, paths)
+                self._accessors[i] = (name, accessor)
+                return self
+        self.fields.append((name, paths))
+        self._accessors.append((name, accessor))
+        return self
+
+    def copy(self):
+        return extraction_schema(self.fields)
+
+    ## pickle the field definitions only, the accessors are recompiled (e.g. when shipped to a process pool)
+    def __getstate__(self):
+        return {'fields': self.fields}
+
+    def __setstate__(self, state):
+        self.__init__(state['fields'])
+
+    def extract(self, d : dict):
+        """ Extract every field of the schema from d """
+        return {name: get(d) for name, get in self._accessors}
+
+def get_candidate_value(d : dict, key : str, candidate_expressions : list = None):
+    """ Fetch the value given a key or one of a list of possible candidate keys or key[index] combos. Expressions are parsed, not evaluated."""
+    if not isinstance(d, dict):
+        return None
+    out = d.get(key)
+    if out is None and candidate_expressions is not None:
+        for candidate in candidate_expressions:
+            try:
+                result = compile_path(candidate)(d)
+            except ValueError:
+                continue
+            if not is_empty(result):
+                return result
+    return out
+
+### default schemas
+## claims returned by the claim search endpoint, see claim_search.clean_up
+## every claimReview field is read from the first review, so that the fields of a claim with several reviews are not mixed
+API_SCHEMA = extraction_schema([
+    ('claim_reviewed', [('text',)]),
+    ('claimant', [('claimant',)]),
+    ('claim_date', [('claimDate',)]),
+    ('fact_check_url', [('claimReview', 0, 'url')]),
+    ('fact_check_domain', [('claimReview', 0, 'publisher', 'site'), ('claimReview', 0, 'site')]),
+    ('fact_check_author_name', [('claimReview', 0, 'publisher', 'name'), ('claimReview', 0, 'name')]),
+    ('fact_check_title', [('claimReview', 0, 'title')]),
+    ('fact_check_language_code', [('claimReview', 0, 'languageCode')])
+    ])
+
+## claim review JSON-LD scraped from the fact check pages, see claim_review_parser.clean_claim_review
+CLAIM_REVIEW_SCHEMA = extraction_schema([
+    ('claim_reviewed', [('claimReviewed',)]),
+    ('review_rating_type', [('reviewRating', '@type')]),
+    ('review_rating_value', [('reviewRating', 'ratingValue')]),
+    ('review_rating_best', [('reviewRating', 'bestRating')]),
+    ('review_rating_worst', [('reviewRating', 'worstRating')]),
+    ('review_rating_alternate_name', [('reviewRating', 'alternateName')]),
+    ('fact_check_url', [('url',)]),
+    ('fact_check_date_published', [('datePublished',)]),
+    ('fact_check_author_type', [('author', '@type')]),
+    ('fact_check_author_id', [('author', '@id')]),
+    ('fact_check_author_name', [('author', 'name')]),
+    ('fact_check_author_url', [('author', 'url')]),
+    ('fact_check_author_url_sameAs', [('author', 'sameAs')]),
+    ('item_reviewed_url', [('itemReviewed', 'url'), ('itemReviewed', 'author', 'sameAs', 'url'), ('itemReviewed', 'author', 'sameAs'), ('itemReviewed', 'appearance'), ('itemReviewed', 'appearance', 'url')]),
+    ('item_reviewed_date_published', [('itemReviewed', 'datePublished'), ('itemReviewed', 'author', 'datePublished'), ('itemReviewed', 'appearance', 'datePublished')]),
+    ('item_reviewed_author_type', [('itemReviewed', 'author', '@type'), ('itemReviewed', 'author', 'type')]),
+    ('item_reviewed_author_name', [('itemReviewed', 'author', 'name')])
+    ])
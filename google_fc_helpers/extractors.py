@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Feb 14 18:40:33 2021
+
+@author: jmr
+
+Registry of fast, domain specific claim review extractors, consulted by claim_review_parser.parse_claim_review before the generic path.
+An extractor takes (html bytes, url) and returns the raw claim review node, or None to fall back to the generic path.
+
+    from google_fc_helpers.extractors import register_extractor, nested_node_extractor
+
+    register_extractor('example-factcheck.org', nested_node_extractor('mainEntity'))
+
+Extractors registered at import time (like the ones below) are available in the parsing processes of the pipelined scraper.
+"""
+from urllib.parse import urlparse
+from google_fc_helpers.claim_review_parser import extract_json_ld, is_claim_review
+
+## domain -> extractor
+EXTRACTORS = {}
+
+def register_extractor(domain : str, extractor = None):
+    """
+    Register an extractor for a domain and its subdomains. Can be used as a decorator.
+    args:
+        domain: str, e.g. 'afp.com'
+        extractor: callable (html : bytes, url : str) -> dict or None
+    """
+    def register(fn):
+        EXTRACTORS[domain.lower()] = fn
+        return fn
+    return register(extractor) if extractor is not None else register
+
+def unregister_extractor(domain : str):
+    EXTRACTORS.pop(domain.lower(), None)
+
+def get_extractor(url : str):
+    """ The extractor registered for the host of url or its closest parent domain, None if there is none """
+    if not EXTRACTORS:
+        return None
+    host = urlparse(url).netloc.lower().split(':')[0]
+    parts = host.split('.')
+    for i in range(len(parts) - 1):
+        extractor = EXTRACTORS.get('.'.join(parts[i:]))
+        if extractor is not None:
+            return extractor
+    return None
+
+### extractor factories for the common layouts
+def graph_node_extractor(types : tuple = ('ClaimReview',)):
+    """ Claim review node inside an @graph, selected by its @type, e.g. Yoast/Drupal pages listing the WebPage, Organization and ClaimReview nodes """
+    def extract(html : bytes, url : str):
+        for d in extract_json_ld(html) or []:
+            graph = d.get('@graph', [d])
+            for node in (graph if isinstance(graph, list) else [graph]):
+                if isinstance(node, dict) and (node.get('@type') in types or is_claim_review(node)):
+                    return node
+        return None
+    return extract
+
+def nested_node_extractor(*keys : str):
+    """ Claim review node nested under one of keys of a parent node, e.g. an Article's 'review' or a WebPage's 'mainEntity' """
+    def extract(html : bytes, url : str):
+        for d in extract_json_ld(html) or []:
+            graph = d.get('@graph', [d])
+            for node in (graph if isinstance(graph, list) else [graph]):
+                if not isinstance(node, dict):
+                    continue
+                for key in keys:
+                    children = node.get(key)
+                    for child in (children if isinstance(children, list) else [children]):
+                        if isinstance(child, dict) and is_claim_review(child):
+                            return child
+        return None
+    return extract
+
+### built-in extractors
+## AFP fact check sites (factcheck.afp.com, factuel.afp.com, checamos.afp.com, ...), ClaimReview node in an @graph
+register_extractor('afp.com', graph_node_extractor())
@@ -6,21 +6,45 @@ Created on Sat Jan  9 22:44:13 2021
 @author: jmr
 """
 
-from requests.exceptions import HTTPError
-import time
-import requests
 import json
+import logging
+import warnings
 from itertools import product
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from google_fc_helpers.throttle import get_rate_limiter
+from google_fc_helpers.key_pool import key_pool, quota_exhausted_error
+from google_fc_helpers.retry import retry_policy, circuit_open_error
+from google_fc_helpers.extraction_schema import API_SCHEMA, get_candidate_value
+from google_fc_helpers.instrumentation import default_registry, logger
+from google_fc_helpers.checkpoint import checkpoint_store
+from google_fc_helpers.sharding import parse_shard, combination_in_shard
+import time
 
 class claim_search:
     
+    ## the claim search endpoint, can be overridden through kwargs (e.g. to point to a local stub)
+    endpoint = "https://content-factchecktools.googleapis.com/v1alpha1/claims:search"
+    ## optional cap on the number of api calls per second made with the same key
+    requests_per_second = None
+    ## retry policy shared by every call made by this instance, defaults to retry_policy()
+    retry = None
+    ## extraction schema used by clean_up, defaults to extraction_schema.API_SCHEMA
+    schema = None
+    ## metrics registry and event hooks, see instrumentation.metrics_registry
+    metrics = default_registry
+    ## optional query planner, see planner.query_planner
+    planner = None
+    ## pool of api keys, set when key is a list of keys or a key_pool
+    keys = None
+    
     def __init__(self, query : str or dict, **kwargs):
         """
         Instantiate class google fct pipeline
         args:
             query : json file containing the query parameters or a dictionary containing the relevant parameters, namely: 
-                key: str, google API key.
+                key: str, google API key. Or a list of keys (or a key_pool) whose combined quota is used, each call going to the key with the most headroom.
                 query: str or list, textual query string or list of textual query strings, Required unless reviewPublisherSiteFilter is specified.
                 languageCode: str or list, BCP-47 language code, e.g. "en-US" or "sr-Latn". Can be used to restrict results by language, though we do not currently consider the region. 
                 reviewPublisherSiteFilter: str or list of strs, the review publisher site to filter results by, e.g. nytimes.com. 
@@ -34,6 +58,13 @@ class claim_search:
             * endpoint docs: https://developers.google.com/fact-check/tools/api/reference/rest/v1alpha1/claims/search
             * Getting a google api key: https://support.google.com/googleapi/answer/6158862?hl=en
             * BCP-47 language code directory: https://github.com/libyal/libfwnt/wiki/Language-Code-identifiers 
+        kwargs:
+            endpoint: str, url of the claim search endpoint.
+            requests_per_second: float, maximum number of api calls per second made with this api key, shared across threads.
+            retry: retry_policy, retry, back off and circuit breaker settings. Retry counts are reported in retry.stats.
+            schema: extraction_schema, output fields of clean_up. Extend a copy of extraction_schema.API_SCHEMA to add fields.
+            metrics: metrics_registry, counters/timings of the api pages and retries. Defaults to instrumentation.default_registry.
+            planner: query_planner, dedupes the combinations and tunes their pageSize/maxAgeDays from the history of previous runs.
         """
         ## parse the query if json file
         if isinstance(query, str) and 'json' in query:
@@ -55,62 +86,114 @@ class claim_search:
             raise ValueError('You must provide a google api key.')
         if self.query is None and self.reviewPublisherSiteFilter is None:
             raise ValueError('You must provide a query string or select a reviewer domain.')
+        if self.retry is None:
+            self.retry = retry_policy(metrics = self.metrics)
+        ## several keys
+        if isinstance(self.key, key_pool):
+            self.keys = self.key
+        elif isinstance(self.key, list):
+            self.keys = key_pool(self.key, requests_per_second = self.requests_per_second, metrics = self.metrics)
+        ## combinations of the last run whose pagination stopped before the last page, see record_incomplete
+        self.incomplete = []
     
     ### Make a get request to Google's claim search endpoint
-    def claim_search(self, querystring : dict, verbose = True, max_retries = 30, back_off = 1.5):
+    def sender(self, querystring : dict, requests_per_second : float = None):
+        """ The callable making one GET request to the endpoint with the current querystring, through the rate limiter or the key pool.
+        requests_per_second: float, rate cap of this call, defaults to the instance attribute."""
+        import requests
+        endpoint = self.endpoint
+        rate = requests_per_second if requests_per_second is not None else self.requests_per_second
+        def send():
+            params = {k: v for k, v in querystring.items() if v is not None}
+            if self.keys is None:
+                ## per key rate limiter
+                get_rate_limiter(querystring.get('key')).acquire(rate)
+                return requests.get(url = endpoint, params = params)
+            ## key pool, fail over to the next key on a 429
+            while True:
+                params['key'] = self.keys.acquire(rate)
+                response = requests.get(url = endpoint, params = params)
+                self.keys.release(params['key'], response)
+                if response.status_code != 429 or not self.keys.available():
+                    return response
+        return send
+    
+    def request_page(self, querystring : dict, verbose = True, max_retries = None, requests_per_second = None, back_off = None):
+        """ Request one page, retries are handled by the retry policy
+        returns:
+            the response, None if the call was given up on (open circuit or exhausted quota)
+        """
+        from requests.exceptions import HTTPError
+        try:
+            response = self.retry.request(self.sender(querystring, requests_per_second), url = self.endpoint, max_retries = max_retries, verbose = verbose, back_off = back_off)
+            response.raise_for_status()
+        except HTTPError as http_err:
+            logger.warning('HTTP error in API call occurred: %s.', http_err)
+        except (circuit_open_error, quota_exhausted_error) as err:
+            logger.warning('Giving up on the API call: %s', err)
+            self.metrics.inc('api_errors_total')
+            return None
+        except Exception as err:
+            raise ValueError(f'Another non HTTP Request error occurred: {err}.')
+        return response
+    
+    def read_page(self, querystring : dict, response, elapsed : float = None):
+        """ Parse the response to a page request and count it
+        returns:
+            the parsed page (dict with claims and nextPageToken), None if the call failed
+        """
+        if not response.ok:
+            self.metrics.inc('api_errors_total')
+            logger.warning('Could not conclude the call: %s', response.text)
+            return None
+        parsed_response = json.loads(response.text)
+        n_claims = len(parsed_response.get('claims', []))
+        if elapsed is not None:
+            self.metrics.observe('api_page_seconds', elapsed)
+        self.metrics.inc('api_pages_total')
+        self.metrics.inc('api_claims_total', n_claims)
+        self.metrics.emit('api_page', query = querystring.get('query'), languageCode = querystring.get('languageCode'), reviewPublisherSiteFilter = querystring.get('reviewPublisherSiteFilter'), claims = n_claims, next_page = 'nextPageToken' in parsed_response)
+        return parsed_response
+    
+    def claim_search(self, querystring : dict, verbose = True, max_retries = None, back_off = None, on_page = None, requests_per_second = None):
         """ Wrapper to the claim search endpoint of googles FC tools API
         params:
             querystring: dict, dict containing the query parameters
-            verbose: logical, defaults to True
-            max_retries: int, how many times should we try the GET request
-            back_off: float, exponential back off parameter
+            verbose: logical, log the pages and retries at info level. Defaults to True.
+            max_retries: int, how many times should we try the GET request. Defaults to the retry policy's max_retries.
+            back_off: float, deprecated, set it on the retry policy instead. Overrides the retry policy's back_off for this search.
+            on_page: callable, called with (claims of the page, nextPageToken or None on the last page) after each page, e.g. to checkpoint the pagination.
+            requests_per_second: float, cap on the api calls per second of this search. Defaults to the instance attribute.
         returns:
             list of dictionaries
         """
-        ### Prepare the get request
-        ## define the endpoint
-        endpoint = "https://content-factchecktools.googleapis.com/v1alpha1/claims:search"
+        if back_off is not None:
+            warnings.warn('claim_search(back_off = ...) is deprecated, set back_off on the retry policy instead.', DeprecationWarning, stacklevel = 2)
         ### start the loop
-        ### make the request 
-        attempts = 0
         nxt = True
         response_list = []
         ## pagination loop
         while nxt:
-            ## retry loop
-            while attempts < max_retries:
-                attempts += 1
-                sleep_time = round(attempts ** back_off, 1)
-                try:
-                    # make the get request
-                    response = requests.get(url = endpoint, params = {k: v for k, v in querystring.items() if v is not None})
-                    response.raise_for_status()
-                except HTTPError as http_err:
-                    time.sleep(sleep_time)
-                    print(f'HTTP error in API call occurred: {http_err}.\n - Retrying in {sleep_time} secs.')  
-                except Exception as err:
-                    raise ValueError(f'Another non HTTP Request error occurred: {err}.')
-            # re-count http request attempts
-            attempts = 0
+            ### make the request
+            start = time.perf_counter()
+            response = self.request_page(querystring, verbose = verbose, max_retries = max_retries, requests_per_second = requests_per_second, back_off = back_off)
+            if response is None:
+                break
             ## parse response and append the output
-            if response.ok:
-                parsed_response = json.loads(response.text)
-                if verbose:
-                    print(parsed_response['claims'])
-                if len(parsed_response) > 0:
-                    # extend response list
-                    response_list.extend(parsed_response['claims'])
-                ## more pages?
-                if 'nextPageToken' not in parsed_response.keys():
-                    nxt = False
-                else:
-                    ## assign the token for the next page to the query string
-                    querystring['pageToken'] = parsed_response['nextPageToken']
-                    if verbose:
-                        print(f'\nFetching next page. Token: {parsed_response["nextPageToken"]}\n')
-            else:
+            parsed_response = self.read_page(querystring, response, time.perf_counter() - start)
+            if parsed_response is None:
+                break
+            # extend response list
+            response_list.extend(parsed_response.get('claims', []))
+            if on_page is not None:
+                on_page(parsed_response.get('claims', []), parsed_response.get('nextPageToken'))
+            ## more pages?
+            if 'nextPageToken' not in parsed_response.keys():
                 nxt = False
-                print(f'Could not conclude the call: {response.text}')
+            else:
+                ## assign the token for the next page to the query string
+                querystring['pageToken'] = parsed_response['nextPageToken']
+                logger.log(logging.INFO if verbose else logging.DEBUG, 'Fetching next page. Token: %s', parsed_response['nextPageToken'])
         ## return
         if len(response_list) > 0:
             out = response_list
@@ -119,78 +202,186 @@ class claim_search:
         return out
     
     ## select values with candidate keys
-    def get_candidate_value(self, d: dict, key: str, candidate_expressions = list):
-        """ Fetch the value given a key or one of a list of possible candidate keys or key[index] combos as expressions to be dynamically evaluated"""
-        if d.get(key) is None:
-            out = None
-            for candidate in candidate_expressions:
-                exp = f'd{candidate}'
-                try:
-                    result = eval(exp)
-                    if result is not None and len(result) > 0:
-                        out = result
-                        break
-                except:
-                    pass
-        else:
-            out = d.get(key)
-        return out
+    def get_candidate_value(self, d: dict, key: str, candidate_expressions = None):
+        """ Fetch the value given a key or one of a list of possible candidate keys or key[index] combos, see extraction_schema.get_candidate_value"""
+        return get_candidate_value(d, key, candidate_expressions = candidate_expressions)
     
     ## clean up the data
     def clean_up(self, response_list: list):
-        """ Extract the relevant metadata """
+        """ Extract the relevant metadata, as defined in the extraction schema """
+        schema = self.schema if self.schema is not None else API_SCHEMA
+        ## claims without a claim review are dropped
+        return [schema.extract(claim) for claim in response_list if isinstance(claim, dict) and claim.get('claimReview')]
+        
+    ### query string of a combination
+    def query_for(self, pars : tuple, overrides : dict = None):
+        """ Query string of a (query, languageCode, reviewPublisherSiteFilter) combination, and the query parameters tagged on its claims
+        returns:
+            tuple, (query dict, dict of the parameters to add to the claims)
+        """
+        ## each combination gets its own query string so that pagination tokens do not leak across combinations or threads
+        query = dict(self.query_dict)
+        ## the key given to the instance (e.g. from kwargs) wins over the query's, a key pool sets it on each call
+        if self.keys is None:
+            query['key'] = self.key
+        else:
+            query.pop('key', None)
+        query['query'] = pars[0]
+        query['languageCode'] = pars[1]
+        query['reviewPublisherSiteFilter'] = pars[2]
+        query.update({k: v for k, v in (overrides or {}).items() if v is not None})
+        ## make query dict with features to add
+        pars_to_add = {k:v for k,v in query.items() if k not in ['key', 'pageToken', 'offset', 'pageSize']}
+        pars_to_add['query_date'] = datetime.today().strftime('%Y-%m-%d')
+        return query, pars_to_add
+    
+    def tag(self, claims : list, pars_to_add : dict):
+        """ Clean up raw claims and add the query parameters to each of them """
+        return [{**pars_to_add, **c} for c in self.clean_up(response_list = claims)]
+    
+    ### run a single query combination
+    def run_combination(self, pars : tuple, verbose = False, checkpoint = None, overrides = None, planner = None, requests_per_second = None):
+        """ Make the claim search calls for one (query, languageCode, reviewPublisherSiteFilter) combination and tag the cleaned claims with the query parameters.
+        args:
+            pars: tuple, (query, languageCode, reviewPublisherSiteFilter)
+            verbose: logical, defaults to False
+            checkpoint: checkpoint_store, record every page and resume the combination from its last nextPageToken
+            overrides: dict, query parameters set by the planner, e.g. pageSize or maxAgeDays
+            planner: query_planner, records the result count and the number of calls of the combination
+            requests_per_second: float, cap on the api calls per second. Defaults to the instance attribute.
+        returns:
+            list of dictionaries
+        """
+        query, pars_to_add = self.query_for(pars, overrides)
+        ## pages fetched, and whether the pagination reached the last page
+        progress = dict(pages = 0, complete = False)
+        def on_page(claims, token):
+            progress['pages'] += 1
+            progress['complete'] = token is None
+            if checkpoint is not None:
+                checkpoint.save_page(pars, claims, token, overrides)
+        ## make the api cal
+        if checkpoint is None:
+            resp = self.claim_search(querystring = query, verbose = verbose, on_page = on_page, requests_per_second = requests_per_second)
+        else:
+            ## resume from the checkpoint
+            state = checkpoint.combination(pars, overrides)
+            previous = state['claims'] if state is not None else []
+            if state is not None and state['done']:
+                resp = previous
+                progress['complete'] = True
+            else:
+                if state is not None:
+                    query['pageToken'] = state['page_token']
+                resp = previous + (self.claim_search(querystring = query, verbose = verbose, on_page = on_page, requests_per_second = requests_per_second) or [])
+            resp = resp if len(resp) > 0 else None
+        if planner is not None:
+            planner.record(pars, claims = len(resp) if resp is not None else 0, pages = progress['pages'], complete = progress['complete'])
+        if not progress['complete']:
+            self.record_incomplete(pars)
         out = []
-        for claim in response_list:
-            ## normalize the dict
-            try:
-                cr = claim.get('claimReview')
-                print(cr)
-                if isinstance(cr, list):
-                    cr = cr[0]
-                my_d = dict(claim_reviewed = claim.get('text'),
-                        claimant = claim.get('claimant'),
-                        claim_date = claim.get('claimDate'),
-                        fact_check_url = cr.get('url'),
-                        fact_check_domain = self.get_candidate_value(cr, 'publisher_site', candidate_expressions = ['["publisher"]["site"]', "['site']"]),
-                        fact_check_author_name = self.get_candidate_value(cr, 'publisher_name', candidate_expressions = ['["publisher"]["name"]', "['name']"]),
-                        fact_check_title = cr.get('title'),
-                        fact_check_language_code = cr.get('languageCode'))
-                print(my_d)
-                out.append(my_d)                
-            except: 
-                pass
+        if resp is not None:
+            ## clean up, and for each response in the query add the query parameters
+            out = self.tag(resp, pars_to_add)
+        else:
+            self.metrics.inc('api_empty_combinations_total')
+            logger.info('No data retrieved for the query: %s', pars_to_add)
         return out
-        
-    ### run the query
-    def run_query(self, verbose = False):
-        """ Run multiple claim search calls."""
-        ### Generate batch queries
+    
+    def record_incomplete(self, pars : tuple):
+        """ Record a combination whose pagination stopped before its last page (open circuit, exhausted quota, api error), i.e. whose results are partial.
+        The planner does not count it as a complete run and its checkpoint is not done, so that a resumed run continues it. """
+        self.incomplete.append(pars)
+        self.metrics.inc('api_incomplete_combinations_total')
+        logger.warning('The query %s stopped before its last page, its results are partial.', pars)
+    
+    def report_incomplete(self):
+        """ Log the combinations of the run with partial results """
+        if len(self.incomplete) > 0:
+            logger.error('%s query combinations have partial results: %s. Run them again with a checkpoint and resume to complete them.', len(self.incomplete), self.incomplete)
+    
+    ### query combinations
+    def combinations(self):
+        """ Unique (query, languageCode, reviewPublisherSiteFilter) combinations of the query parameters """
         ## if one of the dynamic parameters is not list, turn it to list
         q = (self.query if isinstance(self.query, list) else [self.query])
         languageCode = (self.languageCode if isinstance(self.languageCode, list) else [self.languageCode])
         reviewPublisherSiteFilter = (self.reviewPublisherSiteFilter if isinstance(self.reviewPublisherSiteFilter, list) else [self.reviewPublisherSiteFilter])
-        ## find unique combinations of the parameters
-        combinations = list(product(q,languageCode,reviewPublisherSiteFilter))
+        return list(product(q,languageCode,reviewPublisherSiteFilter))
+    
+    ### plan a run
+    def plan(self, checkpoint = None, resume = False, shard = None, planner = None):
+        """ Prepare a run: combinations of the shard, checkpoints and query plan. See run_query for the arguments.
+        returns:
+            tuple, (list of (combination, query parameters overrides) tuples, checkpoint_store or None, query_planner or None)
+        """
+        self.incomplete = []
+        ### Generate batch queries
+        combinations = self.combinations()
+        ## sharded run, only the combinations of this shard
+        shard = parse_shard(shard)
+        if shard is not None:
+            combinations = [pars for pars in combinations if combination_in_shard(pars, shard)]
+            logger.info('Shard %s/%s: %s query combinations.', shard[0], shard[1], len(combinations))
+        ## checkpoints
+        checkpoint = checkpoint_store.open(checkpoint)
+        if checkpoint is not None and not resume:
+            checkpoint.reset(api = True, scraped = False)
+        ## query plan, the combinations to issue and their query parameters
+        planner = planner if planner is not None else self.planner
+        if planner is not None:
+            plan = planner.plan(combinations, self.query_dict)
+        else:
+            plan = [(pars, None) for pars in combinations]
+        return plan, checkpoint, planner
+    
+    ### stream the query results
+    def iter_query(self, verbose = False, max_workers = 1, requests_per_second = None, seen_index = None, checkpoint = None, resume = False, shard = None, planner = None):
+        """ Run multiple claim search calls, yielding the cleaned claims combination by combination instead of collecting them. See run_query for the arguments.
+        returns:
+            generator of dictionaries
+        """
+        plan, checkpoint, planner = self.plan(checkpoint = checkpoint, resume = resume, shard = shard, planner = planner)
+        run = lambda step: self.run_combination(step[0], verbose = verbose, checkpoint = checkpoint, overrides = step[1], planner = planner, requests_per_second = requests_per_second)
         ### Make the queries
-        out = []
-        query = dict(self.query_dict)
-        for pars in combinations:
-            ## add the dynamic parameters to the query string
-            query['query'] = pars[0]
-            query['languageCode'] = pars[1]
-            query['reviewPublisherSiteFilter'] = pars[2]
-            ## make the api cal
-            resp = self.claim_search(querystring = query, verbose = verbose)
-            ## make query dict with features to add
-            pars_to_add = {k:v for k,v in query.items() if k not in ['key', 'pageToken', 'offset', 'pageSize']}
-            pars_to_add['query_date'] = datetime.today().strftime('%Y-%m-%d')
-            if resp is not None:
-                ## clean up
-                cleaned = self.clean_up(response_list = resp)
-                if len(cleaned) > 0:
-                    ## for each response in the query add the query parameters and assign to list
-                    out.extend([{**pars_to_add, **c} for c in cleaned])
-            else:
-                print(f'No data retrieved for the query:\n{pars_to_add}\n')
-        ###
-        return out
+        if max_workers is None or max_workers <= 1:
+            results = map(run, plan)
+        else:
+            results = self.fan_out(run, plan, max_workers)
+        for res in results:
+            ## incremental mode, drop the claims already processed
+            if seen_index is not None:
+                res = seen_index.filter_new(res)
+            yield from res
+        self.report_incomplete()
+        if planner is not None:
+            logger.info(planner.report())
+    
+    @staticmethod
+    def fan_out(fn, combinations : list, max_workers : int):
+        """ Run fn over the combinations on a thread pool, yielding the results in the combination order. At most 2 * max_workers results are held at once."""
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            pending = deque()
+            for pars in combinations:
+                pending.append(executor.submit(fn, pars))
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    ### run the query
+    def run_query(self, verbose = False, max_workers = 1, requests_per_second = None, seen_index = None, checkpoint = None, resume = False, shard = None, planner = None):
+        """ Run multiple claim search calls.
+        args:
+            verbose: logical, defaults to False
+            max_workers: int, number of query combinations fetched concurrently. Defaults to 1, i.e. sequential.
+            requests_per_second: float, cap on the api calls per second for this api key (or per key of a key pool), for this run only. Defaults to the instance attribute.
+            seen_index: seen_claim_index, incremental mode. Only claims which are new or changed since they were last marked in the index are returned.
+            checkpoint: checkpoint_store or str (path to its sqlite file), records the completed combinations, the last nextPageToken of each combination and the claims fetched so far.
+            resume: logical, continue the job recorded in checkpoint instead of starting over. Defaults to False.
+            shard: str "i/N" or tuple (i, N), only run the i-th of N shards (0 <= i < N) of the query combinations, partitioned by a stable hash. Merge the shard outputs with sharding.merge_shards.
+            planner: query_planner, plan the calls from the history of previous runs. Overrides the instance attribute. Planned versus issued calls are in planner.stats.
+        returns:
+            list of dictionaries. Use iter_query to stream them instead. The combinations whose results are partial (e.g. after an open circuit or an exhausted quota) are listed in self.incomplete.
+        """
+        return list(self.iter_query(verbose = verbose, max_workers = max_workers, requests_per_second = requests_per_second, seen_index = seen_index, checkpoint = checkpoint, resume = resume, shard = shard, planner = planner))
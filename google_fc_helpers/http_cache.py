@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jan 21 20:31:08 2021
+
+@author: jmr
+"""
+import threading
+import sqlite3
+import json
+import time
+import re
+
+class cached_response:
+
+    """ Minimal stand-in for a requests response, served from the http cache """
+
+    def __init__(self, url : str, status_code : int, headers : dict, content : bytes):
+        from requests.structures import CaseInsensitiveDict
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.from_cache = True
+
+    @property
+    def encoding(self):
+        charset = re.search(r'charset=([\w-]+)', self.headers.get('Content-Type', ''))
+        return charset.group(1) if charset else 'utf-8'
+
+    @property
+    def text(self):
+        try:
+            return self.content.decode(self.encoding, errors = 'replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors = 'replace')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            from requests.exceptions import HTTPError
+            raise HTTPError(f'{self.status_code} Error for url: {self.url}', response = self)
+
+class http_cache:
+
+    """
+        Persistent, opt-in response cache for fact check pages, stored in a sqlite file.
+        Entries younger than ttl are served without a request. Older entries are revalidated with a conditional GET
+        (If-None-Match/If-Modified-Since) and refreshed on a 304. The least recently used entries are evicted once the cache grows past max_size.
+        Access times are kept in memory and written in batches, before an eviction or every access_flush_every hits.
+    """
+
+    ## pending access times are written every access_flush_every cache hits
+    access_flush_every = 500
+
+    ## headers which no longer describe the stored (already decoded) body
+    _dropped_headers = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+    def __init__(self, path : str, ttl : float = 7 * 24 * 3600, max_size : int = 1024 ** 3):
+        """
+        Instantiate class http_cache
+        args:
+            path: str, path to the sqlite file holding the cache
+            ttl: float, secs during which a cached page is served without contacting the server. Defaults to one week.
+            max_size: int, maximum size of the cached bodies in bytes. Defaults to 1GB.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = dict(hits = 0, revalidated = 0, misses = 0, evicted = 0)
+        self._lock = threading.Lock()
+        ## url -> access time not yet written to the index
+        self._accessed = {}
+        self._con = sqlite3.connect(path, check_same_thread = False)
+        self._con.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status_code INTEGER,
+                headers TEXT,
+                content BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )""")
+        self._con.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._con.commit()
+        self._size = self._con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._con.commit()
+            self._con.close()
+
+    def _count(self, stat : str, n : int = 1):
+        with self._lock:
+            self.stats[stat] += n
+
+    def _flush_accessed(self):
+        """ Write the pending access times. Expects the lock to be held, the caller commits."""
+        if len(self._accessed) > 0:
+            self._con.executemany('UPDATE responses SET accessed_at = ? WHERE url = ?', [(t, url) for url, t in self._accessed.items()])
+            self._accessed = {}
+
+    def _get(self, url : str):
+        with self._lock:
+            row = self._con.execute('SELECT url, status_code, headers, content, etag, last_modified, stored_at FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[url] = time.time()
+            if len(self._accessed) >= self.access_flush_every:
+                self._flush_accessed()
+                self._con.commit()
+        return dict(zip(['url', 'status_code', 'headers', 'content', 'etag', 'last_modified', 'stored_at'], row))
+
+    @staticmethod
+    def to_response(entry : dict):
+        return cached_response(url = entry['url'], status_code = entry['status_code'], headers = json.loads(entry['headers']), content = entry['content'])
+
+    def lookup(self, url : str):
+        """
+        Look a url up in the cache
+        returns:
+            tuple, (cached response if still fresh else None, cache entry or None)
+        """
+        entry = self._get(url)
+        if entry is not None and time.time() - entry['stored_at'] < self.ttl:
+            self._count('hits')
+            return self.to_response(entry), entry
+        return None, entry
+
+    @staticmethod
+    def conditional_headers(entry : dict = None):
+        """ Headers turning a GET into a conditional GET for a stale entry """
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url : str, entry : dict, response):
+        """
+        Update the cache with the server's response to a (conditional) GET
+        returns:
+            the response to use, the cached page on a 304
+        """
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.stats['revalidated'] += 1
+                self._con.execute('UPDATE responses SET stored_at = ? WHERE url = ?', (time.time(), url))
+                self._con.commit()
+            return self.to_response(entry)
+        self._count('misses')
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def store(self, url : str, response):
+        """ Store a response """
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in self._dropped_headers}
+        content = response.content
+        now = time.time()
+        with self._lock:
+            old = self._con.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self._accessed.pop(url, None)
+            self._con.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, response.status_code, json.dumps(headers), content, response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(content))
+                )
+            self._size += len(content) - (old[0] if old else 0)
+            self._evict()
+            self._con.commit()
+
+    def _evict(self):
+        """ Drop the least recently used entries until the cache fits in max_size. Expects the lock to be held."""
+        if self._size > self.max_size:
+            ## evict on up to date access times
+            self._flush_accessed()
+        while self._size > self.max_size:
+            rows = self._con.execute('SELECT url, size FROM responses ORDER BY accessed_at LIMIT 100').fetchall()
+            if len(rows) == 0:
+                break
+            for url, size in rows:
+                self._con.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self._size -= size
+                self.stats['evicted'] += 1
+                if self._size <= self.max_size:
+                    break
+
+    def fetch(self, url : str, send):
+        """
+        Serve a url from the cache or fetch it
+        args:
+            url: str
+            send: callable, takes a dict of extra request headers and returns a response
+        returns:
+            response or cached_response
+        """
+        cached, entry = self.lookup(url)
+        if cached is not None:
+            return cached
+        response = send(self.conditional_headers(entry))
+        return self.update(url, entry, response)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Feb  1 19:26:53 2021
+
+@author: jmr
+"""
+from contextlib import contextmanager
+import threading
+import logging
+import bisect
+import time
+
+## package logger, silent unless the application configures logging (see __init__.py)
+logger = logging.getLogger('google_fc_helpers')
+
+## default histogram buckets, in secs. The sub-ms ones resolve the parse timings.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class histogram:
+
+    """ Cumulative bucket histogram, prometheus style """
+
+    def __init__(self, buckets : tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value : float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q : float):
+        """ Approximate quantile, linearly interpolated within the bucket holding it. The buckets are narrowed to the observed min and max."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = self.min
+        for bound, n in zip(self.buckets + (self.max,), self.counts):
+            upper = min(bound, self.max)
+            if n > 0 and seen + n >= rank:
+                return lower + (upper - lower) * max(rank - seen, 0) / n
+            seen += n
+            lower = max(upper, self.min)
+        return self.max
+
+    def summary(self):
+        return dict(
+            count = self.count,
+            sum = round(self.sum, 6),
+            mean = round(self.sum / self.count, 6) if self.count else None,
+            min = self.min,
+            p50 = self.quantile(0.5),
+            p90 = self.quantile(0.9),
+            p99 = self.quantile(0.99),
+            max = self.max
+            )
+
+class metrics_registry:
+
+    """
+        Counters, timing histograms and event hooks for the api calls, retries, fetches and parsing.
+        Hooks are callables receiving (event name, dict of fields) for every emitted event, e.g. registry.add_hook(lambda event, fields: print(event, fields)).
+        Export with summary() or to_prometheus().
+    """
+
+    def __init__(self, prefix : str = 'gfc'):
+        """
+        Instantiate class metrics_registry
+        args:
+            prefix: str, prefix of the exported metric names
+        """
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.hooks = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name : str, labels : dict):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name : str, n : float = 1, **labels):
+        """ Increase a counter """
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name : str, value : float, **labels):
+        """ Add an observation to a histogram """
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name : str, **labels):
+        """ Time a block into a histogram """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_hook(self, hook):
+        """ Register a callable receiving (event name, fields) for every emitted event """
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def emit(self, event : str, **fields):
+        """ Pass an event on to the hooks and the package logger (debug level) """
+        logger.debug('%s %s', event, fields)
+        for hook in list(self.hooks):
+            try:
+                hook(event, fields)
+            except Exception as err:
+                logger.warning('Instrumentation hook %r failed: %s', hook, err)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def get(self, name : str, **labels):
+        """ Current value of a counter """
+        return self.counters.get(self._key(name, labels), 0)
+
+    def summary(self):
+        """ Dict with the counters and histogram summaries, keyed by 'name{label="value"}' """
+        with self._lock:
+            return dict(
+                counters = {self._series(name, labels): v for (name, labels), v in sorted(self.counters.items())},
+                histograms = {self._series(name, labels): h.summary() for (name, labels), h in sorted(self.histograms.items(), key = lambda kv: kv[0])}
+                )
+
+    @staticmethod
+    def _series(name : str, labels : tuple, extra : tuple = ()):
+        labels = tuple(labels) + tuple(extra)
+        if len(labels) == 0:
+            return name
+        escaped = ('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels)
+        return name + '{' + ','.join(escaped) + '}'
+
+    def to_prometheus(self):
+        """ Metrics in the prometheus text exposition format """
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), v in sorted(self.counters.items()):
+                full = f'{self.prefix}_{name}'
+                if full not in typed:
+                    lines.append(f'# TYPE {full} counter')
+                    typed.add(full)
+                lines.append(f'{self._series(full, labels)} {v}')
+            for (name, labels), h in sorted(self.histograms.items(), key = lambda kv: kv[0]):
+                full = f'{self.prefix}_{name}'
+                if full not in typed:
+                    lines.append(f'# TYPE {full} histogram')
+                    typed.add(full)
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{self._series(full + "_bucket", labels, (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{self._series(full + "_bucket", labels, (("le", "+Inf"),))} {h.count}')
+                lines.append(f'{self._series(full + "_sum", labels)} {h.sum}')
+                lines.append(f'{self._series(full + "_count", labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+## registry used unless a class is given its own
+default_registry = metrics_registry()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Feb 15 19:21:47 2021
+
+@author: jmr
+"""
+from datetime import datetime, timedelta, timezone
+from google_fc_helpers.throttle import get_rate_limiter
+from google_fc_helpers.instrumentation import default_registry, logger
+import threading
+import hashlib
+import time
+
+class quota_exhausted_error(Exception):
+    """ Raised when every key of a key_pool is out of quota """
+    pass
+
+def mask(key : str):
+    """ Printable form of an api key: its first characters (long keys only) and a short hash, distinct for distinct keys """
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+    return (key[:4] if len(key) > 8 else '') + '...' + digest
+
+class api_key:
+
+    """ State of one key of a key_pool: its rate limiter, daily quota and usage """
+
+    def __init__(self, key : str, requests_per_second : float = None, daily_quota : int = None):
+        self.key = key
+        self.limiter = get_rate_limiter(key, requests_per_second)
+        self.daily_quota = daily_quota
+        self.day = None
+        self.used_today = 0
+        ## time.time() until which the key is not used, after a 429 or once out of quota
+        self.cooldown_until = 0.0
+        self.stats = dict(requests = 0, throttled = 0, exhausted = 0)
+
+    def remaining(self):
+        """ Calls left today, None without daily quota """
+        today = datetime.now(timezone.utc).date()
+        if self.day != today:
+            self.day, self.used_today = today, 0
+        if self.daily_quota is None:
+            return None
+        return max(0, self.daily_quota - self.used_today)
+
+class key_pool:
+
+    """
+        Pool of google api keys, each with its own rate limit and daily quota, shared by every claim_search thread.
+        Each call goes to the available key with the most headroom (no wait on its rate limiter, then most calls left today).
+        A key answered with a 429 is set aside for a while and one out of its daily quota until the next (UTC) day, the calls failing over to the other keys.
+    """
+
+    ## secs a key is set aside after a 429 without Retry-After
+    cooldown = 60
+    ## maximum secs acquire waits for a key to come back from a cooldown before raising quota_exhausted_error
+    max_wait = 300
+
+    def __init__(self, keys : list, requests_per_second : float = None, daily_quota : int = None, metrics = None, **kwargs):
+        """
+        Instantiate class key_pool
+        args:
+            keys: list of str, or of dicts with key, requests_per_second and daily_quota to configure each key
+            requests_per_second: float, default rate limit per key
+            daily_quota: int, default number of calls per key and day
+            metrics: metrics_registry, per key call counters. Defaults to instrumentation.default_registry.
+        kwargs:
+            cooldown: float, secs a key is set aside after a 429. Defaults to 60.
+            max_wait: float, maximum secs to wait for a key before raising quota_exhausted_error. Defaults to 300.
+        """
+        for k in kwargs:
+            setattr(self, k, kwargs[k])
+        if len(keys) == 0:
+            raise ValueError('You must provide at least one google api key.')
+        self.keys = []
+        for k in keys:
+            k = dict(key = k) if isinstance(k, str) else dict(k)
+            self.keys.append(api_key(k['key'], requests_per_second = k.get('requests_per_second', requests_per_second), daily_quota = k.get('daily_quota', daily_quota)))
+        self.metrics = metrics if metrics is not None else default_registry
+        self._by_key = {k.key: k for k in self.keys}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _pick(self, requests_per_second : float = None):
+        """ The available key with the most headroom, or the time at which the first key becomes available. Expects the lock to be held."""
+        now = time.time()
+        candidates = []
+        for k in self.keys:
+            remaining = k.remaining()
+            if k.cooldown_until > now or remaining == 0:
+                continue
+            candidates.append((k.limiter.wait_time(requests_per_second), -(remaining if remaining is not None else float('inf')), k.stats['requests'], k))
+        if len(candidates) == 0:
+            return None, min(k.cooldown_until if k.remaining() != 0 else float('inf') for k in self.keys)
+        return min(candidates, key = lambda c: c[:3])[-1], None
+
+    def acquire(self, requests_per_second : float = None):
+        """
+        Take a call on the key with the most headroom, blocking on its rate limiter
+        args:
+            requests_per_second: float, rate limit per key of this call, e.g. the one passed to run_query. Defaults to the rate of each key.
+        returns:
+            str, the api key
+        """
+        start = time.time()
+        while True:
+            with self._lock:
+                k, available_at = self._pick(requests_per_second)
+                if k is not None:
+                    k.remaining()
+                    k.used_today += 1
+                    k.stats['requests'] += 1
+            if k is not None:
+                k.limiter.acquire(requests_per_second)
+                self.metrics.inc('api_key_requests_total', key = mask(k.key))
+                return k.key
+            if available_at - start > self.max_wait:
+                raise quota_exhausted_error(f'All {len(self.keys)} api keys are out of quota.')
+            time.sleep(max(0.0, available_at - time.time()))
+
+    def release(self, key : str, response = None):
+        """ Report the response of a call made with key. A 429 sets the key aside, for the rest of the day if its daily quota is exhausted."""
+        if response is None or response.status_code != 429:
+            return
+        k = self._by_key[key]
+        from google_fc_helpers.retry import retry_policy
+        retry_after = retry_policy.retry_after(response)
+        with self._lock:
+            if 'per day' in (response.text or '').lower():
+                tomorrow = datetime.now(timezone.utc).date() + timedelta(days = 1)
+                k.cooldown_until = datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo = timezone.utc).timestamp()
+                k.stats['exhausted'] += 1
+            else:
+                k.cooldown_until = time.time() + (retry_after if retry_after is not None else self.cooldown)
+            k.stats['throttled'] += 1
+        self.metrics.inc('api_key_throttled_total', key = mask(key))
+        logger.info('Api key %s throttled, set aside until %s.', mask(key), datetime.fromtimestamp(k.cooldown_until).isoformat(timespec = 'seconds'))
+
+    def available(self):
+        """ Whether a key can take a call right now """
+        with self._lock:
+            return self._pick()[0] is not None
+
+    def usage(self):
+        """ Usage per (masked) key: calls made, 429s, calls left today and cooldown """
+        now = time.time()
+        with self._lock:
+            return {mask(k.key): dict(k.stats, remaining_today = k.remaining(), cooling_down = max(0.0, round(k.cooldown_until - now, 1))) for k in self.keys}
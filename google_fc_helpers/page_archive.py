@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Feb 16 20:03:58 2021
+
+@author: jmr
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from google_fc_helpers.claim_review_parser import parse_page
+from google_fc_helpers.instrumentation import logger
+import threading
+import sqlite3
+import mmap
+import time
+import zlib
+import os
+
+def default_codec():
+    """ zstd if the zstandard package is installed, else zlib """
+    try:
+        import zstandard
+        return 'zstd'
+    except ImportError:
+        return 'zlib'
+
+def compress(content : bytes, codec : str):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level = 3).compress(content)
+    return zlib.compress(content, 6)
+
+def decompress(data : bytes, codec : str):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+class page_archive:
+
+    """
+        Compressed, append-only archive of fetched pages keyed by url. Each page is compressed on its own (zstd when available, else zlib)
+        and appended to the data file, its offset and length are kept in a sqlite index (path + '.idx') and reads go through an mmap of the data file.
+        Archiving a url again appends the new page, the index points to the latest one.
+    """
+
+    ## index commits are batched every commit_every pages
+    commit_every = 100
+
+    def __init__(self, path : str, codec : str = None, readonly : bool = False):
+        """
+        Instantiate class page_archive
+        args:
+            path: str, path to the archive data file, the index is stored next to it in path + '.idx'
+            codec: str, 'zstd' or 'zlib' for the new pages. Defaults to zstd if the zstandard package is installed, else zlib.
+            readonly: logical, open the archive for reading only, e.g. in the re-parse workers
+        """
+        self.path = path
+        self.codec = codec or default_codec()
+        self.readonly = readonly
+        self.stats = dict(pages = 0, raw_bytes = 0, stored_bytes = 0)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._mmap = None
+        self._f = open(path, 'rb' if readonly else 'ab+')
+        self._con = sqlite3.connect(path + '.idx', check_same_thread = False)
+        if not readonly:
+            self._con.execute('PRAGMA journal_mode = WAL')
+            self._con.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    offset INTEGER,
+                    length INTEGER,
+                    raw_length INTEGER,
+                    codec TEXT,
+                    status_code INTEGER,
+                    stored_at REAL
+                )""")
+            self._con.commit()
+
+    def close(self):
+        with self._lock:
+            if not self.readonly:
+                self._f.flush()
+                self._con.commit()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._f.close()
+            self._con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def __contains__(self, url : str):
+        with self._lock:
+            return self._con.execute('SELECT 1 FROM pages WHERE url = ?', (url,)).fetchone() is not None
+
+    def append(self, url : str, content : bytes, status_code : int = 200):
+        """ Archive a page """
+        data = compress(content, self.codec)
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            offset = self._f.tell()
+            self._f.write(data)
+            self._con.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)', (url, offset, len(data), len(content), self.codec, status_code, time.time()))
+            self.stats['pages'] += 1
+            self.stats['raw_bytes'] += len(content)
+            self.stats['stored_bytes'] += len(data)
+            self._pending += 1
+            ## the data reaches the file before the index points to it
+            if self._pending >= self.commit_every:
+                self.flush()
+
+    def flush(self):
+        """ Flush the data file and commit the index. Expects the lock to be held."""
+        self._f.flush()
+        self._con.commit()
+        self._pending = 0
+
+    def sync(self):
+        """ Make the pages archived so far durable, e.g. at the end of a batch. The index is otherwise only committed every commit_every pages and on close."""
+        with self._lock:
+            if not self.readonly:
+                self.flush()
+
+    def entries(self, urls : list = None):
+        """ Index rows (url, offset, length, codec) in file order, of every page or of those among urls """
+        with self._lock:
+            if not self.readonly:
+                self.flush()
+            rows = self._con.execute('SELECT url, offset, length, codec FROM pages ORDER BY offset').fetchall()
+        if urls is not None:
+            urls = set(urls)
+            rows = [r for r in rows if r[0] in urls]
+        return rows
+
+    def read(self, offset : int, length : int, codec : str):
+        """ Decompressed page at offset """
+        with self._lock:
+            if self._mmap is None or offset + length > len(self._mmap):
+                ## (re)map the data file, it grew since the last mapping
+                if not self.readonly:
+                    self._f.flush()
+                if self._mmap is not None:
+                    self._mmap.close()
+                self._mmap = mmap.mmap(self._f.fileno(), 0, access = mmap.ACCESS_READ)
+            data = self._mmap[offset:offset + length]
+        return decompress(data, codec)
+
+    def get(self, url : str):
+        """ The latest archived page of url, None if it was never archived """
+        with self._lock:
+            if not self.readonly:
+                self.flush()
+            row = self._con.execute('SELECT offset, length, codec FROM pages WHERE url = ?', (url,)).fetchone()
+        return self.read(*row) if row is not None else None
+
+    def items(self, urls : list = None):
+        """ Iterate over the (url, page) pairs in file order """
+        for url, offset, length, codec in self.entries(urls):
+            yield url, self.read(offset, length, codec)
+
+### offline re-parse
+def reparse_entries(path : str, rows : list, schema = None):
+    """ Parse a chunk of archived pages, None for the pages without a claim review or whose claim review could not be parsed. A module level function so that it can run in a process pool."""
+    with page_archive(path, readonly = True) as archive:
+        out = []
+        for url, offset, length, codec in rows:
+            try:
+                ## parse_page gives an empty dict for a claim review which could not be parsed
+                out.append((url, parse_page(archive.read(offset, length, codec), url, schema) or None))
+            except Exception as err:
+                logger.warning('Error occurred when re-parsing %s: %s.', url, err)
+                out.append((url, None))
+        return out
+
+def reparse(path : str, urls : list = None, schema = None, workers : int = None, chunk_size : int = 200):
+    """
+    Run the claim review parsing and cleaning over the archived pages, in parallel and without any network access
+    args:
+        path: str, path to the archive data file
+        urls: list of str, only re-parse these urls. Defaults to every archived page.
+        schema: extraction_schema, defaults to CLAIM_REVIEW_SCHEMA
+        workers: int, number of parsing processes. Defaults to the number of cores.
+        chunk_size: int, pages per task
+    returns:
+        generator of (url, cleaned claim review) tuples, the claim review is None if the page has none or it could not be parsed
+    """
+    with page_archive(path, readonly = True) as archive:
+        rows = archive.entries(urls)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(reparse_entries, path, chunk, schema))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def reparse_claims(claims, path : str, schema = None, workers : int = None, chunk_size : int = 200):
+    """
+    Enrich claims (e.g. a previous run's output) again from the archived pages of their fact_check_url
+    returns:
+        generator of dictionaries, the claims with an archived claim review page
+    """
+    claims = list(claims)
+    cleaned = dict(reparse(path, urls = [c.get('fact_check_url') for c in claims], schema = schema, workers = workers, chunk_size = chunk_size))
+    for claim in claims:
+        cr = cleaned.get(claim.get('fact_check_url'))
+        if cr is not None:
+            yield {**claim, **cr}
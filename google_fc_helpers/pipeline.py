@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Feb 18 20:47:05 2021
+
+@author: jmr
+"""
+import asyncio
+import time
+from google_fc_helpers.async_wrapper import async_claim_search
+from google_fc_helpers.async_scraper import claim_review_client
+from google_fc_helpers.checkpoint import checkpoint_store
+from google_fc_helpers.instrumentation import logger
+
+class claim_pipeline:
+
+    """
+        Fused api and scraping pipeline. As each api page arrives, its cleaned claims are pushed through a bounded queue to the scraping stage,
+        so that the claim reviews are fetched while the api is still paginating and the first enriched records come out after the first page.
+
+            pipe = claim_pipeline('example_query.json', scraper_kwargs = dict(max_per_domain = 4))
+            async for record in pipe.run():
+                ...
+            ## or, outside of an event loop
+            records = pipe.run_sync()
+    """
+
+    ## number of query combinations paginated concurrently
+    max_workers = 4
+    ## maximum number of claims waiting to be scraped, and of enriched records waiting to be consumed
+    queue_size = 1000
+    ## optional index of the claims already processed, for incremental runs
+    seen_index = None
+    ## optional checkpoints of the api pages and of the scraped urls, and whether to resume from them
+    checkpoint = None
+    resume = False
+    ## optional shard "i/N" of the query combinations, see sharding
+    shard = None
+    ## optional query planner, see planner.query_planner
+    planner = None
+    verbose = False
+
+    def __init__(self, query, search_kwargs : dict = None, scraper_kwargs : dict = None, client : claim_review_client = None, **kwargs):
+        """
+        Instantiate class claim_pipeline
+        args:
+            query: json file, dict of query parameters (see claim_search) or an async_claim_search instance
+            search_kwargs: dict, kwargs of async_claim_search, e.g. endpoint, requests_per_second or retry
+            scraper_kwargs: dict, kwargs of claim_review_client, e.g. max_concurrency, max_per_domain, cache, domain_cache, archive or pipeline (parse in a process pool)
+            client: claim_review_client, scraping stage to use instead of one built from scraper_kwargs. A client started by the caller (async with) stays open after the run.
+        kwargs:
+            max_workers: int, number of query combinations paginated concurrently. Defaults to 4.
+            queue_size: int, bound of the queues between the stages. Defaults to 1000.
+            seen_index: seen_claim_index, incremental mode. Known claims are dropped after the api stage and the scraped ones are marked.
+            checkpoint: checkpoint_store or str (path to its sqlite file), records the api pages and the scraped urls.
+            resume: logical, continue the job recorded in checkpoint. Defaults to False.
+            shard: str "i/N" or tuple (i, N), only run the i-th of N shards of the query combinations.
+            planner: query_planner, plan the api calls from the history of previous runs.
+            verbose: logical, log the api pages at info level. Defaults to False.
+        """
+        for k in kwargs:
+            setattr(self, k, kwargs[k])
+        self.search = query if isinstance(query, async_claim_search) else async_claim_search(query, **(search_kwargs or {}))
+        self.client = client if client is not None else claim_review_client(**(scraper_kwargs or {}))
+        self.checkpoint = checkpoint_store.open(self.checkpoint)
+        if self.seen_index is not None:
+            self.client.seen_index = self.seen_index
+        if self.checkpoint is not None:
+            self.client.checkpoint = self.checkpoint
+            self.client.resume = self.resume
+        ## claims out of the api stage, enriched records out of the scraping stage, time to the first enriched record
+        self.stats = dict(claims = 0, records = 0, resumed = 0, first_record_seconds = None, elapsed = 0.0)
+
+    async def run(self):
+        """
+        Run the pipeline
+        returns:
+            async generator of the enriched claims, in order of completion
+        """
+        start = time.perf_counter()
+        claims_queue = asyncio.Queue(maxsize = self.queue_size)
+        records_queue = asyncio.Queue(maxsize = self.queue_size)
+        ## scraping stage, the client's session is kept open if it was started by the caller
+        started = self.client.started
+        await self.client.start()
+        n_scrapers = self.client.max_concurrency
+        loop = asyncio.get_running_loop()
+        async def api_stage():
+            async for claim in self.search.iter_claims(verbose = self.verbose, max_workers = self.max_workers, seen_index = self.seen_index, checkpoint = self.checkpoint, resume = self.resume, shard = self.shard, planner = self.planner):
+                self.stats['claims'] += 1
+                await claims_queue.put(claim)
+            for _ in range(n_scrapers):
+                await claims_queue.put(None)
+        async def scraping_stage():
+            while True:
+                claim = await claims_queue.get()
+                if claim is None:
+                    break
+                url = claim.get('fact_check_url')
+                ## claim review already scraped, the sqlite calls run off the event loop
+                done = await loop.run_in_executor(None, self.checkpoint.scraped, [url]) if self.checkpoint is not None and self.resume else {}
+                if url in done:
+                    self.stats['resumed'] += 1
+                    record = {**claim, **done[url]} if done[url] is not None else None
+                    ## processed by the interrupted run, as enrich_claim marks the scraped ones
+                    if self.seen_index is not None:
+                        await loop.run_in_executor(None, self.seen_index.mark, [claim])
+                else:
+                    record = await self.client.enrich_claim(claim)
+                if record is not None:
+                    await records_queue.put(record)
+        async def stages():
+            tasks = [asyncio.ensure_future(api_stage())] + [asyncio.ensure_future(scraping_stage()) for _ in range(n_scrapers)]
+            try:
+                await asyncio.gather(*tasks)
+            except asyncio.CancelledError:
+                ## the consumer stopped, gather cancels the stages and nobody waits for the end of the records
+                raise
+            except Exception:
+                ## an error in one stage stops the others, which may be waiting on a queue, and is raised to the consumer
+                for t in tasks:
+                    t.cancel()
+                await records_queue.put(None)
+                raise
+            await records_queue.put(None)
+        task = asyncio.ensure_future(stages())
+        try:
+            while True:
+                record = await records_queue.get()
+                if record is None:
+                    break
+                if self.stats['first_record_seconds'] is None:
+                    self.stats['first_record_seconds'] = time.perf_counter() - start
+                    logger.info('First enriched record after %.2f secs.', self.stats['first_record_seconds'])
+                self.stats['records'] += 1
+                yield record
+            ## raise the errors of the stages
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+            if not started:
+                await self.client.close()
+            self.stats['elapsed'] = time.perf_counter() - start
+
+    def __aiter__(self):
+        return self.run()
+
+    async def collect(self):
+        """ Run the pipeline and collect the enriched claims """
+        return [record async for record in self.run()]
+
+    def run_sync(self):
+        """ Run the pipeline in a new event loop and return the enriched claims """
+        return asyncio.run(self.collect())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 13 18:26:51 2021
+
+@author: jmr
+"""
+from google_fc_helpers.checkpoint import checkpoint_store
+from google_fc_helpers.instrumentation import logger
+import threading
+import sqlite3
+import math
+import time
+import re
+
+def normalize_combination(pars : tuple):
+    """ Normalize a (query, languageCode, reviewPublisherSiteFilter) combination: collapsed whitespace, no empty strings, bare lower case publisher site """
+    query, language_code, site = (p.strip() if isinstance(p, str) else p for p in pars)
+    if isinstance(query, str):
+        query = re.sub(r'\s+', ' ', query)
+    if isinstance(site, str):
+        site = re.sub(r'^https?://', '', site.lower()).rstrip('/')
+    return tuple(p if p != '' else None for p in (query, language_code, site))
+
+class query_planner:
+
+    """
+        Plans the claim search calls of claim_search.run_query from the result counts of previous runs, stored in a sqlite file:
+            * normalizes and dedupes the query combinations
+            * sets the pageSize of each combination from its last result count, so that most combinations fit in one page
+            * skips the combinations which were empty in the last empty_runs runs, probing them again once every sample_every runs
+            * with delta = True, narrows maxAgeDays to the days since the last complete run of the combination
+        The planned, skipped and issued calls of the current run are reported in self.stats.
+    """
+
+    ## number of consecutive empty runs after which a combination is only sampled
+    empty_runs = 3
+    ## an empty combination is probed again once every sample_every runs
+    sample_every = 4
+    ## bounds of the tuned pageSize
+    min_page_size = 10
+    max_page_size = 100
+    ## head room over the last result count when sizing the pages
+    page_size_margin = 1.25
+    ## only request the days since the last complete run of each combination
+    delta = False
+    ## days of overlap added to the delta windows
+    delta_overlap_days = 1
+
+    def __init__(self, path : str = ':memory:', **kwargs):
+        """
+        Instantiate class query_planner
+        args:
+            path: str, path to the sqlite file holding the history of the result counts. Defaults to an in memory history.
+        kwargs:
+            empty_runs: int, consecutive empty runs after which a combination is skipped. Defaults to 3.
+            sample_every: int, skipped combinations are still issued once every sample_every runs. Defaults to 4.
+            min_page_size, max_page_size: int, bounds of the tuned pageSize. Default to 10 and 100.
+            page_size_margin: float, pageSize is the last result count times page_size_margin. Defaults to 1.25.
+            delta: logical, narrow maxAgeDays to the days since the last complete run. Defaults to False.
+            delta_overlap_days: int, days of overlap of the delta windows. Defaults to 1.
+        """
+        for k in kwargs:
+            setattr(self, k, kwargs[k])
+        self.path = path
+        self.run = 0
+        self.stats = dict(requested = 0, unique = 0, skipped = 0, planned_calls = 0, naive_calls = 0, issued_calls = 0)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread = False)
+        self._con.executescript("""
+            CREATE TABLE IF NOT EXISTS history (
+                key TEXT PRIMARY KEY,
+                runs INTEGER,
+                empty_streak INTEGER,
+                last_claims INTEGER,
+                last_pages INTEGER,
+                last_issued_run INTEGER,
+                last_success REAL
+            );
+            CREATE TABLE IF NOT EXISTS planner_runs (
+                run INTEGER PRIMARY KEY,
+                started_at REAL
+            );
+            """)
+        self._con.commit()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def history(self, pars : tuple):
+        """ History of a combination, None if it was never issued """
+        with self._lock:
+            row = self._con.execute('SELECT runs, empty_streak, last_claims, last_pages, last_issued_run, last_success FROM history WHERE key = ?', (checkpoint_store.combination_key(pars),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['runs', 'empty_streak', 'last_claims', 'last_pages', 'last_issued_run', 'last_success'], row))
+
+    def page_size(self, history : dict, default : int = None):
+        """ pageSize fitting the last result count of the combination """
+        if history is None or history['last_claims'] is None:
+            return default
+        size = math.ceil(history['last_claims'] * self.page_size_margin)
+        return max(self.min_page_size, min(self.max_page_size, size))
+
+    def max_age_days(self, history : dict, default : int = None):
+        """ maxAgeDays of the delta window since the last complete run, never wider than the requested one """
+        if not self.delta or history is None or history['last_success'] is None:
+            return default
+        days = math.ceil((time.time() - history['last_success']) / 86400) + self.delta_overlap_days
+        return days if default is None else min(days, int(default))
+
+    def skip(self, history : dict):
+        """ Whether a combination empty in the last empty_runs runs sits out this run """
+        if history is None or history['empty_streak'] < self.empty_runs:
+            return False
+        return self.run - history['last_issued_run'] < self.sample_every
+
+    def plan(self, combinations : list, query : dict):
+        """
+        Plan a run
+        args:
+            combinations: list of (query, languageCode, reviewPublisherSiteFilter) tuples, e.g. claim_search.combinations()
+            query: dict, the query parameters (pageSize, maxAgeDays)
+        returns:
+            list of (combination, dict of query parameters overrides) tuples, the combinations to issue
+        """
+        with self._lock:
+            self.run = self._con.execute('SELECT COALESCE(MAX(run), 0) + 1 FROM planner_runs').fetchone()[0]
+            self._con.execute('INSERT INTO planner_runs VALUES (?, ?)', (self.run, time.time()))
+            self._con.commit()
+        unique = list(dict.fromkeys(normalize_combination(pars) for pars in combinations))
+        default_page_size = query.get('pageSize')
+        self.stats = dict(requested = len(combinations), unique = len(unique), skipped = 0, planned_calls = 0, naive_calls = 0, issued_calls = 0)
+        out = []
+        for pars in unique:
+            history = self.history(pars)
+            expected = history['last_claims'] if history is not None and history['last_claims'] is not None else 0
+            self.stats['naive_calls'] += max(1, math.ceil(expected / (default_page_size or 10)))
+            if self.skip(history):
+                self.stats['skipped'] += 1
+                continue
+            overrides = dict(pageSize = self.page_size(history, default_page_size), maxAgeDays = self.max_age_days(history, query.get('maxAgeDays')))
+            self.stats['planned_calls'] += max(1, math.ceil(expected / (overrides['pageSize'] or 10)))
+            out.append((pars, overrides))
+        ## the naive plan issues every combination, duplicates included
+        self.stats['naive_calls'] += len(combinations) - len(unique)
+        logger.info('Query plan: %s', self.stats)
+        return out
+
+    def record(self, pars : tuple, claims : int, pages : int, complete : bool):
+        """
+        Record the outcome of a combination
+        args:
+            pars: tuple, the combination
+            claims: int, number of raw claims returned
+            pages: int, number of api calls issued
+            complete: logical, whether the pagination ran to the last page. Incomplete runs do not update the result counts.
+        """
+        key = checkpoint_store.combination_key(pars)
+        with self._lock:
+            self.stats['issued_calls'] += pages
+            row = self._con.execute('SELECT runs, empty_streak, last_claims, last_success FROM history WHERE key = ?', (key,)).fetchone()
+            runs, empty_streak, last_claims, last_success = row if row is not None else (0, 0, None, None)
+            if complete:
+                empty_streak = empty_streak + 1 if claims == 0 else 0
+                last_claims = claims
+                last_success = time.time()
+            self._con.execute('INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?)', (key, runs + 1, empty_streak, last_claims, pages, self.run, last_success))
+            self._con.commit()
+
+    def report(self):
+        """ Planned versus issued calls of the current run """
+        s = self.stats
+        return (f"{s['requested']} combinations requested, {s['unique']} unique, {s['skipped']} skipped. "
+                f"API calls: {s['naive_calls']} naive, {s['planned_calls']} planned, {s['issued_calls']} issued.")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Feb  8 19:55:02 2021
+
+@author: jmr
+"""
+from google_fc_helpers.extraction_schema import API_SCHEMA, CLAIM_REVIEW_SCHEMA
+import json
+import csv
+import sys
+
+## query parameters added to every claim by claim_search.run_query
+QUERY_FIELDS = ('query', 'languageCode', 'reviewPublisherSiteFilter', 'maxAgeDays', 'query_date')
+## fields of the claims returned by the api, and of the scraped claim reviews
+API_FIELDS = tuple(name for name, _ in API_SCHEMA.fields)
+CLAIM_REVIEW_FIELDS = tuple(name for name, _ in CLAIM_REVIEW_SCHEMA.fields if name not in API_FIELDS)
+FIELDS = QUERY_FIELDS + API_FIELDS + CLAIM_REVIEW_FIELDS
+
+## low cardinality columns, interned in memory and dictionary encoded in arrow/parquet
+DICTIONARY_COLUMNS = (
+    'query', 'languageCode', 'reviewPublisherSiteFilter', 'query_date', 'claimant', 'fact_check_domain', 'fact_check_author_name',
+    'fact_check_language_code', 'review_rating_type', 'review_rating_value', 'review_rating_best', 'review_rating_worst',
+    'review_rating_alternate_name', 'fact_check_author_type', 'fact_check_author_id', 'fact_check_author_url', 'item_reviewed_author_type'
+    )
+## integer columns
+INT_COLUMNS = ('maxAgeDays',)
+
+class claim_record:
+
+    """
+        Compact, typed representation of an (enriched) claim. One slot per field instead of a ~25 key dict.
+        Fields outside of FIELDS (e.g. added through a custom extraction schema) are kept in .extra.
+    """
+
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, **fields):
+        for name in FIELDS:
+            setattr(self, name, None)
+        self.extra = None
+        self.update(fields)
+
+    def update(self, fields : dict):
+        for name, value in fields.items():
+            if name in INT_COLUMNS:
+                value = to_int(value)
+            elif name in DICTIONARY_COLUMNS and isinstance(value, str):
+                value = sys.intern(value)
+            if name in FIELDS:
+                setattr(self, name, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+
+    @classmethod
+    def from_dict(cls, d : dict):
+        return cls(**d)
+
+    def to_dict(self):
+        out = {name: getattr(self, name) for name in FIELDS}
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    def __eq__(self, other):
+        return isinstance(other, claim_record) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'claim_record(fact_check_url={self.fact_check_url!r}, languageCode={self.languageCode!r})'
+
+def to_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def to_records(dicts):
+    """ Convert dicts (e.g. async_claim_review_parser.data) into claim records """
+    return [claim_record.from_dict(d) for d in dicts]
+
+def to_str(value):
+    """ Column value as a string, nested values as json """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii = False)
+    return str(value)
+
+def as_dicts(records):
+    return [r.to_dict() if isinstance(r, claim_record) else r for r in records]
+
+def columns_of(rows : list):
+    """ FIELDS first, then any additional key, in order of appearance """
+    extra = [k for k in dict.fromkeys(k for r in rows for k in r) if k not in FIELDS]
+    return list(FIELDS) + extra
+
+def arrow_schema(columns : list):
+    """ Arrow schema: dictionary encoded strings for DICTIONARY_COLUMNS, int64 for INT_COLUMNS, strings otherwise """
+    import pyarrow as pa
+    def column_type(c):
+        if c in INT_COLUMNS:
+            return pa.int64()
+        if c in DICTIONARY_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+    return pa.schema([(c, column_type(c)) for c in columns])
+
+def records_to_arrow(records, columns : list = None):
+    """
+    Batch conversion of claim records (or dicts) to a pyarrow Table. Requires pyarrow.
+    args:
+        records: list of claim_record or dict
+        columns: list of str, defaults to FIELDS plus any additional key
+    returns:
+        pyarrow.Table
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('records_to_arrow requires pyarrow: pip install pyarrow')
+    rows = as_dicts(records)
+    columns = columns or columns_of(rows)
+    arrays = []
+    for c in columns:
+        if c in INT_COLUMNS:
+            arrays.append(pa.array([to_int(r.get(c)) for r in rows], pa.int64()))
+        else:
+            array = pa.array([to_str(r.get(c)) for r in rows], pa.string())
+            arrays.append(array.dictionary_encode() if c in DICTIONARY_COLUMNS else array)
+    return pa.Table.from_arrays(arrays, schema = arrow_schema(columns))
+
+def write_parquet(records, path : str, columns : list = None, compression : str = 'zstd'):
+    """ Write claim records (or dicts) to a parquet file, dictionary encoding the low cardinality columns. Requires pyarrow."""
+    import pyarrow.parquet as pq
+    table = records_to_arrow(records, columns)
+    pq.write_table(table, path, compression = compression, use_dictionary = [c for c in table.column_names if c in DICTIONARY_COLUMNS])
+
+def write_csv(records, path : str, columns : list = None):
+    """ Write claim records (or dicts) to a csv file, nested values as json """
+    rows = as_dicts(records)
+    columns = columns or columns_of(rows)
+    with open(path, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for r in rows:
+            writer.writerow(['' if r.get(c) is None else to_str(r.get(c)) for c in columns])
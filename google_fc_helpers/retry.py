@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jan 19 19:12:40 2021
+
+@author: jmr
+"""
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from google_fc_helpers.instrumentation import default_registry, logger
+import threading
+import logging
+import random
+import time
+
+class circuit_open_error(Exception):
+    """ Raised when a host's circuit breaker is open and requests to it are being short-circuited """
+    pass
+
+class retry_policy:
+
+    """
+        Shared retry, back off and circuit breaker logic for the http calls made by claim_search and claim_review_parser.
+        Stops on the first non retryable response, honours Retry-After on 429/503, adds jitter to the back off, caps the total time
+        spent retrying and opens a circuit breaker per host after repeated failures (connection errors and 5xx, throttling 429s excluded).
+    """
+
+    ## http statuses worth retrying
+    retry_statuses = (429, 500, 502, 503, 504)
+    ## retried statuses which do not count toward the circuit breaker: throttling is not a failure of the host
+    throttle_statuses = (429,)
+
+    def __init__(self, max_retries : int = 5, back_off : float = 1.5, base_delay : float = 1, max_delay : float = 60, max_retry_time : float = 300, jitter : bool = True, failure_threshold : int = 5, reset_timeout : float = 60, metrics = None):
+        """
+        Instantiate class retry_policy
+        args:
+            max_retries: int, maximum number of attempts per request
+            back_off: float, exponential back off parameter, the n-th retry waits base_delay * n ** back_off secs
+            base_delay: float, delay of the first retry in secs
+            max_delay: float, upper bound for a single wait, Retry-After included
+            max_retry_time: float, maximum number of secs spent retrying a single request
+            jitter: logical, whether to randomize the back off
+            failure_threshold: int, consecutive failures after which a host's circuit opens
+            reset_timeout: float, secs before an open circuit lets a single trial request through
+            metrics: metrics_registry, where requests, retries and circuit breaker events are counted. Defaults to instrumentation.default_registry.
+        """
+        self.max_retries = max_retries
+        self.back_off = back_off
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_time = max_retry_time
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics if metrics is not None else default_registry
+        ## counters
+        self.stats = dict(requests = 0, retries = 0, failures = 0, circuit_open = 0)
+        ## host -> [consecutive failures, time at which the circuit opened, time at which the trial request of the half open circuit started]
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _count(self, stat : str, n : int = 1):
+        with self._lock:
+            self.stats[stat] += n
+
+    @staticmethod
+    def host(url : str):
+        return urlparse(url).netloc
+
+    @staticmethod
+    def retry_after(response = None):
+        """ Parse the Retry-After header, either delta seconds or an http date. Returns secs or None."""
+        if response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def is_retryable(self, response = None):
+        """ Whether a response (None meaning a connection error or timeout) should be retried """
+        return response is None or response.status_code in self.retry_statuses
+
+    def delay(self, attempt : int, response = None, back_off : float = None):
+        """ How long to wait before the next attempt. back_off: float, overrides the policy's back_off."""
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        back_off = back_off if back_off is not None else self.back_off
+        sleep_time = min(self.max_delay, self.base_delay * attempt ** back_off)
+        if self.jitter:
+            ## equal jitter, keeps at least half of the back off
+            sleep_time = sleep_time / 2 + random.uniform(0, sleep_time / 2)
+        return round(sleep_time, 2)
+
+    ### circuit breaker
+    def check_circuit(self, url : str):
+        """ Raise circuit_open_error if the host's circuit is open, or half open with its trial request in flight """
+        host = self.host(url)
+        with self._lock:
+            failures, opened_at, probe_at = self._hosts.get(host, [0, None, None])
+            if opened_at is None:
+                return
+            now = time.monotonic()
+            ## half open, let a single trial request through. Another one goes through if it never reported back.
+            if now - opened_at >= self.reset_timeout and (probe_at is None or now - probe_at >= self.reset_timeout):
+                self._hosts[host] = [failures, opened_at, now]
+                return
+            self.stats['circuit_open'] += 1
+        self.metrics.inc('circuit_open_total', host = host)
+        raise circuit_open_error(f'Circuit open for {host} after {failures} consecutive failures.')
+
+    def record_success(self, url : str):
+        with self._lock:
+            self._hosts.pop(self.host(url), None)
+
+    def record_failure(self, url : str):
+        host = self.host(url)
+        with self._lock:
+            self.stats['failures'] += 1
+            failures, opened_at, probe_at = self._hosts.get(host, [0, None, None])
+            failures += 1
+            ## (re)open the circuit, a failed trial request included
+            if failures >= self.failure_threshold:
+                opened_at, probe_at = time.monotonic(), None
+            self._hosts[host] = [failures, opened_at, probe_at]
+        self.metrics.inc('http_failures_total', host = host)
+
+    def request(self, send, url : str, max_retries : int = None, verbose : bool = True, back_off : float = None):
+        """
+        Call send() until it returns a non retryable response or the retry budget is exhausted
+        args:
+            send: callable, makes the http request and returns a response object
+            url: str, requested url, used to key the circuit breaker
+            max_retries: int, overrides the policy's max_retries
+            verbose: logical, log the retries at info level instead of debug
+            back_off: float, overrides the policy's back_off
+        returns:
+            the last response. Raises the last connection error if no response was ever obtained.
+        """
+        from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+        max_retries = max_retries or self.max_retries
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            self.check_circuit(url)
+            attempts += 1
+            self._count('requests')
+            self.metrics.inc('http_requests_total', host = self.host(url))
+            response = None
+            error = None
+            try:
+                response = send()
+            except (RequestsConnectionError, Timeout) as err:
+                error = err
+            if not self.is_retryable(response):
+                self.record_success(url)
+                return response
+            if response is None or response.status_code not in self.throttle_statuses:
+                self.record_failure(url)
+            sleep_time = self.delay(attempts, response, back_off)
+            if attempts >= max_retries or time.monotonic() - start + sleep_time > self.max_retry_time:
+                if response is None:
+                    raise error
+                return response
+            reason = error if response is None else f'HTTP {response.status_code}'
+            logger.log(logging.INFO if verbose else logging.DEBUG, '%s when requesting %s. Retrying in %s secs.', reason, url, sleep_time)
+            self._count('retries')
+            self.metrics.inc('http_retries_total', host = self.host(url))
+            self.metrics.emit('retry', url = url, attempt = attempts, reason = str(reason), sleep_time = sleep_time)
+            time.sleep(sleep_time)
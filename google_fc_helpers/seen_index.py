@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jan 23 16:45:19 2021
+
+@author: jmr
+"""
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+## query parameters which do not change the page
+TRACKING_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid', 'amp')
+
+## api fields whose change means the fact check was updated
+FINGERPRINT_FIELDS = ('claim_reviewed', 'claimant', 'claim_date', 'fact_check_title', 'fact_check_language_code')
+
+def normalize_url(url : str):
+    """ Normalize a fact check url: lower case scheme and host, no fragment, no tracking parameters, sorted query, no trailing slash """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values = True) if k.lower() not in TRACKING_PARAMS))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+def fingerprint(record : dict):
+    """ Content fingerprint of a claim record as returned by claim_search.run_query """
+    payload = json.dumps([record.get(k) for k in FINGERPRINT_FIELDS], ensure_ascii = False, default = str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class seen_claim_index:
+
+    """
+        Local index of the claims already processed, stored in a sqlite file and keyed by the normalized fact_check_url.
+        Used for incremental runs: known claims whose fingerprint did not change are skipped before any fetch.
+    """
+
+    def __init__(self, path : str):
+        """
+        Instantiate class seen_claim_index
+        args:
+            path: str, path to the sqlite file holding the index
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread = False)
+        self._con.execute("""
+            CREATE TABLE IF NOT EXISTS seen (
+                url TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                first_seen REAL,
+                last_seen REAL
+            )""")
+        self._con.commit()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def is_new(self, record : dict):
+        """ Whether a claim record is unknown or changed since it was last marked """
+        url = record.get('fact_check_url')
+        if url is None:
+            return True
+        with self._lock:
+            row = self._con.execute('SELECT fingerprint FROM seen WHERE url = ?', (normalize_url(url),)).fetchone()
+        return row is None or row[0] != fingerprint(record)
+
+    def filter_new(self, records : list):
+        """ Keep only the new or changed claim records """
+        return [r for r in records if self.is_new(r)]
+
+    def mark(self, records : list):
+        """ Record claims as processed """
+        now = time.time()
+        rows = [(normalize_url(r['fact_check_url']), fingerprint(r), now, now) for r in records if r.get('fact_check_url') is not None]
+        with self._lock:
+            self._con.executemany(
+                'INSERT INTO seen VALUES (?, ?, ?, ?) ON CONFLICT(url) DO UPDATE SET fingerprint = excluded.fingerprint, last_seen = excluded.last_seen',
+                rows
+                )
+            self._con.commit()
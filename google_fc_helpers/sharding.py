@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Feb 12 19:08:44 2021
+
+@author: jmr
+
+Sharded runs: the query combinations (and claim urls) are partitioned into N shards by a stable hash,
+so that N workers, on as many cores or machines, run "--shard i/N" independently and without any coordination.
+merge_shards then combines and deduplicates their outputs.
+"""
+from google_fc_helpers.seen_index import normalize_url
+from google_fc_helpers.checkpoint import checkpoint_store
+from google_fc_helpers.instrumentation import logger
+import hashlib
+import os
+import json
+import csv
+
+def parse_shard(shard):
+    """
+    Parse a shard specification
+    args:
+        shard: str "i/N" or tuple (i, N), with 0 <= i < N
+    returns:
+        tuple (i, N), or None if shard is None
+    """
+    if shard is None:
+        return None
+    if isinstance(shard, str):
+        try:
+            i, n = (int(x) for x in shard.split('/'))
+        except ValueError:
+            raise ValueError(f'Invalid shard {shard!r}, expected "i/N", e.g. "0/4".')
+    else:
+        i, n = shard
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f'Invalid shard {i}/{n}, expected 0 <= i < N.')
+    return i, n
+
+def shard_of(key : str, n : int):
+    """ Shard (0 to n - 1) of a key. Stable across processes, machines and python versions, unlike hash()."""
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n
+
+def in_shard(key : str, shard):
+    """ Whether a key belongs to a shard, every key belongs to the None shard """
+    shard = parse_shard(shard)
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+def combination_in_shard(pars : tuple, shard):
+    """ Whether a (query, languageCode, reviewPublisherSiteFilter) combination belongs to a shard """
+    return in_shard(checkpoint_store.combination_key(pars), shard)
+
+def claim_in_shard(claim : dict, shard):
+    """ Whether a claim belongs to a shard, by its normalized fact_check_url """
+    url = claim.get('fact_check_url')
+    return in_shard(normalize_url(url) if url else '', shard)
+
+### merge step
+def iter_records(path : str):
+    """ Read back the records of a shard output: .jsonl, .json, .csv or .parquet (requires pyarrow). Missing or empty files hold no records, e.g. a shard which found nothing or failed."""
+    if not os.path.exists(path):
+        logger.warning('Shard output %s does not exist, skipping it.', path)
+        return
+    if os.path.getsize(path) == 0:
+        return
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    elif path.endswith('.csv'):
+        with open(path, newline = '', encoding = 'utf-8') as f:
+            for row in csv.DictReader(f):
+                yield {k: (v if v != '' else None) for k, v in row.items()}
+    elif path.endswith('.json'):
+        with open(path, encoding = 'utf-8') as f:
+            yield from json.load(f)
+    else:
+        with open(path, encoding = 'utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def record_key(record : dict, by_url : bool = False):
+    """ Deduplication key of a record: the normalized fact_check_url, within its query combination unless by_url """
+    url = record.get('fact_check_url')
+    url = normalize_url(url) if url else None
+    if by_url:
+        return url
+    return json.dumps([record.get('query'), record.get('languageCode'), record.get('reviewPublisherSiteFilter'), url], ensure_ascii = False, default = str)
+
+def iter_merged(paths : list, by_url : bool = False):
+    """
+    Combine shard outputs, keeping the first occurrence of each record
+    args:
+        paths: list of str, shard output files
+        by_url: logical, one record per fact check url instead of one per query combination and url. Defaults to False.
+    returns:
+        generator of dictionaries
+    """
+    seen = set()
+    for path in paths:
+        for record in iter_records(path):
+            key = hashlib.md5(str(record_key(record, by_url = by_url)).encode('utf-8')).digest()
+            if key in seen:
+                continue
+            seen.add(key)
+            yield record
+
+def merge_shards(paths : list, output : str, by_url : bool = False):
+    """
+    Merge and deduplicate shard outputs into one file, in the format given by its extension
+    returns:
+        int, number of records written
+    """
+    from google_fc_helpers.sinks import open_sink
+    with open_sink(output) as sink:
+        return sink.consume(iter_merged(paths, by_url = by_url))
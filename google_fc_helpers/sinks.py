@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb  6 17:33:41 2021
+
+@author: jmr
+"""
+from google_fc_helpers.records import claim_record, records_to_arrow, arrow_schema, columns_of, as_dicts, to_str, FIELDS
+from google_fc_helpers.instrumentation import logger
+import json
+import csv
+import abc
+
+class record_sink(abc.ABC):
+
+    """ Base class of the sinks. Records are written incrementally, use as a context manager or call close()."""
+
+    @abc.abstractmethod
+    def write(self, record : dict):
+        pass
+
+    def close(self):
+        pass
+
+    def consume(self, records):
+        """ Write every record of an iterable (e.g. claim_search.iter_query() or iter_claim_reviews()). Returns the number of records written."""
+        n = 0
+        for record in records:
+            self.write(record)
+            n += 1
+        return n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def check_columns(self, rows : list):
+        """ Warn, once per key, about the keys of rows left out of columns frozen by an earlier record. Pass columns explicitly to keep them."""
+        dropped = [k for k in dict.fromkeys(k for r in rows for k in r) if k not in self._columns_set and k not in self._dropped]
+        if len(dropped) > 0:
+            self._dropped.update(dropped)
+            logger.warning('%s: dropping the keys %s, which were not in the first records. Pass columns to keep them.', self.path, ', '.join(dropped))
+
+class jsonl_sink(record_sink):
+
+    """ Writes one json record per line """
+
+    def __init__(self, path : str, mode : str = 'w'):
+        """
+        Instantiate class jsonl_sink
+        args:
+            path: str, path to the output file
+            mode: str, 'w' to overwrite, 'a' to append
+        """
+        self.path = path
+        self._f = open(path, mode, encoding = 'utf-8')
+
+    def write(self, record):
+        if isinstance(record, claim_record):
+            record = record.to_dict()
+        self._f.write(json.dumps(record, ensure_ascii = False) + '\n')
+
+    def close(self):
+        self._f.close()
+
+class json_sink(record_sink):
+
+    """ Writes the records as one json array, as in examples/pipeline_example.py, but incrementally """
+
+    def __init__(self, path : str, indent : int = None):
+        """
+        Instantiate class json_sink
+        args:
+            path: str, path to the output file
+            indent: int, json indentation of each record
+        """
+        self.path = path
+        self.indent = indent
+        self._f = open(path, 'w', encoding = 'utf-8')
+        self._f.write('[')
+        self._first = True
+
+    def write(self, record):
+        if isinstance(record, claim_record):
+            record = record.to_dict()
+        self._f.write(('\n' if self._first else ',\n') + json.dumps(record, ensure_ascii = False, indent = self.indent))
+        self._first = False
+
+    def close(self):
+        self._f.write('\n]\n')
+        self._f.close()
+
+class csv_sink(record_sink):
+
+    """ Writes records to a csv file, nested values as json """
+
+    def __init__(self, path : str, columns : list = None):
+        """
+        Instantiate class csv_sink
+        args:
+            path: str, path to the output file
+            columns: list of str, output columns. Defaults to records.FIELDS plus the additional keys of the first record, later keys are dropped with a warning.
+        """
+        self.path = path
+        self.columns = columns
+        ## columns inferred from the first record, and the keys dropped since
+        self._inferred = columns is None
+        self._dropped = set()
+        self._f = open(path, 'w', newline = '', encoding = 'utf-8')
+        self._writer = csv.writer(self._f)
+
+    def write(self, record):
+        record = as_dicts([record])[0]
+        if self.columns is None:
+            self.columns = columns_of([record])
+            self._columns_set = set(self.columns)
+        elif self._inferred:
+            self.check_columns([record])
+        if self._f.tell() == 0:
+            self._writer.writerow(self.columns)
+        self._writer.writerow(['' if record.get(c) is None else to_str(record.get(c)) for c in self.columns])
+
+    def close(self):
+        self._f.close()
+
+class parquet_sink(record_sink):
+
+    """ Writes records to a parquet file, one row group per batch_size records, dictionary encoding the low cardinality columns (see records.records_to_arrow). Requires pyarrow. """
+
+    def __init__(self, path : str, batch_size : int = 10000, columns : list = None, compression : str = 'zstd'):
+        """
+        Instantiate class parquet_sink
+        args:
+            path: str, path to the output file
+            batch_size: int, number of records buffered before a row group is written
+            columns: list of str, output columns. Defaults to records.FIELDS plus the additional keys of the first batch, later keys are dropped with a warning.
+            compression: str, parquet compression codec
+        """
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('parquet_sink requires pyarrow: pip install pyarrow')
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.batch_size = batch_size
+        self.columns = columns
+        self.compression = compression
+        self._inferred = columns is None
+        self._dropped = set()
+        self._buffer = []
+        self._writer = None
+
+    def write(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._buffer) == 0:
+            return
+        if self.columns is None:
+            self.columns = columns_of(as_dicts(self._buffer))
+            self._columns_set = set(self.columns)
+        elif self._inferred:
+            self.check_columns(as_dicts(self._buffer))
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, arrow_schema(self.columns), compression = self.compression)
+        self._writer.write_table(records_to_arrow(self._buffer, self.columns))
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._writer is None:
+            ## no records, still write a (schema only) file so that every output can be read back, e.g. by merge_shards
+            self._writer = self._pq.ParquetWriter(self.path, arrow_schema(self.columns or FIELDS), compression = self.compression)
+        self._writer.close()
+
+def open_sink(path : str):
+    """ Sink matching the output file extension: .parquet, .csv, .json, else jsonl """
+    if path.endswith('.parquet'):
+        return parquet_sink(path)
+    if path.endswith('.csv'):
+        return csv_sink(path)
+    if path.endswith('.json'):
+        return json_sink(path)
+    return jsonl_sink(path)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jan 18 21:07:12 2021
+
+@author: jmr
+"""
+import threading
+import time
+
+class rate_limiter:
+
+    """ Thread-safe token bucket. Caps the number of calls per second shared by every thread using the same instance."""
+
+    def __init__(self, requests_per_second : float = None, burst : int = 1):
+        """
+        Instantiate class rate_limiter
+        args:
+            requests_per_second: float, maximum sustained rate. None disables the cap.
+            burst: int, how many calls can be made back to back before the rate kicks in
+        """
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait_time(self, requests_per_second : float = None):
+        """ Secs until a token is available, without taking it. requests_per_second: float, rate of this call, defaults to the limiter's."""
+        rate = requests_per_second if requests_per_second is not None else self.requests_per_second
+        if not rate:
+            return 0.0
+        with self._lock:
+            tokens = min(self.burst, self._tokens + (time.monotonic() - self._last) * rate)
+        return max(0.0, (1 - tokens) / rate)
+
+    def acquire(self, requests_per_second : float = None):
+        """ Block until a token is available. requests_per_second: float, rate of this call, defaults to the limiter's."""
+        rate = requests_per_second if requests_per_second is not None else self.requests_per_second
+        if not rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                ## refill the bucket
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / rate
+            time.sleep(wait)
+
+## one limiter per api key, shared across claim_search instances and threads
+_limiters = {}
+_limiters_lock = threading.Lock()
+## default of get_rate_limiter, keep the rate of an existing limiter
+_keep = object()
+
+def get_rate_limiter(key : str, requests_per_second : float = _keep):
+    """ Fetch (or create) the rate limiter associated with a given api key
+    args:
+        key: str, api key
+        requests_per_second: float, set the rate of the limiter. None removes the cap. Omitted, an existing limiter keeps its rate.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = rate_limiter(requests_per_second = requests_per_second if requests_per_second is not _keep else None)
+            _limiters[key] = limiter
+        elif requests_per_second is not _keep:
+            limiter.requests_per_second = requests_per_second
+        return limiter
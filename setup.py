@@ -13,10 +13,16 @@ setup(
       long_description=long_description,
       long_description_content_type="text/markdown",
       install_requires=[
-              "lxml>=4.3.3",
-              "requests_html>=0.10.0",
               "requests>=2.22.0",
               "extruct>=0.12.0"
              ],
+      entry_points={
+              "console_scripts": ["gfc-helpers=google_fc_helpers.cli:main"]
+             },
+      extras_require={
+              "parquet": ["pyarrow>=3.0.0"],
+              "archive": ["zstandard>=0.15.0"],
+              "bench": ["lxml>=4.6.0"]
+             },
       python_requires='>=3.7',
 )
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 13:34:12 2021
+
+@author: jmr
+
+Offline stand-ins for the http responses and the scraper session, shared by the tests.
+"""
+import asyncio
+import json
+from google_fc_helpers.async_scraper import claim_review_client
+from google_fc_helpers.instrumentation import metrics_registry
+
+def page_html(n : int):
+    cr = {'@context': 'https://schema.org', '@type': 'ClaimReview', 'claimReviewed': f'claim {n}', 'url': f'https://factcheck.example.org/{n}', 'reviewRating': {'@type': 'Rating', 'alternateName': 'False'}}
+    return f'<html><head><script type="application/ld+json">{json.dumps(cr)}</script></head><body></body></html>'.encode('utf-8')
+
+class fake_response:
+    def __init__(self, status_code : int = 200, content : bytes = b'', text : str = '', headers : dict = None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if not self.ok:
+            from requests.exceptions import HTTPError
+            raise HTTPError(f'{self.status_code} Error')
+
+class fake_session:
+    """ Serves the fact check pages of the claims, answering a 500 for the urls in errors """
+    def __init__(self, errors : set):
+        self.errors = errors
+        self.requested = []
+    async def get(self, url : str, headers : dict = None, timeout : float = None):
+        self.requested.append(url)
+        if url in self.errors:
+            return fake_response(500, b'server error')
+        if url.endswith('/none'):
+            return fake_response(200, b'<html><body>no claim review</body></html>')
+        return fake_response(200, page_html(int(url.rsplit('/', 1)[-1])))
+    async def close(self):
+        pass
+
+def enrich(claims : list, session : fake_session, **kwargs):
+    class client(claim_review_client):
+        def session(self):
+            return session
+    async def run():
+        async with client(metrics = metrics_registry(), **kwargs) as c:
+            return await c.enrich(claims)
+    return asyncio.run(run())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 11:40:52 2021
+
+@author: jmr
+"""
+import asyncio
+import json
+from google_fc_helpers.checkpoint import checkpoint_store
+from google_fc_helpers.google_fc_wrapper import claim_search
+from google_fc_helpers.async_scraper import claim_review_client
+from google_fc_helpers.instrumentation import metrics_registry
+
+PARS = ('covid', 'en', None)
+
+def page_html(n : int):
+    cr = {'@context': 'https://schema.org', '@type': 'ClaimReview', 'claimReviewed': f'claim {n}', 'url': f'https://factcheck.example.org/{n}', 'reviewRating': {'@type': 'Rating', 'alternateName': 'False'}}
+    return f'<html><head><script type="application/ld+json">{json.dumps(cr)}</script></head><body></body></html>'.encode('utf-8')
+
+class fake_response:
+    def __init__(self, status_code : int = 200, content : bytes = b'', text : str = ''):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+        self.text = text
+        self.headers = {}
+
+class stub_search(claim_search):
+    """ claim_search answering from a list of pages, failing the calls listed in fail_pages """
+    def request_page(self, querystring : dict, verbose = True, max_retries = None, requests_per_second = None, back_off = None):
+        page = int(querystring.get('pageToken') or 0)
+        self.calls.append(page)
+        if page in self.fail_pages:
+            return None
+        claims = [{'text': f'claim {page}-{i}', 'claimReview': [{'url': f'https://factcheck.example.org/{page}-{i}'}]} for i in range(2)]
+        body = {'claims': claims}
+        if page + 1 < self.pages:
+            body['nextPageToken'] = str(page + 1)
+        return fake_response(text = json.dumps(body))
+
+def search(**kwargs):
+    kwargs = {'metrics': metrics_registry(), 'calls': [], 'pages': 3, 'fail_pages': (), **kwargs}
+    return stub_search({'key': 'test-key', 'query': 'covid', 'languageCode': 'en', 'reviewPublisherSiteFilter': None}, **kwargs)
+
+def test_combination_state(tmp_path):
+    store = checkpoint_store(str(tmp_path / 'ck.sqlite'))
+    assert store.combination(PARS) is None
+    store.save_page(PARS, [{'text': 'a'}], '1')
+    store.save_page(PARS, [{'text': 'b'}], None)
+    assert store.combination(PARS) == dict(done = True, page_token = None, claims = [{'text': 'a'}, {'text': 'b'}])
+    ## pages fetched with other query parameters are kept apart
+    assert store.combination(PARS, dict(pageSize = 50)) is None
+    assert store.combination_key(PARS, dict(pageSize = None)) == store.combination_key(PARS)
+    ## the delta window moves every day, a job resumed on a later day continues its combinations
+    assert store.combination(PARS, dict(maxAgeDays = 3)) == store.combination(PARS)
+    assert store.combination_key(PARS, dict(pageSize = 50, maxAgeDays = 3)) == store.combination_key(PARS, dict(pageSize = 50, maxAgeDays = 4))
+    store.reset(api = True, scraped = False)
+    assert store.combination(PARS) is None
+
+def test_run_query_resume(tmp_path):
+    path = str(tmp_path / 'ck.sqlite')
+    cs = search(fail_pages = (1,))
+    assert len(cs.run_query(checkpoint = path)) == 2
+    ## the resumed run starts from the failed page
+    cs.fail_pages = ()
+    cs.calls = []
+    out = cs.run_query(checkpoint = path, resume = True)
+    assert cs.calls == [1, 2]
+    assert [c['claim_reviewed'] for c in out] == [f'claim {p}-{i}' for p in range(3) for i in range(2)]
+    ## a complete combination is not called again
+    cs.calls = []
+    assert len(cs.run_query(checkpoint = path, resume = True)) == 6
+    assert cs.calls == []
+    ## without resume the job starts over
+    assert len(cs.run_query(checkpoint = path)) == 6
+    assert cs.calls == [0, 1, 2]
+
+class fake_session:
+    """ Serves the fact check pages of the claims, answering a 500 for the urls in errors """
+    def __init__(self, errors : set):
+        self.errors = errors
+        self.requested = []
+    async def get(self, url : str, headers : dict = None, timeout : float = None):
+        self.requested.append(url)
+        if url in self.errors:
+            return fake_response(500, b'server error')
+        if url.endswith('/none'):
+            return fake_response(200, b'<html><body>no claim review</body></html>')
+        return fake_response(200, page_html(int(url.rsplit('/', 1)[-1])))
+    async def close(self):
+        pass
+
+def enrich(claims : list, session : fake_session, **kwargs):
+    class client(claim_review_client):
+        def session(self):
+            return session
+    async def run():
+        async with client(metrics = metrics_registry(), **kwargs) as c:
+            return await c.enrich(claims)
+    return asyncio.run(run())
+
+def test_scraper_resume(tmp_path):
+    path = str(tmp_path / 'ck.sqlite')
+    claims = [{'fact_check_url': f'https://factcheck.example.org/{n}'} for n in range(4)] + [{'fact_check_url': 'https://factcheck.example.org/none'}]
+    failed = claims[2]['fact_check_url']
+    session = fake_session(errors = {failed})
+    out = enrich(claims, session, checkpoint = path)
+    assert len(out) == 3
+    ## failures are not checkpointed, pages without claim review are
+    scraped = checkpoint_store(path).scraped()
+    assert failed not in scraped
+    assert scraped['https://factcheck.example.org/none'] is None
+    assert scraped[claims[0]['fact_check_url']]['claim_reviewed'] == 'claim 0'
+    ## the resumed job only fetches the failed page
+    session = fake_session(errors = set())
+    out = enrich(claims, session, checkpoint = path, resume = True)
+    assert session.requested == [failed]
+    assert sorted(d['claim_reviewed'] for d in out) == [f'claim {n}' for n in range(4)]
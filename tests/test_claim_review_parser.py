@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 17:48:15 2021
+
+@author: jmr
+"""
+import os
+import pytest
+from google_fc_helpers.claim_review_parser import claim_review_parser, claim_review_blocks, extract_json_ld, parse_page
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'json_ld')
+
+def fixture(name : str):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+def url(name : str):
+    return 'https://factcheck.example.org/' + name.split('.')[0]
+
+@pytest.mark.parametrize('name, claim', [
+    ('attributes.html', 'single quoted type, attributes first'),
+    ('unquoted.html', 'unquoted type, upper case tag'),
+    ('graph.html', 'claim review inside a graph'),
+    ('array.html', 'claim review inside an array'),
+    ('comment.html', 'wrapped in an html comment'),
+    ('cdata.html', 'wrapped in cdata'),
+    ])
+def test_fast_path(name, claim):
+    parser = claim_review_parser()
+    def no_extruct(html, url):
+        raise AssertionError('the fast path should decode the page')
+    parser.extruct_json_ld = no_extruct
+    cr = parser.parse_claim_review(fixture(name), url(name))
+    assert cr['claimReviewed'] == claim
+    assert parser.clean_claim_review(cr)['fact_check_url'] == url(name)
+
+def test_blocks():
+    ## only the blocks mentioning a claim review are decoded
+    assert len(claim_review_blocks(fixture('attributes.html'))) == 1
+    assert claim_review_blocks(fixture('no_claim_review.html')) == []
+    assert [d.get('@type') for d in extract_json_ld(fixture('array.html'))] == ['BreadcrumbList', ['ClaimReview', 'Review']]
+    assert extract_json_ld(fixture('cdata.html'))[0]['text'] == 'a raw\ttab in a string'
+    ## str content
+    assert len(extract_json_ld(fixture('graph.html').decode('utf-8'))[0]['@graph']) == 3
+
+def test_malformed_falls_back_to_extruct():
+    assert extract_json_ld(fixture('malformed.html')) is None
+    parser = claim_review_parser()
+    calls = []
+    def extruct_json_ld(html, url):
+        calls.append(url)
+        return [{'@type': 'ClaimReview', 'claimReviewed': 'trailing comma', 'url': url}]
+    parser.extruct_json_ld = extruct_json_ld
+    cr = parser.parse_claim_review(fixture('malformed.html'), url('malformed.html'))
+    assert calls == [url('malformed.html')]
+    assert cr['claimReviewed'] == 'trailing comma'
+
+def test_parse_page():
+    assert parse_page(fixture('no_claim_review.html'), url('no_claim_review.html')) is None
+    assert parse_page(fixture('graph.html'), url('graph.html'))['fact_check_url'] == url('graph.html')
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 19:47:03 2021
+
+@author: jmr
+"""
+import time
+import pytest
+from google_fc_helpers.domain_cache import domain_capability_cache
+from fakes import fake_session, enrich
+
+DOMAIN = 'factcheck.example.org'
+
+class clock:
+    """ Settable replacement of time.time """
+    def __init__(self, now : float = 1000.0):
+        self.now = now
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def now(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(time, 'time', now)
+    return now
+
+def flag(cache : domain_capability_cache, domain : str = DOMAIN):
+    for _ in range(cache.min_misses):
+        cache.record(domain, has_claim_review = False)
+
+def test_flag_and_expiry(now):
+    cache = domain_capability_cache(ttl = 100, min_misses = 3)
+    cache.record(DOMAIN, has_claim_review = False)
+    cache.record(DOMAIN, has_claim_review = False)
+    ## a claim review resets the consecutive misses
+    cache.record(DOMAIN, has_claim_review = True)
+    cache.record(DOMAIN, has_claim_review = False)
+    assert cache.should_fetch(DOMAIN) and cache.flagged() == []
+    cache.record(DOMAIN, has_claim_review = False)
+    cache.record(DOMAIN, has_claim_review = False)
+    assert cache.flagged() == [DOMAIN]
+    assert not cache.should_fetch(DOMAIN)
+    assert cache.should_fetch('other.example.org')
+    now.now += 99
+    assert not cache.should_fetch(DOMAIN)
+    ## the flag expires: a single probe goes through and the ttl restarts
+    now.now += 2
+    assert cache.should_fetch(DOMAIN)
+    assert not cache.should_fetch(DOMAIN)
+    assert cache.stats == dict(skipped = 3, probed = 1, flagged = 1, cleared = 0)
+    now.now += 101
+    assert cache.should_fetch(DOMAIN)
+
+def test_probe(now):
+    cache = domain_capability_cache(ttl = 100, min_misses = 2)
+    flag(cache)
+    ## a probe without claim review keeps the domain flagged
+    now.now += 101
+    assert cache.should_fetch(DOMAIN)
+    cache.record(DOMAIN, has_claim_review = False)
+    assert cache.flagged() == [DOMAIN] and not cache.should_fetch(DOMAIN)
+    ## a probe with a claim review clears it
+    now.now += 101
+    assert cache.should_fetch(DOMAIN)
+    cache.record(DOMAIN, has_claim_review = True)
+    assert cache.flagged() == []
+    assert cache.should_fetch(DOMAIN) and cache.should_fetch(DOMAIN)
+    assert cache.stats['cleared'] == 1
+
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'domains.sqlite')
+    cache = domain_capability_cache(path, min_misses = 1)
+    flag(cache)
+    cache.close()
+    cache = domain_capability_cache(path)
+    assert not cache.should_fetch(DOMAIN)
+    cache.close()
+
+def test_scraper_learns_from_200s_only():
+    cache = domain_capability_cache(min_misses = 2)
+    ## server errors say nothing about the domain
+    errors = {f'https://{DOMAIN}/{n}' for n in range(3)}
+    session = fake_session(errors)
+    assert enrich([{'fact_check_url': url} for url in sorted(errors)], session, domain_cache = cache) == []
+    assert cache.flagged() == []
+    ## pages without claim review do
+    claims = [{'fact_check_url': f'https://{DOMAIN}/{n}/none'} for n in range(2)]
+    enrich(claims, session, domain_cache = cache)
+    assert cache.flagged() == [DOMAIN]
+    ## then the domain's pages are no longer fetched
+    session.requested = []
+    assert enrich([{'fact_check_url': f'https://{DOMAIN}/5'}], session, domain_cache = cache) == []
+    assert session.requested == []
+    ## a page with a claim review, once the flag expired, clears it
+    cache.ttl = 0
+    assert len(enrich([{'fact_check_url': f'https://{DOMAIN}/5'}], session, domain_cache = cache)) == 1
+    assert cache.flagged() == []
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 11:02:17 2021
+
+@author: jmr
+"""
+import pickle
+import pytest
+from google_fc_helpers.extraction_schema import parse_path, compile_path, get_candidate_value, API_SCHEMA
+
+CLAIM = {
+    'text': 'the moon is made of cheese',
+    'claimant': 'social media',
+    'claimDate': '2021-01-06T18:16:03Z',
+    'claimReview': [{
+        'publisher': {'name': 'Fact Check', 'site': 'factcheck.example.org'},
+        'url': 'https://factcheck.example.org/moon',
+        'title': 'No, the moon is not made of cheese',
+        'languageCode': 'en'
+        }]
+    }
+
+def test_parse_path():
+    assert parse_path('url') == ('url',)
+    assert parse_path('["author"]["sameAs"][0]') == ('author', 'sameAs', 0)
+    assert parse_path(" ['site'] ") == ('site',)
+    assert parse_path('["a"][-1]') == ('a', -1)
+    with pytest.raises(ValueError):
+        parse_path('["a"]x["b"]')
+
+def test_compile_path():
+    d = {'a': [{'b': 1}, {'c': [10, 20]}], 'e': ''}
+    assert compile_path('["a"][0]["b"]')(d) == 1
+    ## a key on a list selects the first element holding it
+    assert compile_path(('a', 'c', 1))(d) == 20
+    assert compile_path(('a', 5))(d) is None
+    assert compile_path(('a', 'missing'))(d) is None
+    ## an index on a dict, or a step below a leaf
+    assert compile_path(('a', 0, 0))(d) is None
+    assert compile_path(('e', 'f'))(d) is None
+
+def test_get_candidate_value():
+    ## same semantics as the former eval based lookup of candidate_expressions on d
+    cr = CLAIM['claimReview'][0]
+    assert get_candidate_value(cr, 'publisher_site', ['["publisher"]["site"]', "['site']"]) == 'factcheck.example.org'
+    assert get_candidate_value({'site': 'a.org'}, 'publisher_site', ['["publisher"]["site"]', "['site']"]) == 'a.org'
+    ## the key wins over the candidates
+    assert get_candidate_value({'publisher_site': 'b.org', 'site': 'a.org'}, 'publisher_site', ["['site']"]) == 'b.org'
+    ## empty values and invalid expressions are skipped
+    assert get_candidate_value({'site': '', 'name': 'n'}, 'x', ["['site']", '["a"]x', "['name']"]) == 'n'
+    assert get_candidate_value({'site': []}, 'x', ["['site']"]) is None
+    assert get_candidate_value(None, 'x', ["['site']"]) is None
+
+def test_api_schema():
+    assert API_SCHEMA.extract(CLAIM) == dict(
+        claim_reviewed = 'the moon is made of cheese',
+        claimant = 'social media',
+        claim_date = '2021-01-06T18:16:03Z',
+        fact_check_url = 'https://factcheck.example.org/moon',
+        fact_check_domain = 'factcheck.example.org',
+        fact_check_author_name = 'Fact Check',
+        fact_check_title = 'No, the moon is not made of cheese',
+        fact_check_language_code = 'en'
+        )
+    ## fallback path when the publisher has no site
+    claim = {'claimReview': [{'site': 'other.example.org', 'publisher': {'name': 'Other'}}]}
+    assert API_SCHEMA.extract(claim)['fact_check_domain'] == 'other.example.org'
+
+def test_api_schema_several_reviews():
+    ## every field comes from the first review, even when a later one holds a value the first lacks
+    claim = {'text': 'the moon is made of cheese', 'claimReview': [
+        {'publisher': {'name': 'Fact Check', 'site': 'factcheck.example.org'}, 'url': 'https://factcheck.example.org/moon', 'languageCode': 'en'},
+        {'publisher': {'name': 'Other', 'site': 'other.example.org'}, 'url': 'https://other.example.org/moon', 'title': 'Moon cheese', 'languageCode': 'fr'}
+        ]}
+    out = API_SCHEMA.extract(claim)
+    assert out['fact_check_url'] == 'https://factcheck.example.org/moon'
+    assert out['fact_check_domain'] == 'factcheck.example.org'
+    assert out['fact_check_title'] is None
+    assert out['fact_check_language_code'] == 'en'
+
+def test_schema_fields():
+    schema = API_SCHEMA.copy()
+    schema.add_field('publisher_name', '["claimReview"][0]["publisher"]["name"]')
+    schema.add_field('claimant', ('text',))
+    out = schema.extract(CLAIM)
+    assert out['publisher_name'] == 'Fact Check'
+    assert out['claimant'] == CLAIM['text']
+    assert list(out)[-1] == 'publisher_name'
+    ## the default schema is left untouched
+    assert 'publisher_name' not in API_SCHEMA.extract(CLAIM)
+    ## accessors are recompiled after pickling, e.g. in a process pool
+    assert pickle.loads(pickle.dumps(schema)).extract(CLAIM) == out
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 16:22:37 2021
+
+@author: jmr
+"""
+import time
+import pytest
+from google_fc_helpers.http_cache import http_cache
+from fakes import fake_response, page_html
+
+URL = 'https://factcheck.example.org/1'
+
+class clock:
+    """ Settable replacement of time.time """
+    def __init__(self, now : float = 1000.0):
+        self.now = now
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def now(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(time, 'time', now)
+    return now
+
+def page(n : int = 1, status_code : int = 200, **headers):
+    return fake_response(status_code, content = page_html(n), headers = headers)
+
+def test_ttl(tmp_path, now):
+    pytest.importorskip('requests')
+    cache = http_cache(str(tmp_path / 'cache.sqlite'), ttl = 60)
+    cache.store(URL, page(ETag = '"v1"'))
+    now.now += 59
+    cached, entry = cache.lookup(URL)
+    assert cached.from_cache and cached.content == page_html(1)
+    assert cache.stats['hits'] == 1
+    ## stale entries are returned for revalidation only
+    now.now += 2
+    cached, entry = cache.lookup(URL)
+    assert cached is None and entry['etag'] == '"v1"'
+    assert cache.lookup('https://factcheck.example.org/2') == (None, None)
+    cache.close()
+
+def test_conditional_headers(tmp_path, now):
+    cache = http_cache(str(tmp_path / 'cache.sqlite'), ttl = 0)
+    cache.store(URL, page(**{'ETag': '"v1"', 'Last-Modified': 'Sat, 20 Feb 2021 10:00:00 GMT', 'Content-Encoding': 'gzip'}))
+    _, entry = cache.lookup(URL)
+    assert cache.conditional_headers(entry) == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Sat, 20 Feb 2021 10:00:00 GMT'}
+    assert 'Content-Encoding' not in entry['headers']
+    cache.store(URL, page())
+    _, entry = cache.lookup(URL)
+    assert cache.conditional_headers(entry) == {}
+    assert cache.conditional_headers(None) == {}
+    cache.close()
+
+def test_not_modified_refresh(tmp_path, now):
+    pytest.importorskip('requests')
+    cache = http_cache(str(tmp_path / 'cache.sqlite'), ttl = 60)
+    cache.store(URL, page(ETag = '"v1"'))
+    now.now += 120
+    sent = []
+    def send(headers):
+        sent.append(headers)
+        return fake_response(304)
+    ## a 304 serves the stored page and restarts its ttl
+    response = cache.fetch(URL, send)
+    assert sent == [{'If-None-Match': '"v1"'}]
+    assert response.status_code == 200 and response.content == page_html(1)
+    assert cache.stats['revalidated'] == 1
+    now.now += 30
+    assert cache.fetch(URL, send).from_cache
+    assert len(sent) == 1
+    ## a changed page replaces the entry, an error leaves it untouched
+    now.now += 120
+    response = cache.fetch(URL, lambda headers: page(2, ETag = '"v2"'))
+    assert response.content == page_html(2)
+    now.now += 120
+    assert cache.fetch(URL, lambda headers: page(3, 500)).status_code == 500
+    _, entry = cache.lookup(URL)
+    assert entry['etag'] == '"v2"' and entry['content'] == page_html(2)
+    assert cache.stats['misses'] == 2
+    cache.close()
+
+def test_lru_evict(tmp_path, now):
+    size = len(page_html(1))
+    path = str(tmp_path / 'cache.sqlite')
+    cache = http_cache(path, ttl = 0, max_size = 3 * size)
+    for n in range(3):
+        now.now += 1
+        cache.store(f'https://factcheck.example.org/{n}', page(n))
+    ## reading the oldest entry makes it the most recently used, the batched access time is flushed before evicting
+    now.now += 1
+    assert cache.lookup('https://factcheck.example.org/0')[1] is not None
+    now.now += 1
+    cache.store('https://factcheck.example.org/3', page(3))
+    assert cache.stats['evicted'] == 1
+    assert cache.lookup('https://factcheck.example.org/1') == (None, None)
+    assert all(cache.lookup(f'https://factcheck.example.org/{n}')[1] is not None for n in (0, 2, 3))
+    cache.close()
+    ## the size is restored when reopening
+    cache = http_cache(path, ttl = 0, max_size = 3 * size)
+    assert cache._size == 3 * size
+    cache.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 18:31:09 2021
+
+@author: jmr
+"""
+import pytest
+from google_fc_helpers.instrumentation import histogram
+
+def test_quantile_within_bucket():
+    ## every observation in the first bucket, the percentiles are spread between min and max
+    h = histogram(buckets = (0.005, 0.01))
+    for i in range(1, 101):
+        h.observe(i / 100000)
+    assert h.quantile(0.5) == pytest.approx(0.0005, rel = 0.02)
+    assert h.quantile(0.9) == pytest.approx(0.0009, rel = 0.02)
+    assert h.quantile(0) == h.min
+    assert h.quantile(1) == h.max
+
+def test_quantile_across_buckets():
+    h = histogram(buckets = (1, 2, 4))
+    for value in [0.5] * 50 + [3] * 50:
+        h.observe(value)
+    assert 0.5 <= h.quantile(0.25) < h.quantile(0.5) <= 1
+    assert 2 < h.quantile(0.9) < 3
+    ## above the last bucket
+    h.observe(100)
+    assert h.quantile(1) == 100
+    assert histogram().quantile(0.5) is None
+
+def test_sub_millisecond_buckets():
+    h = histogram()
+    for value in (0.0002, 0.0003, 0.0004, 0.002):
+        h.observe(value)
+    assert h.summary()['p50'] < 0.0005
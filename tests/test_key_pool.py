@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 12:48:33 2021
+
+@author: jmr
+"""
+import time
+import pytest
+from google_fc_helpers.key_pool import key_pool, quota_exhausted_error, mask
+from google_fc_helpers.instrumentation import metrics_registry
+from fakes import fake_response
+
+def pool(keys : list, **kwargs):
+    return key_pool(keys, metrics = metrics_registry(), **kwargs)
+
+def test_spreads_calls():
+    keys = pool(['test-key-a', 'test-key-b'])
+    used = [keys.acquire() for _ in range(4)]
+    assert sorted(used) == ['test-key-a', 'test-key-a', 'test-key-b', 'test-key-b']
+
+def test_failover_on_429():
+    keys = pool(['test-key-a', 'test-key-b'], cooldown = 60)
+    first = keys.acquire()
+    keys.release(first, fake_response(429, text = 'Too many requests'))
+    ## the throttled key is set aside, the calls go to the other one
+    other = [keys.acquire() for _ in range(3)]
+    assert first not in other
+    assert keys.usage()[mask(first)]['throttled'] == 1
+    assert keys.usage()[mask(first)]['cooling_down'] > 0
+
+def test_retry_after():
+    keys = pool(['test-key-a'], cooldown = 60, max_wait = 5)
+    key = keys.acquire()
+    keys.release(key, fake_response(429, headers = {'Retry-After': '0.2'}))
+    assert not keys.available()
+    ## acquire waits for the cooldown
+    start = time.time()
+    assert keys.acquire() == key
+    assert time.time() - start >= 0.1
+
+def test_quota_exhausted():
+    keys = pool(['test-key-a', dict(key = 'test-key-b', daily_quota = 2)], max_wait = 1)
+    ## a 429 mentioning the daily quota sets the key aside until the next day
+    keys.release('test-key-a', fake_response(429, text = 'Quota exceeded for quota metric Queries per day'))
+    assert [keys.acquire() for _ in range(2)] == ['test-key-b', 'test-key-b']
+    assert keys.usage()[mask('test-key-b')]['remaining_today'] == 0
+    assert keys.usage()[mask('test-key-a')]['exhausted'] == 1
+    assert not keys.available()
+    with pytest.raises(quota_exhausted_error):
+        keys.acquire()
+
+def test_mask():
+    ## short keys are told apart, long keys keep their first characters only
+    assert mask('abc') != mask('abd')
+    assert mask('AIzaSyExampleKey123').startswith('AIza...')
+    assert 'Key123' not in mask('AIzaSyExampleKey123')
+    keys = pool(['k1', 'k2'])
+    assert len(keys.usage()) == 2
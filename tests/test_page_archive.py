@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 13:21:40 2021
+
+@author: jmr
+"""
+from google_fc_helpers.page_archive import page_archive, reparse, reparse_claims
+from fakes import page_html, fake_session, enrich
+
+NO_CLAIM_REVIEW = b'<html><body>no claim review</body></html>'
+
+def fill(path : str, n : int = 10):
+    with page_archive(path, codec = 'zlib') as archive:
+        for i in range(n):
+            archive.append(f'https://factcheck.example.org/{i}', page_html(i) if i % 2 == 0 else NO_CLAIM_REVIEW)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'pages.gfa')
+    fill(path)
+    with page_archive(path) as archive:
+        assert len(archive) == 10
+        assert 'https://factcheck.example.org/3' in archive
+        assert 'https://factcheck.example.org/10' not in archive
+        assert archive.get('https://factcheck.example.org/4') == page_html(4)
+        assert archive.get('https://factcheck.example.org/10') is None
+        ## archiving a url again points the index to the new page
+        archive.append('https://factcheck.example.org/4', NO_CLAIM_REVIEW)
+        assert archive.get('https://factcheck.example.org/4') == NO_CLAIM_REVIEW
+        assert len(archive) == 10
+    with page_archive(path, readonly = True) as archive:
+        pages = dict(archive.items())
+    assert len(pages) == 10
+    assert pages['https://factcheck.example.org/4'] == NO_CLAIM_REVIEW
+    assert pages['https://factcheck.example.org/2'] == page_html(2)
+
+def test_sync(tmp_path):
+    path = str(tmp_path / 'pages.gfa')
+    archive = page_archive(path, codec = 'zlib')
+    archive.append('https://factcheck.example.org/0', page_html(0))
+    archive.sync()
+    ## visible to another reader before the archive is closed
+    with page_archive(path, readonly = True) as reader:
+        assert reader.get('https://factcheck.example.org/0') == page_html(0)
+    archive.close()
+
+def test_reparse(tmp_path):
+    path = str(tmp_path / 'pages.gfa')
+    fill(path)
+    out = dict(reparse(path, workers = 2, chunk_size = 3))
+    assert len(out) == 10
+    assert out['https://factcheck.example.org/1'] is None
+    assert out['https://factcheck.example.org/2']['claim_reviewed'] == 'claim 2'
+    claims = [{'fact_check_url': f'https://factcheck.example.org/{i}', 'query': 'covid'} for i in (0, 1, 2, 11)]
+    records = list(reparse_claims(claims, path, workers = 1))
+    assert [r['claim_reviewed'] for r in records] == ['claim 0', 'claim 2']
+    assert records[0]['query'] == 'covid'
+
+def test_reparse_failures(tmp_path):
+    ## a claim review block which cannot be decoded, nor parsed by the fallback, is skipped rather than emitted as a bare url
+    path = str(tmp_path / 'pages.gfa')
+    with page_archive(path, codec = 'zlib') as archive:
+        archive.append('https://factcheck.example.org/0', page_html(0))
+        archive.append('https://factcheck.example.org/1', b'<script type="application/ld+json">{"@type": "ClaimReview", </script>')
+    out = dict(reparse(path, workers = 1))
+    assert out['https://factcheck.example.org/1'] is None
+    claims = [{'fact_check_url': f'https://factcheck.example.org/{i}'} for i in (0, 1)]
+    assert [r['fact_check_url'] for r in reparse_claims(claims, path, workers = 1)] == ['https://factcheck.example.org/0']
+
+def test_scraper_archive(tmp_path):
+    path = str(tmp_path / 'pages.gfa')
+    archive = page_archive(path, codec = 'zlib')
+    archive.commit_every = 1000
+    claims = [{'fact_check_url': f'https://factcheck.example.org/{i}'} for i in range(3)]
+    failed = claims[1]['fact_check_url']
+    enrich(claims, fake_session(errors = {failed}), archive = archive)
+    ## closing the client commits the archived pages, error pages are not archived
+    with page_archive(path, readonly = True) as reader:
+        assert sorted(url for url, _, _, _ in reader.entries()) == [claims[0]['fact_check_url'], claims[2]['fact_check_url']]
+    archive.close()
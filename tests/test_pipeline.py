@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 20:26:54 2021
+
+@author: jmr
+"""
+import asyncio
+import json
+import time
+import pytest
+from google_fc_helpers.async_wrapper import async_claim_search
+from google_fc_helpers.async_scraper import claim_review_client
+from google_fc_helpers.pipeline import claim_pipeline
+from google_fc_helpers.seen_index import seen_claim_index
+from google_fc_helpers.instrumentation import metrics_registry
+from fakes import fake_response, fake_session
+
+class stub_search(async_claim_search):
+    """ async_claim_search answering pages of two claims, whose fact check pages are served by fake_session """
+    def request_page(self, querystring : dict, verbose = True, max_retries = None, requests_per_second = None, back_off = None):
+        page = int(querystring.get('pageToken') or 0)
+        self.calls.append(page)
+        time.sleep(self.latency)
+        if page in self.fail_pages:
+            raise ValueError(f'api error on page {page}')
+        claims = [{'text': f'claim {2 * page + i}', 'claimReview': [{'url': f'https://factcheck.example.org/{2 * page + i}'}]} for i in range(2)]
+        body = {'claims': claims}
+        if page + 1 < self.pages:
+            body['nextPageToken'] = str(page + 1)
+        return fake_response(text = json.dumps(body))
+
+class stub_client(claim_review_client):
+    def session(self):
+        return self.fake_session
+
+def pipeline(pages : int = 5, latency : float = 0.0, fail_pages : tuple = (), errors : set = (), **kwargs):
+    search = stub_search({'key': 'test-key', 'query': 'covid', 'languageCode': 'en', 'reviewPublisherSiteFilter': None}, metrics = metrics_registry(), calls = [], pages = pages, latency = latency, fail_pages = fail_pages)
+    client = stub_client(metrics = metrics_registry(), fake_session = fake_session(set(errors)), max_concurrency = 2)
+    return claim_pipeline(search, client = client, max_workers = 1, **kwargs)
+
+def collect(pipe, timeout : float = 10):
+    return asyncio.run(asyncio.wait_for(pipe.collect(), timeout))
+
+def test_streams_records():
+    pipe = pipeline(pages = 5, latency = 0.02)
+    async def first():
+        async for record in pipe.run():
+            ## the first enriched record comes out while the api is still paginating
+            return len(pipe.search.calls)
+    assert asyncio.run(first()) < 5
+    pipe = pipeline(pages = 5)
+    records = collect(pipe)
+    assert sorted(r['claim_reviewed'] for r in records) == sorted(f'claim {n}' for n in range(10))
+    assert pipe.stats['claims'] == pipe.stats['records'] == 10
+    assert pipe.stats['first_record_seconds'] <= pipe.stats['elapsed']
+
+def test_backpressure():
+    pipe = pipeline(pages = 30, queue_size = 2)
+    async def stalled_consumer():
+        async for record in pipe.run():
+            ## the consumer stalls, the stages stop once their queues are full
+            await asyncio.sleep(0.3)
+            return pipe.stats['claims']
+    ## claims queue, scrapers, records queue, the record held by the consumer and the claim the api stage waits to queue
+    assert asyncio.run(stalled_consumer()) <= 2 + 2 + 2 + 1 + 1
+    ## the api stage is bounded by its own page queue, far from the 60 claims
+    assert pipe.stats['claims'] < 60
+
+def test_api_error():
+    pipe = pipeline(pages = 5, fail_pages = (2,))
+    with pytest.raises(ValueError, match = 'api error on page 2'):
+        collect(pipe)
+
+def test_scraper_error():
+    class failing_client(stub_client):
+        async def enrich_claim(self, claim_dict : dict):
+            if claim_dict['fact_check_url'].endswith('/3'):
+                raise RuntimeError('scraper error')
+            return await super().enrich_claim(claim_dict)
+    pipe = pipeline(pages = 30, queue_size = 2)
+    pipe.client = failing_client(metrics = metrics_registry(), fake_session = fake_session(set()), max_concurrency = 2)
+    with pytest.raises(RuntimeError, match = 'scraper error'):
+        collect(pipe)
+
+def test_resume_marks_seen(tmp_path):
+    checkpoint = str(tmp_path / 'ck.sqlite')
+    failed = 'https://factcheck.example.org/3'
+    assert len(collect(pipeline(pages = 3, errors = {failed}, checkpoint = checkpoint))) == 5
+    ## the resumed run only fetches the failed page, and marks every claim done with as processed
+    index = seen_claim_index(str(tmp_path / 'seen.sqlite'))
+    pipe = pipeline(pages = 3, checkpoint = checkpoint, resume = True, seen_index = index)
+    assert len(collect(pipe)) == 6
+    assert pipe.client.fake_session.requested == [failed]
+    assert pipe.stats['resumed'] == 5
+    assert len(index) == 6
+    index.close()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 12:15:09 2021
+
+@author: jmr
+"""
+import time
+from google_fc_helpers.planner import query_planner, normalize_combination
+
+QUERY = {'pageSize': 10, 'maxAgeDays': 30}
+
+def test_normalize_combination():
+    assert normalize_combination(('  covid   vaccine ', 'en', 'https://FactCheck.org/')) == ('covid vaccine', 'en', 'factcheck.org')
+    assert normalize_combination(('', 'en', None)) == (None, 'en', None)
+
+def test_plan_dedupes():
+    planner = query_planner()
+    plan = planner.plan([('covid', 'en', None), (' covid', 'en', None), ('covid', 'pt', None)], QUERY)
+    assert [pars for pars, _ in plan] == [('covid', 'en', None), ('covid', 'pt', None)]
+    ## nothing is known yet, the query parameters are kept
+    assert all(overrides == dict(pageSize = 10, maxAgeDays = 30) for _, overrides in plan)
+    assert planner.stats['requested'] == 3
+    assert planner.stats['unique'] == 2
+
+def test_page_size():
+    planner = query_planner()
+    pars = ('covid', 'en', None)
+    planner.plan([pars], QUERY)
+    planner.record(pars, claims = 40, pages = 4, complete = True)
+    assert planner.plan([pars], QUERY)[0][1]['pageSize'] == 50
+    planner.record(pars, claims = 1000, pages = 10, complete = True)
+    assert planner.plan([pars], QUERY)[0][1]['pageSize'] == planner.max_page_size
+    ## an incomplete run does not update the result count
+    planner.record(pars, claims = 2, pages = 1, complete = False)
+    assert planner.plan([pars], QUERY)[0][1]['pageSize'] == planner.max_page_size
+
+def test_empty_runs_skip():
+    planner = query_planner(empty_runs = 2, sample_every = 3)
+    empty, full = ('nothing', 'en', None), ('covid', 'en', None)
+    issued = []
+    for _ in range(8):
+        plan = planner.plan([empty, full], QUERY)
+        issued.append(empty in [pars for pars, _ in plan])
+        for pars, _ in plan:
+            planner.record(pars, claims = 0 if pars == empty else 10, pages = 1, complete = True)
+    ## issued until empty in 2 runs in a row, then only sampled once every 3 runs
+    assert issued == [True, True, False, False, True, False, False, True]
+    assert planner.stats['skipped'] == 0
+    ## a non empty result brings it back
+    planner.record(empty, claims = 5, pages = 1, complete = True)
+    assert empty in [pars for pars, _ in planner.plan([empty], QUERY)]
+
+def test_delta_max_age_days():
+    planner = query_planner(delta = True)
+    pars = ('covid', 'en', None)
+    assert planner.plan([pars], QUERY)[0][1]['maxAgeDays'] == 30
+    planner.record(pars, claims = 10, pages = 1, complete = True)
+    ## last complete run 3 days ago, plus a day of overlap
+    planner._con.execute('UPDATE history SET last_success = ?', (time.time() - 3 * 86400 + 60,))
+    assert planner.plan([pars], QUERY)[0][1]['maxAgeDays'] == 4
+    ## never wider than the requested window
+    planner._con.execute('UPDATE history SET last_success = ?', (time.time() - 90 * 86400,))
+    assert planner.plan([pars], QUERY)[0][1]['maxAgeDays'] == 30
+    ## without delta the requested window is kept
+    planner.delta = False
+    assert planner.plan([pars], QUERY)[0][1]['maxAgeDays'] == 30
+
+def test_history_persists(tmp_path):
+    path = str(tmp_path / 'planner.sqlite')
+    pars = ('covid', 'en', None)
+    planner = query_planner(path)
+    planner.plan([pars], QUERY)
+    planner.record(pars, claims = 24, pages = 3, complete = True)
+    planner.close()
+    planner = query_planner(path)
+    plan = planner.plan([pars], QUERY)
+    assert planner.run == 2
+    assert plan[0][1]['pageSize'] == 30
+    assert planner.history(pars)['last_pages'] == 3
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 14:05:48 2021
+
+@author: jmr
+"""
+import time
+import json
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import pytest
+from google_fc_helpers.retry import retry_policy, circuit_open_error
+from google_fc_helpers.instrumentation import metrics_registry
+from fakes import fake_response
+
+URL = 'https://factcheck.example.org/page'
+
+def policy(**kwargs):
+    kwargs = {'base_delay': 0.001, 'max_delay': 0.01, 'jitter': False, 'failure_threshold': 3, 'reset_timeout': 0.05, 'metrics': metrics_registry(), **kwargs}
+    return retry_policy(**kwargs)
+
+def test_circuit_opens():
+    retry = policy()
+    for _ in range(2):
+        retry.record_failure(URL)
+    retry.check_circuit(URL)
+    retry.record_failure(URL)
+    with pytest.raises(circuit_open_error):
+        retry.check_circuit(URL)
+    ## per host
+    retry.check_circuit('https://other.example.org/page')
+    assert retry.stats['circuit_open'] == 1
+
+def test_success_resets_failures():
+    retry = policy()
+    for _ in range(2):
+        retry.record_failure(URL)
+    retry.record_success(URL)
+    for _ in range(2):
+        retry.record_failure(URL)
+    retry.check_circuit(URL)
+
+def test_half_open_single_probe():
+    retry = policy()
+    for _ in range(3):
+        retry.record_failure(URL)
+    time.sleep(0.06)
+    ## one trial request goes through, the concurrent callers are still short-circuited
+    retry.check_circuit(URL)
+    with pytest.raises(circuit_open_error):
+        retry.check_circuit(URL)
+    ## a failed trial reopens the circuit
+    retry.record_failure(URL)
+    with pytest.raises(circuit_open_error):
+        retry.check_circuit(URL)
+    ## a successful one closes it
+    time.sleep(0.06)
+    retry.check_circuit(URL)
+    retry.record_success(URL)
+    retry.check_circuit(URL)
+    retry.check_circuit(URL)
+
+def test_half_open_lost_probe():
+    retry = policy()
+    for _ in range(3):
+        retry.record_failure(URL)
+    time.sleep(0.06)
+    retry.check_circuit(URL)
+    ## the trial request never reported back, another one is let through after reset_timeout
+    time.sleep(0.06)
+    retry.check_circuit(URL)
+
+def test_retry_after():
+    assert retry_policy.retry_after(fake_response(429, headers = {'Retry-After': '7'})) == 7
+    assert retry_policy.retry_after(fake_response(429)) is None
+    assert retry_policy.retry_after(fake_response(429, headers = {'Retry-After': 'soon'})) is None
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds = 30), usegmt = True)
+    assert 25 < retry_policy.retry_after(fake_response(503, headers = {'Retry-After': date})) <= 30
+    ## Retry-After wins over the back off, within max_delay
+    retry = policy(max_delay = 60)
+    assert retry.delay(1, fake_response(429, headers = {'Retry-After': '7'})) == 7
+    assert retry.delay(1, fake_response(429, headers = {'Retry-After': '600'})) == 60
+
+def test_back_off():
+    retry = policy(base_delay = 1, max_delay = 60, back_off = 2)
+    assert [retry.delay(n) for n in (1, 2, 3)] == [1, 4, 9]
+    assert retry.delay(3, back_off = 1) == 3
+    assert retry.delay(100) == 60
+    retry.jitter = True
+    assert all(4.5 <= retry.delay(3) <= 9 for _ in range(20))
+
+def test_request_retries():
+    pytest.importorskip('requests')
+    retry = policy(max_retries = 5)
+    responses = iter([fake_response(503), fake_response(429, headers = {'Retry-After': '0'}), fake_response(200)])
+    assert retry.request(lambda: next(responses), URL).status_code == 200
+    assert retry.stats['requests'] == 3
+    assert retry.stats['retries'] == 2
+    ## non retryable statuses are returned at once
+    assert retry.request(lambda: fake_response(404), URL).status_code == 404
+    ## out of retries, the last response is returned
+    assert retry.request(lambda: fake_response(500), URL, max_retries = 2).status_code == 500
+
+def test_throttling_does_not_open_circuit():
+    pytest.importorskip('requests')
+    retry = policy(failure_threshold = 2)
+    for _ in range(5):
+        assert retry.request(lambda: fake_response(429, headers = {'Retry-After': '0'}), URL, max_retries = 3).status_code == 429
+    retry.check_circuit(URL)
+    assert retry.stats['failures'] == 0
+    ## server errors do
+    retry.request(lambda: fake_response(503), URL, max_retries = 2)
+    with pytest.raises(circuit_open_error):
+        retry.check_circuit(URL)
+
+def test_open_circuit_marks_combination_incomplete(tmp_path):
+    pytest.importorskip('requests')
+    from google_fc_helpers.google_fc_wrapper import claim_search
+    from google_fc_helpers.checkpoint import checkpoint_store
+    pages = iter([fake_response(text = json.dumps({'claims': [{'text': 'a', 'claimReview': [{'url': 'https://factcheck.example.org/a'}]}], 'nextPageToken': '1'}))])
+    class stub_search(claim_search):
+        def sender(self, querystring : dict, requests_per_second : float = None):
+            return lambda: next(pages, fake_response(503))
+    cs = stub_search({'key': 'test-key', 'query': 'covid', 'languageCode': 'en', 'reviewPublisherSiteFilter': None}, metrics = metrics_registry(), retry = policy(failure_threshold = 1, max_retries = 3, reset_timeout = 60))
+    path = str(tmp_path / 'ck.sqlite')
+    out = cs.run_query(checkpoint = path)
+    ## the first page is kept, the truncation is reported and the checkpoint is resumable
+    assert len(out) == 1
+    assert cs.incomplete == [('covid', 'en', None)]
+    state = checkpoint_store(path).combination(('covid', 'en', None))
+    assert not state['done'] and state['page_token'] == '1'
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 20 19:12:26 2021
+
+@author: jmr
+"""
+import json
+import pytest
+from google_fc_helpers.google_fc_wrapper import claim_search
+from google_fc_helpers.instrumentation import metrics_registry
+from google_fc_helpers.sharding import parse_shard, combination_in_shard, claim_in_shard, merge_shards, iter_records
+from google_fc_helpers.sinks import jsonl_sink, json_sink, csv_sink
+
+QUERY = {'key': 'test-key', 'query': ['covid', 'vaccine', 'election', '5g', 'moon'], 'languageCode': ['en', 'pt', 'es', 'de'], 'reviewPublisherSiteFilter': [None, 'factcheck.example.org']}
+
+def test_parse_shard():
+    assert parse_shard('1/4') == (1, 4)
+    assert parse_shard((0, 1)) == (0, 1)
+    assert parse_shard(None) is None
+    for shard in ('4/4', '-1/4', '1/0', 'a/b', '1'):
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+def test_shards_partition_combinations():
+    cs = claim_search(dict(QUERY), metrics = metrics_registry())
+    combinations = cs.combinations()
+    shards = [[pars for pars, _ in cs.plan(shard = f'{i}/4')[0]] for i in range(4)]
+    ## disjoint and covering
+    assert set().union(*shards) == set(combinations)
+    assert sum(len(s) for s in shards) == len(combinations)
+    assert all(len(s) > 0 for s in shards)
+    ## stable
+    assert all(combination_in_shard(pars, (i, 4)) for i, shard in enumerate(shards) for pars in shard)
+    ## a single shard holds everything
+    assert all(combination_in_shard(pars, '0/1') and combination_in_shard(pars, None) for pars in combinations)
+
+def test_claims_partition():
+    claims = [{'fact_check_url': f'https://factcheck.example.org/{n}'} for n in range(50)]
+    assert sorted(sum(claim_in_shard(c, (i, 3)) for i in range(3)) for c in claims) == [1] * 50
+    ## the normalized url decides
+    assert claim_in_shard({'fact_check_url': 'https://FactCheck.example.org/1/'}, (0, 3)) == claim_in_shard(claims[1], (0, 3))
+
+def record(query : str, n : int, url : str = None):
+    return {'query': query, 'languageCode': 'en', 'reviewPublisherSiteFilter': None, 'fact_check_url': url or f'https://factcheck.example.org/{n}', 'claim_reviewed': f'{query} {n}'}
+
+def write(path, records, sink = jsonl_sink):
+    with sink(str(path)) as s:
+        s.consume(records)
+    return str(path)
+
+def test_merge(tmp_path):
+    shard_0 = write(tmp_path / 'shard_0.jsonl', [record('covid', 1), record('covid', 2), record('vaccine', 1)])
+    ## the same fact check under another url form, and a record found by another combination
+    shard_1 = write(tmp_path / 'shard_1.json', [record('covid', 1, 'https://factcheck.example.org/1/'), record('moon', 2)], sink = json_sink)
+    shard_2 = write(tmp_path / 'shard_2.csv', [record('covid', 2)], sink = csv_sink)
+    output = str(tmp_path / 'merged.jsonl')
+    assert merge_shards([shard_0, shard_1, shard_2], output) == 4
+    merged = list(iter_records(output))
+    assert [(r['query'], r['claim_reviewed']) for r in merged] == [('covid', 'covid 1'), ('covid', 'covid 2'), ('vaccine', 'vaccine 1'), ('moon', 'moon 2')]
+    ## one record per fact check url, the first occurrence wins
+    assert merge_shards([shard_0, shard_1, shard_2], output, by_url = True) == 2
+    assert [r['claim_reviewed'] for r in iter_records(output)] == ['covid 1', 'covid 2']
+
+def test_merge_empty_and_missing_shards(tmp_path):
+    shard_0 = write(tmp_path / 'shard_0.jsonl', [record('covid', 1)])
+    empty = [write(tmp_path / f'empty.{ext}', [], sink = sink) for ext, sink in (('jsonl', jsonl_sink), ('json', json_sink), ('csv', csv_sink))]
+    (tmp_path / 'truncated.json').write_text('')
+    output = str(tmp_path / 'merged.json')
+    assert merge_shards([shard_0, *empty, str(tmp_path / 'truncated.json'), str(tmp_path / 'missing.jsonl')], output) == 1
+    assert json.load(open(output))[0]['claim_reviewed'] == 'covid 1'
+
+def test_merge_empty_parquet_shard(tmp_path):
+    pytest.importorskip('pyarrow')
+    from google_fc_helpers.sinks import parquet_sink
+    shard_0 = write(tmp_path / 'shard_0.parquet', [record('covid', 1)], sink = parquet_sink)
+    empty = write(tmp_path / 'empty.parquet', [], sink = parquet_sink)
+    assert merge_shards([shard_0, empty], str(tmp_path / 'merged.jsonl')) == 1